@@ -0,0 +1,726 @@
+"""
+Online counterparts to the agate aggregations listed in cmk.aggs.Aggregates
+
+Where an agate.Aggregation is handed a whole (grouped) table, an Accumulator is
+handed one row's value(s) at a time, and keeps only as much state as its aggregation needs.
+"""
+from array import array
+import datetime
+from decimal import Context, Decimal, MAX_EMAX, MAX_PREC, MIN_EMIN, localcontext
+from functools import partial
+import math
+from typing import (
+    Callable as CallableType,
+    List as ListType,
+    NoReturn as NoReturnType,
+    Optional as OptionalType,
+    Sequence as SequenceType,
+    Tuple as TupleType,
+)
+
+from csvmedkit import agate
+from csvmedkit.cmk.floats import CompensatedSum, Float, float_result, float_stdev
+from csvmedkit.cmk.sketches import (
+    DEFAULT_COUNTERS,
+    DEFAULT_HLL_PRECISION,
+    DEFAULT_SKETCH_SIZE,
+    HyperLogLog,
+    KLLSketch,
+    SpaceSaving,
+)
+
+# subsequences of no more than this many values are sorted, rather than partitioned further
+SELECT_CUTOFF = 32
+
+# a decimal context with room for any sum or product of the input values, so nothing computed in it is rounded
+EXACT_CONTEXT = Context(prec=MAX_PREC, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+
+def percentile_ranks(n: int, p) -> TupleType[int, int]:
+    """
+    The (0-based) ranks of the one or two values of n whose mean is the p-th (0 to 100) percentile,
+    the same way that agate.aggregations.Percentiles calculates it
+    """
+    k = n * (float(p) / 100)
+    low = max(1, int(math.ceil(k)))
+    high = min(n, int(math.floor(k + 1)))
+    return low - 1, high - 1
+
+
+def percentile(data: SequenceType, p) -> object:
+    """The p-th (0 to 100) percentile of a sorted, non-empty sequence"""
+    low, high = percentile_ranks(len(data), p)
+    if low == high:
+        return data[low]
+    return (data[low] + data[high]) / 2
+
+
+def order_statistics(values: SequenceType, ranks) -> dict:
+    """
+    {rank: the value at that (0-based) rank in sorted(values)} for each of ranks, found by quickselect instead of
+    sorting all of values: each round partitions a subsequence around the median of its first, middle, and last
+    values, and carries on with just the partition(s) that hold wanted ranks, so it takes linear time on average.
+
+    Like introselect, a subsequence that has been partitioned more than about 2 x log2(len(values)) times
+    without getting small is sorted instead, which bounds the worst case at O(n log n). Partitions keep the
+    values' order, so ties are broken the same way as by sorted(), e.g. between Decimal("1") and Decimal("1.0")
+    """
+    found = {}
+    max_depth = 2 * max(1, len(values)).bit_length()
+    pending = [(values, 0, sorted(set(ranks)), 0)]
+    while pending:
+        data, offset, wanted, depth = pending.pop()
+        if len(data) <= SELECT_CUTOFF or depth > max_depth:
+            ordered = sorted(data)
+            for r in wanted:
+                found[r] = ordered[r - offset]
+            continue
+
+        pivot = sorted([data[0], data[len(data) // 2], data[-1]])[1]
+        less = [v for v in data if v < pivot]
+        equal = [v for v in data if v == pivot]
+        # i.e. pivot < v, except that a NaN, which is neither less than nor equal to anything, goes here too
+        more = [v for v in data if not v <= pivot]
+        bounds = offset + len(less), offset + len(less) + len(equal)
+        for part, start, end in (
+            (less, offset, bounds[0]),
+            (equal, bounds[0], bounds[1]),
+            (more, bounds[1], offset + len(data)),
+        ):
+            part_wanted = [r for r in wanted if start <= r < end]
+            if not part_wanted:
+                continue
+            if part is equal:
+                for r in part_wanted:
+                    found[r] = equal[r - start]
+            else:
+                pending.append((part, start, part_wanted, depth + 1))
+    return found
+
+
+def select_percentiles(values: SequenceType, percentiles: SequenceType) -> list:
+    """each of the percentiles (0 to 100) of a non-empty sequence, with just one order_statistics() selection"""
+    ranks = [percentile_ranks(len(values), p) for p in percentiles]
+    found = order_statistics(values, {r for pair in ranks for r in pair})
+    return [
+        found[low] if low == high else (found[low] + found[high]) / 2
+        for low, high in ranks
+    ]
+
+
+class Accumulator(object):
+    """
+    The running state of one aggregation over one group of rows.
+
+    - add() is called with the group's value(s) for each row, in input order
+    - merge() folds in the state of another accumulator of the same kind, i.e. one that
+        saw rows that come *after* this accumulator's rows
+    - result() returns the same value as the agate aggregation would for the same rows
+    - to_state() and load_state() save and restore its state, e.g. for csvpivot --emit-state
+    """
+
+    def add(self, *values) -> NoReturnType:
+        raise NotImplementedError
+
+    def merge(self, other: "Accumulator") -> NoReturnType:
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def to_state(self) -> dict:
+        """
+        The accumulator's attributes, less those that its factory gave it and that can't be saved as data,
+        i.e. callables, e.g. CountIfAccumulator's matcher, and agate's `default` placeholder
+        """
+        return {
+            k: v
+            for k, v in vars(self).items()
+            if not callable(v) and v is not agate.utils.default
+        }
+
+    def load_state(self, state: dict) -> NoReturnType:
+        """restores to_state() to an accumulator from the same factory"""
+        self.__dict__.update(state)
+
+    @classmethod
+    def factory(
+        cls, column_types: SequenceType[agate.DataType], params: ListType
+    ) -> CallableType:
+        """
+        Returns a no-argument callable that creates a fresh accumulator for a group
+
+        column_types: the agate data types of the aggregated column(s)
+        params: any aggregation arguments that aren't column names, e.g. the value in `count:col,value`
+        """
+        return partial(cls, *params)
+
+
+class Uncast(agate.DataType):
+    """
+    The type of a column whose values are passed to accumulators as they are, i.e. as strings, because
+    casting them isn't needed, e.g. for `count:status,open`. data_type is the column's actual type
+    """
+
+    def __init__(self, data_type: agate.DataType):
+        super().__init__()
+        self.data_type = data_type
+
+    def cast(self, d):
+        return d
+
+
+class ValueMatcher(object):
+    """
+    Whether a raw (uncast) value, when cast with `cast`, is one of `targets`. Each distinct raw value is only
+    cast once: the result is remembered – for up to memo_limit of them – so that, in effect, the matcher builds
+    up the set of raw spellings of the targets, e.g. "5", "5.0", and "$5" for the number 5
+    """
+
+    def __init__(self, cast: CallableType, targets, memo_limit: int = 100000):
+        self.cast = cast
+        self.targets = frozenset(targets)
+        self.memo_limit = memo_limit
+        self.memo: dict = {}
+
+    def __call__(self, raw) -> bool:
+        matched = self.memo.get(raw)
+        if matched is None:
+            matched = self.cast(raw) in self.targets
+            if len(self.memo) < self.memo_limit:
+                self.memo[raw] = matched
+        return matched
+
+    def __getstate__(self):
+        # e.g. when an accumulator is pickled: the memo is just a cache
+        return {**self.__dict__, "memo": {}}
+
+
+class CountAccumulator(Accumulator):
+    """
+    - add() with no value: count every row
+    - add(value): count every non-null value
+    - add(value) with self.value set: count every value equal to self.value
+
+    With a value, and an Uncast column, its factory returns a CountIfAccumulator instead
+    """
+
+    def __init__(self, value=agate.utils.default):
+        self.value = value
+        self.count = 0
+
+    def add(self, *values):
+        if not values:
+            self.count += 1
+        elif self.value is agate.utils.default:
+            if values[0] is not None:
+                self.count += 1
+        elif values[0] == self.value:
+            self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def result(self):
+        return self.count
+
+    @classmethod
+    def factory(cls, column_types, params):
+        if params and isinstance(column_types[0], Uncast):
+            return CountIfAccumulator.factory(column_types, params)
+        return partial(cls, *params)
+
+
+class CountIfAccumulator(Accumulator):
+    """the number of values that are any of the given values, i.e. `countif:col,value1,value2...`"""
+
+    def __init__(self, match: CallableType):
+        self.match = match
+        self.count = 0
+
+    def add(self, value):
+        if self.match(value):
+            self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def result(self):
+        return self.count
+
+    @classmethod
+    def factory(cls, column_types, params):
+        """for an Uncast column, values are matched by their raw spellings; otherwise, by set membership"""
+        if isinstance(column_types[0], Uncast):
+            match = ValueMatcher(column_types[0].data_type.cast, params)
+        else:
+            match = frozenset(params).__contains__
+        # every group's accumulator shares the same matcher, and so its memo
+        return partial(cls, match)
+
+
+class CountDistinctAccumulator(Accumulator):
+    """the number of distinct non-null values. Holds every one of them, in a set"""
+
+    def __init__(self):
+        self.values = set()
+
+    def add(self, value):
+        if value is not None:
+            self.values.add(value)
+
+    def merge(self, other):
+        self.values |= other.values
+
+    def result(self):
+        return len(self.values)
+
+
+class ApproxCountDistinctAccumulator(Accumulator):
+    """the estimated number of distinct non-null values, in the fixed memory of a HyperLogLog"""
+
+    def __init__(self, precision: int = DEFAULT_HLL_PRECISION):
+        self.hll = HyperLogLog(precision)
+
+    def add(self, value):
+        if value is not None:
+            self.hll.add(value)
+
+    def merge(self, other):
+        self.hll.merge(other.hll)
+
+    def result(self):
+        return self.hll.estimate()
+
+    @classmethod
+    def factory(cls, column_types, params):
+        return partial(cls, *(int(p) for p in params))
+
+
+class SumAccumulator(Accumulator):
+    def __init__(self, start=0):
+        self.total = start
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+
+    def merge(self, other):
+        self.total += other.total
+
+    def result(self):
+        return self.total
+
+    @classmethod
+    def factory(cls, column_types, params):
+        # same as agate.aggregations.Sum, which starts summing TimeDelta columns from timedelta()
+        if isinstance(column_types[0], agate.TimeDelta):
+            return partial(cls, datetime.timedelta())
+        if isinstance(column_types[0], Float):
+            return FloatSumAccumulator
+        return partial(cls)
+
+
+class FloatSumAccumulator(Accumulator):
+    """the sum of a Float column's values, with compensated summation"""
+
+    def __init__(self):
+        self.total = CompensatedSum()
+
+    def add(self, value):
+        if value is not None:
+            self.total.add(value)
+
+    def merge(self, other):
+        self.total.merge(other.total)
+
+    def result(self):
+        return float_result(self.total.value())
+
+
+class MinAccumulator(Accumulator):
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        # strict comparison, so that ties go to the first value seen, same as min()
+        if value is not None and (self.value is None or value < self.value):
+            self.value = value
+
+    def merge(self, other):
+        self.add(other.value)
+
+    def result(self):
+        return self.value
+
+
+class MaxAccumulator(MinAccumulator):
+    def add(self, value):
+        if value is not None and (self.value is None or value > self.value):
+            self.value = value
+
+
+class MaxLengthAccumulator(Accumulator):
+    def __init__(self):
+        self.length = 0
+
+    def add(self, value):
+        if value is not None and len(value) > self.length:
+            self.length = len(value)
+
+    def merge(self, other):
+        self.length = max(self.length, other.length)
+
+    def result(self):
+        return Decimal(self.length)
+
+
+class MeanAccumulator(Accumulator):
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+            self.total += value
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+
+    def result(self):
+        if self.count:
+            return self.total / self.count
+
+    @classmethod
+    def factory(cls, column_types, params):
+        if isinstance(column_types[0], Float):
+            return FloatMeanAccumulator
+        return partial(cls)
+
+
+class FloatMeanAccumulator(MeanAccumulator):
+    """the mean of a Float column's values, from their compensated sum"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = CompensatedSum()
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+            self.total.add(value)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total.merge(other.total)
+
+    def result(self):
+        if self.count:
+            return float_result(self.total.value() / self.count)
+
+
+class WeightedMeanAccumulator(Accumulator):
+    """The mean of a column's values, weighted by another column's; rows with a null in either are skipped"""
+
+    def __init__(self):
+        self.weighted = 0
+        self.weights = 0
+
+    def add(self, value, weight):
+        if value is not None and weight is not None:
+            self.weighted += value * weight
+            self.weights += weight
+
+    def merge(self, other):
+        self.weighted += other.weighted
+        self.weights += other.weights
+
+    def result(self):
+        if self.weights:
+            return self.weighted / self.weights
+
+
+class SumProductAccumulator(Accumulator):
+    """The sum of the products of two columns' values; rows with a null in either are skipped"""
+
+    def __init__(self):
+        self.total = 0
+
+    def add(self, a, b):
+        if a is not None and b is not None:
+            self.total += a * b
+
+    def merge(self, other):
+        self.total += other.total
+
+    def result(self):
+        return self.total
+
+
+class RatioAccumulator(Accumulator):
+    """The sum of one column divided by the sum of another; None if the latter is 0"""
+
+    def __init__(self):
+        self.numerator = 0
+        self.denominator = 0
+
+    def add(self, a, b):
+        if a is not None:
+            self.numerator += a
+        if b is not None:
+            self.denominator += b
+
+    def merge(self, other):
+        self.numerator += other.numerator
+        self.denominator += other.denominator
+
+    def result(self):
+        if self.denominator:
+            return self.numerator / self.denominator
+
+
+class StDevAccumulator(Accumulator):
+    """
+    Sample standard deviation, from the count, sum and sum of squares of the values.
+
+    The sums are kept exactly, in EXACT_CONTEXT, so the variance's numerator doesn't lose digits to cancellation
+    when the values have a large offset and a small spread; it's rounded once, when divided, to the same answer as
+    agate.StDev's mean-first second pass.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = Decimal(0)
+        self.squares = Decimal(0)
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+            with localcontext(EXACT_CONTEXT):
+                self.total += value
+                self.squares += value * value
+
+    def merge(self, other):
+        self.count += other.count
+        with localcontext(EXACT_CONTEXT):
+            self.total += other.total
+            self.squares += other.squares
+
+    def result(self):
+        if self.count:
+            with localcontext(EXACT_CONTEXT):
+                numerator = self.count * self.squares - self.total * self.total
+            variance = numerator / (self.count * (self.count - 1))
+            return variance.sqrt()
+
+    @classmethod
+    def factory(cls, column_types, params):
+        if isinstance(column_types[0], Float):
+            return FloatStDevAccumulator
+        return partial(cls)
+
+
+class FloatStDevAccumulator(Accumulator):
+    """
+    Sample standard deviation of a Float column's values. Unlike StDevAccumulator, it keeps the running mean and
+    sum of squared deviations from it (Welford's algorithm), because with floats, subtracting the squared sum from
+    the sum of squares can cancel out most of the result's digits. Partials are combined with Chan et al.'s update
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.mean += delta * other.count / count
+            self.count = count
+
+    def result(self):
+        return float_stdev(self.count, self.m2)
+
+
+class PercentileAccumulator(Accumulator):
+    """
+    Exact percentiles aren't decomposable, so this holds on to every (non-null) value of its group – for a Float
+    column, compactly, in an array of doubles – and picks out the percentile's values with select_percentiles(),
+    instead of sorting them all
+    """
+
+    def __init__(self, percentile=50, compact: bool = False):
+        self.percentiles = (percentile,)
+        self.compact = compact
+        self.values = array("d") if compact else []
+
+    def add(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def merge(self, other):
+        self.values.extend(other.values)
+
+    def _results(self) -> list:
+        results = select_percentiles(self.values, self.percentiles)
+        return [float_result(r) for r in results] if self.compact else results
+
+    def result(self):
+        if self.values:
+            return self._results()[0]
+
+    @classmethod
+    def factory(cls, column_types, params):
+        # params are the strings from e.g. `percentile:col,90`, already checked by aggs.Percentile
+        compact = isinstance(column_types[0], Float)
+        return partial(cls, *(Decimal(p) for p in params), compact=compact)
+
+
+class MedianAccumulator(PercentileAccumulator):
+    def __init__(self, compact: bool = False):
+        super().__init__(50, compact)
+
+
+class QuartilesAccumulator(PercentileAccumulator):
+    """the 25th, 50th, and 75th percentiles, joined by "; " """
+
+    def __init__(self, compact: bool = False):
+        super().__init__(compact=compact)
+        self.percentiles = (25, 50, 75)
+
+    def result(self):
+        if self.values:
+            return "; ".join(str(r) for r in self._results())
+
+
+class ApproxPercentileAccumulator(Accumulator):
+    """
+    Holds a KLLSketch of at most a few times `size` values, however many values the group has.
+
+    Until the sketch has had to compact anything, the result is exact, i.e. the same as
+    agate's Percentiles
+    """
+
+    def __init__(self, percentile=50, size: int = DEFAULT_SKETCH_SIZE):
+        self.percentile = percentile
+        self.sketch = KLLSketch(size)
+
+    def add(self, value):
+        if value is not None:
+            self.sketch.add(value)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+
+    def result(self):
+        sketch = self.sketch
+        if sketch.count:
+            if sketch.is_exact:
+                return percentile(sorted(sketch.levels[0]), self.percentile)
+            return sketch.quantile(float(self.percentile) / 100)
+
+    @classmethod
+    def factory(cls, column_types, params):
+        # params are the strings from e.g. `percentile~:col,90,500`, already checked by aggs.ApproxPercentile
+        pct, *size = params
+        return partial(cls, Decimal(pct), *(int(s) for s in size))
+
+
+class ApproxMedianAccumulator(ApproxPercentileAccumulator):
+    @classmethod
+    def factory(cls, column_types, params):
+        return partial(cls, 50, *(int(s) for s in params))
+
+
+class ModeAccumulator(Accumulator):
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, value):
+        if value is not None:
+            self.counts[value] = self.counts.get(value, 0) + 1
+
+    def merge(self, other):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+
+    def result(self):
+        if self.counts:
+            # max() returns the first of tied values, i.e. the one seen first
+            return max(self.counts, key=self.counts.get)
+
+
+class TopKAccumulator(Accumulator):
+    """
+    The k most frequent non-null values, from a SpaceSaving summary of a bounded number of counters,
+    joined into one string, e.g. "a; b; c"
+    """
+
+    separator = "; "
+
+    def __init__(self, k: int = 1, counters: OptionalType[int] = None):
+        self.k = k
+        self.summary = SpaceSaving(counters or max(DEFAULT_COUNTERS, 10 * k))
+
+    def add(self, value):
+        if value is not None:
+            self.summary.add(value)
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+
+    def result(self):
+        return self.separator.join(str(v) for v, _ in self.summary.top(self.k))
+
+    @classmethod
+    def factory(cls, column_types, params):
+        # params are the strings from e.g. `topk~:col,5,1000`, already checked by aggs.ApproxTopK
+        return partial(cls, *(int(p) for p in params))
+
+
+class ApproxModeAccumulator(TopKAccumulator):
+    """Same as ModeAccumulator, as long as the group has no more than 2 x counters distinct values"""
+
+    def __init__(self, counters: int = DEFAULT_COUNTERS):
+        super().__init__(1, counters)
+
+    def result(self):
+        top = self.summary.top(1)
+        if top:
+            return top[0][0]
+
+
+Accumulators = {
+    "count": CountAccumulator,
+    "countdistinct": CountDistinctAccumulator,
+    "countdistinct~": ApproxCountDistinctAccumulator,
+    "countif": CountIfAccumulator,
+    "max": MaxAccumulator,
+    "maxlength": MaxLengthAccumulator,
+    "min": MinAccumulator,
+    "mean": MeanAccumulator,
+    "median": MedianAccumulator,
+    "median~": ApproxMedianAccumulator,
+    "mode": ModeAccumulator,
+    "mode~": ApproxModeAccumulator,
+    "percentile": PercentileAccumulator,
+    "percentile~": ApproxPercentileAccumulator,
+    "quartiles": QuartilesAccumulator,
+    "ratio": RatioAccumulator,
+    "stdev": StDevAccumulator,
+    "sum": SumAccumulator,
+    "sumproduct": SumProductAccumulator,
+    "topk~": TopKAccumulator,
+    "wmean": WeightedMeanAccumulator,
+}
@@ -1,6 +1,31 @@
+from decimal import Decimal, InvalidOperation
+
 from csvmedkit import agate
+from csvmedkit.cmk.accumulators import (
+    Accumulators,
+    ApproxCountDistinctAccumulator,
+    ApproxModeAccumulator,
+    ApproxPercentileAccumulator,
+    CountDistinctAccumulator,
+    CountIfAccumulator,
+    PercentileAccumulator,
+    QuartilesAccumulator,
+    RatioAccumulator,
+    SumProductAccumulator,
+    TopKAccumulator,
+    WeightedMeanAccumulator,
+)
 from csvmedkit.cmk.helpers import *
-from csvmedkit.exceptions import InvalidAggregateName, MissingAggregationArgument
+from csvmedkit.cmk.sketches import (
+    DEFAULT_COUNTERS,
+    DEFAULT_HLL_PRECISION,
+    DEFAULT_SKETCH_SIZE,
+)
+from csvmedkit.exceptions import (
+    InvalidAggregateName,
+    InvalidAggregationArgument,
+    MissingAggregationArgument,
+)
 from typing import (
     List as ListType,
     NoReturn as NoReturnType,
@@ -21,16 +46,374 @@ from typing import (
 #     Sum,
 # )
 
+
+class CountDistinct(agate.Aggregation):
+    """
+    Count the number of distinct non-null values in a column
+
+    :param column_name:
+        The name of a column, of any data type
+    """
+
+    def __init__(self, column_name):
+        self._column_name = column_name
+
+    def get_aggregate_data_type(self, table):
+        return agate.Number()
+
+    def run(self, table):
+        acc = CountDistinctAccumulator()
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class CountIf(agate.Aggregation):
+    """
+    Like agate.aggregations.Count with a value, but for any of several values
+
+    :param column_name:
+        The name of a column, of any data type
+    :param values:
+        The values to count, e.g. `countif:status,open,pending`. csvpivot casts them to the column's data type
+    """
+
+    def __init__(self, column_name, *values):
+        if not values:
+            raise MissingAggregationArgument(
+                f"The aggregate function `countif` requires at least one value to count, e.g. `countif:{column_name},yes`"
+            )
+        self._column_name = column_name
+        self._values = values
+
+    def get_aggregate_data_type(self, table):
+        return agate.Number()
+
+    def run(self, table):
+        acc = CountIfAccumulator(frozenset(self._values).__contains__)
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class ApproxCountDistinct(CountDistinct):
+    """
+    Estimate the number of distinct non-null values in a column, with a HyperLogLog (cmk.sketches.HyperLogLog)
+
+    :param column_name:
+        The name of a column, of any data type
+    :param precision:
+        From 4 to 16: the counter uses 2**precision bytes, and its standard error is about 1.04 / sqrt(2**precision)
+    """
+
+    def __init__(self, column_name, precision=DEFAULT_HLL_PRECISION):
+        self._column_name = column_name
+        try:
+            self._precision = int(precision)
+        except ValueError:
+            raise InvalidAggregationArgument(
+                f"HyperLogLog precision must be an integer, not {precision}"
+            )
+        if not 4 <= self._precision <= 16:
+            raise InvalidAggregationArgument(
+                f"HyperLogLog precision must be from 4 to 16, not {precision}"
+            )
+
+    def run(self, table):
+        acc = ApproxCountDistinctAccumulator(self._precision)
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class Percentile(agate.Aggregation):
+    """
+    Like agate.aggregations.Percentiles, but for a single percentile, whose value(s) are picked out by
+    quickselect (cmk.accumulators.order_statistics) instead of sorting the column
+
+    :param column_name:
+        The name of a column containing :class:`.Number` data.
+    :param percentile:
+        A number from 0 to 100
+    """
+
+    def __init__(self, column_name, percentile=None):
+        self._column_name = column_name
+        if percentile is None:
+            raise MissingAggregationArgument(
+                f"The aggregate function `percentile` requires a percentile argument, e.g. `percentile:{column_name},90`"
+            )
+        try:
+            self._percentile = Decimal(percentile)
+        except InvalidOperation:
+            raise InvalidAggregationArgument(
+                f"Expected a percentile, not: {percentile}"
+            )
+        if not 0 <= self._percentile <= 100:
+            raise InvalidAggregationArgument(
+                f"Percentile must be between 0 and 100, not {percentile}"
+            )
+
+    def get_aggregate_data_type(self, table):
+        return agate.Number()
+
+    def validate(self, table):
+        column = table.columns[self._column_name]
+        if not isinstance(column.data_type, agate.Number):
+            raise agate.DataTypeError(
+                f"{type(self).__name__} can only be applied to columns containing Number data."
+            )
+
+    def run(self, table):
+        acc = PercentileAccumulator(self._percentile)
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class Quartiles(Percentile):
+    """
+    The 25th, 50th, and 75th percentiles of a column, as text, joined by "; ". Unlike agate.aggregations.Quartiles,
+    which returns a Quantiles object, the result fits in one cell of a pivot table
+
+    :param column_name:
+        The name of a column containing :class:`.Number` data.
+    """
+
+    def __init__(self, column_name):
+        self._column_name = column_name
+
+    def get_aggregate_data_type(self, table):
+        return agate.Text()
+
+    def run(self, table):
+        acc = QuartilesAccumulator()
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class ApproxPercentile(agate.Aggregation):
+    """
+    Like agate.aggregations.Percentiles, but for a single percentile, estimated from a fixed-size
+    sketch (cmk.sketches.KLLSketch) instead of a sorted copy of the column
+
+    :param column_name:
+        The name of a column containing :class:`.Number` data.
+    :param percentile:
+        A number from 0 to 100
+    :param size:
+        The accuracy of the sketch: its rank error is roughly proportional to 1/size, and its memory
+        use to size. Groups with fewer than `size` values get an exact result
+    """
+
+    def __init__(self, column_name, percentile=None, size=DEFAULT_SKETCH_SIZE):
+        self._column_name = column_name
+        if percentile is None:
+            raise MissingAggregationArgument(
+                f"The aggregate function `percentile~` requires a percentile argument, e.g. `percentile~:{column_name},90`"
+            )
+        try:
+            self._percentile = Decimal(percentile)
+            self._size = int(size)
+        except (InvalidOperation, ValueError):
+            raise InvalidAggregationArgument(
+                f"Expected a percentile and (optionally) an integer sketch size, not: {percentile}, {size}"
+            )
+        if not 0 <= self._percentile <= 100:
+            raise InvalidAggregationArgument(
+                f"Percentile must be between 0 and 100, not {percentile}"
+            )
+        if self._size < 8:
+            raise InvalidAggregationArgument(
+                f"Sketch size must be an integer of at least 8, not {size}"
+            )
+
+    def get_aggregate_data_type(self, table):
+        return agate.Number()
+
+    def validate(self, table):
+        column = table.columns[self._column_name]
+        if not isinstance(column.data_type, agate.Number):
+            raise agate.DataTypeError(
+                f"{type(self).__name__} can only be applied to columns containing Number data."
+            )
+
+    def run(self, table):
+        acc = ApproxPercentileAccumulator(self._percentile, self._size)
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class ApproxMedian(ApproxPercentile):
+    """ApproxPercentile, for the 50th percentile"""
+
+    def __init__(self, column_name, size=DEFAULT_SKETCH_SIZE):
+        super().__init__(column_name, 50, size)
+
+
+class ApproxTopK(agate.Aggregation):
+    """
+    The k most frequent values in a column, in descending order of frequency, joined by "; ". Counted with a
+    Space-Saving summary (cmk.sketches.SpaceSaving), i.e. in fixed memory however many distinct values there are
+
+    :param column_name:
+        The name of a column, of any data type
+    :param k:
+        The number of values
+    :param counters:
+        The number of values whose counts are kept track of; more counters means more accurate counts.
+        Defaults to 10 x k, or 100, whichever is more
+    """
+
+    def __init__(self, column_name, k=None, counters=None):
+        if k is None:
+            raise MissingAggregationArgument(
+                f"The aggregate function `topk~` requires a number of values argument, e.g. `topk~:{column_name},5`"
+            )
+        self._column_name = column_name
+        self._args = [_positive_int(k, "k")]
+        if counters is not None:
+            self._args.append(_positive_int(counters, "Number of counters"))
+
+    def get_aggregate_data_type(self, table):
+        return agate.Text()
+
+    def run(self, table):
+        acc = TopKAccumulator(*self._args)
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class ApproxMode(ApproxTopK):
+    """
+    Like agate.aggregations.Mode, but for a column of any data type, and in fixed memory: counted with
+    a Space-Saving summary of `counters` values
+
+    :param column_name:
+        The name of a column, of any data type
+    :param counters:
+        The number of values whose counts are kept track of. The result is exact if the column has
+        no more than 2 x counters distinct values
+    """
+
+    def __init__(self, column_name, counters=DEFAULT_COUNTERS):
+        self._column_name = column_name
+        self._args = [_positive_int(counters, "Number of counters")]
+
+    def get_aggregate_data_type(self, table):
+        return table.columns[self._column_name].data_type
+
+    def run(self, table):
+        acc = ApproxModeAccumulator(*self._args)
+        for value in table.columns[self._column_name]:
+            acc.add(value)
+        return acc.result()
+
+
+class NumberPair(agate.Aggregation):
+    """
+    An aggregation of two Number columns together, row by row, with accumulator_class
+
+    :param column_name:
+        The name of a column containing :class:`.Number` data.
+    :param other_column_name:
+        The name of another column containing :class:`.Number` data.
+    """
+
+    # the number of arguments, from the start, that are column names
+    column_count = 2
+    slug: str
+    accumulator_class: type
+
+    def __init__(self, column_name, other_column_name=None):
+        if other_column_name is None:
+            raise MissingAggregationArgument(
+                f"The aggregate function `{self.slug}` requires two column names, e.g. `{self.slug}:{column_name},other_column`"
+            )
+        self._column_names = (column_name, other_column_name)
+
+    def get_aggregate_data_type(self, table):
+        return agate.Number()
+
+    def validate(self, table):
+        for name in self._column_names:
+            if not isinstance(table.columns[name].data_type, agate.Number):
+                raise agate.DataTypeError(
+                    f"{type(self).__name__} can only be applied to columns containing Number data."
+                )
+
+    def run(self, table):
+        acc = self.accumulator_class()
+        for a, b in zip(*(table.columns[name] for name in self._column_names)):
+            acc.add(a, b)
+        return acc.result()
+
+
+class WeightedMean(NumberPair):
+    """
+    The mean of a column, with each value weighted by that of another column, e.g. `wmean:price,quantity`
+
+    :param column_name:
+        The name of a column containing :class:`.Number` data.
+    :param other_column_name:
+        The name of a column containing the weights, as :class:`.Number` data.
+    """
+
+    slug = "wmean"
+    accumulator_class = WeightedMeanAccumulator
+
+
+class SumProduct(NumberPair):
+    """The sum of the products of two columns' values in each row, e.g. `sumproduct:price,quantity`"""
+
+    slug = "sumproduct"
+    accumulator_class = SumProductAccumulator
+
+
+class Ratio(NumberPair):
+    """The sum of one column divided by the sum of another, e.g. `ratio:arrests,incidents`"""
+
+    slug = "ratio"
+    accumulator_class = RatioAccumulator
+
+
+def _positive_int(value, description: str) -> int:
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise InvalidAggregationArgument(
+            f"{description} must be a positive integer, not {value}"
+        )
+    return n
+
+
 Aggregates = {
     "count": agate.aggregations.Count,
+    "countdistinct": CountDistinct,
+    "countdistinct~": ApproxCountDistinct,
+    "countif": CountIf,
     "max": agate.aggregations.Max,
     "maxlength": agate.aggregations.MaxLength,
     "min": agate.aggregations.Min,
     "mean": agate.aggregations.Mean,
     "median": agate.aggregations.Median,
+    "median~": ApproxMedian,
     "mode": agate.aggregations.Mode,
+    "mode~": ApproxMode,
+    "percentile": Percentile,
+    "percentile~": ApproxPercentile,
+    "quartiles": Quartiles,
+    "ratio": Ratio,
     "stdev": agate.aggregations.StDev,
     "sum": agate.aggregations.Sum,
+    "sumproduct": SumProduct,
+    "topk~": ApproxTopK,
+    "wmean": WeightedMean,
 }
 
 
@@ -60,6 +443,13 @@ class Aggy(object):
         """e.g. agate.aggregations.Sum"""
         return self.get_agg(self.slug)
 
+    @property
+    def accumulator_class(self) -> type:
+        """e.g. cmk.accumulators.SumAccumulator"""
+        # raises InvalidAggregateName for an unknown slug
+        self.get_agg(self.slug)
+        return Accumulators[self.slug]
+
     @property
     def aggregation(self) -> agate.Aggregation:
         try:
@@ -83,6 +473,11 @@ class Aggy(object):
         """basically, agg_args[0]"""
         return self._args[0] if self._args else None
 
+    @property
+    def column_names(self) -> ListType[str]:
+        """the args that are column names: just column_name, except for e.g. `wmean:price,quantity`"""
+        return self._args[: getattr(self.aggregate_class, "column_count", 1)]
+
     @property
     def title(self) -> str:
         if self._output_name:
@@ -90,7 +485,8 @@ class Aggy(object):
             _name = self._output_name
         else:
             """derive from aggregate function and given arguments"""
-            _name = [self.slug, "of", *self._args]
+            # e.g. "median~" becomes "median_approx", rather than being slugified to just "median"
+            _name = [self.slug.replace("~", "_approx"), "of", *self._args]
             _name = cmk_slugify(_name)
 
         return _name
@@ -0,0 +1,67 @@
+"""
+Time buckets for csvpivot's pivot rows and column, e.g. `-r date@month`: each date or datetime is grouped by
+the month (or year, hour, etc.) that it falls in
+"""
+from typing import (
+    Callable as CallableType,
+    Dict as DictType,
+)
+
+from csvmedkit import agate
+
+# each bucket's label for a date or datetime, which sorts in time order
+TIME_BUCKETS: DictType[str, CallableType] = {
+    "year": lambda d: f"{d.year:04d}",
+    "quarter": lambda d: f"{d.year:04d}-Q{(d.month - 1) // 3 + 1}",
+    "month": lambda d: f"{d.year:04d}-{d.month:02d}",
+    "week": lambda d: "{:04d}-W{:02d}".format(*d.isocalendar()[:2]),
+    "day": lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d}",
+    "hour": lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d} {d.hour:02d}:00",
+    "minute": lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d} {d.hour:02d}:{d.minute:02d}",
+}
+
+# the buckets that are smaller than a day, which only a DateTime column can be bucketed by
+TIME_OF_DAY_BUCKETS = ("hour", "minute")
+
+
+def split_bucket(name: str) -> tuple:
+    """e.g. ("date", "month") for "date@month", or (name, None) if name doesn't end with @ and a time bucket"""
+    column, sep, unit = name.rpartition("@")
+    if sep and column and unit in TIME_BUCKETS:
+        return column, unit
+    return name, None
+
+
+class TimeBucket(agate.DataType):
+    """
+    A column type whose values are cast with data_type, a Date or DateTime, and then labeled with their time
+    bucket, e.g. "2020-03" for month. Dates and datetimes are often repeated many times in a column, so the label
+    of each distinct value – up to memo_limit of them – is remembered, and each one is only parsed once
+    """
+
+    def __init__(self, data_type: agate.DataType, unit: str, memo_limit: int = 100000):
+        super().__init__()
+        self.data_type = data_type
+        self.unit = unit
+        self.memo_limit = memo_limit
+        self.memo: dict = {}
+        self._label = TIME_BUCKETS[unit]
+
+    def cast(self, d):
+        try:
+            return self.memo[d]
+        except KeyError:
+            pass
+        value = self.data_type.cast(d)
+        label = None if value is None else self._label(value)
+        if len(self.memo) < self.memo_limit:
+            self.memo[d] = label
+        return label
+
+    def __getstate__(self):
+        # e.g. when a --state is pickled: the memo is just a cache, and the label function is a lambda
+        return {**self.__dict__, "memo": {}, "_label": None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._label = TIME_BUCKETS[self.unit]
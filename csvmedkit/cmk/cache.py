@@ -0,0 +1,131 @@
+"""
+An on-disk cache of csvpivot's output, keyed by a fingerprint of the input file and the options that shape the output
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import (
+    Iterator as IteratorType,
+    NoReturn as NoReturnType,
+    TextIO as TextIOType,
+)
+
+DEFAULT_CACHE_SIZE = 256 << 20
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def digest(obj) -> str:
+    """a hex digest of any JSON-able object; anything that isn't, e.g. a Decimal, is stringified"""
+    text = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _Tee(object):
+    """a (write-only) file that writes to every one of `files`"""
+
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, text: str) -> int:
+        for f in self.files:
+            f.write(text)
+        return len(text)
+
+
+class ResultCache(object):
+    """
+    A directory of cached outputs, each in a file named by its key. A fetched output's file is touched, so that
+    when the directory's files add up to more than max_size bytes, the least recently used ones are deleted first.
+
+    Hashing an input file's contents is the slow part of fingerprinting it, so each content hash is cached too,
+    keyed by the file's path, size, modification time, and inode: a file that hasn't changed isn't read at all,
+    and one that has only been touched is hashed again, but still gets a cache hit
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _read(self, path: str) -> TextIOType:
+        """opens a cached file and marks it as recently used. Raises FileNotFoundError, e.g. if it was just evicted"""
+        f = open(path, encoding="utf-8", newline="")
+        os.utime(path)
+        return f
+
+    def fingerprint(self, path: str) -> str:
+        """the size and content hash of the file at path"""
+        st = os.stat(path)
+        memo = self._path(
+            digest([os.path.realpath(path), st.st_size, st.st_mtime_ns, st.st_ino]),
+            ".hash",
+        )
+        try:
+            with self._read(memo) as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+        h = hashlib.blake2b()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                h.update(block)
+        result = f"{st.st_size}:{h.hexdigest()}"
+        with self._writing(memo) as f:
+            f.write(result)
+        return result
+
+    def fetch(self, key: str, output: TextIOType) -> bool:
+        """copies the cached output for key, if there is one, to output. Returns whether there was"""
+        try:
+            with self._read(self._path(key, ".csv")) as f:
+                shutil.copyfileobj(f, output)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @contextmanager
+    def store(self, key: str, output: TextIOType) -> IteratorType[_Tee]:
+        """
+        Yields a file that writes to both output and the cache. The cached copy is only kept if the with-block
+        finishes without an exception; then, older entries are evicted as needed
+        """
+        with self._writing(self._path(key, ".csv")) as f:
+            yield _Tee(output, f)
+        self.evict()
+
+    @contextmanager
+    def _writing(self, path: str) -> IteratorType[TextIOType]:
+        """a temporary file that replaces path when it's done, so that a cached file is never read half-written"""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8", newline="") as f:
+                yield f
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def evict(self) -> NoReturnType:
+        """deletes the least recently used files until the cache fits in max_size"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith(".tmp"):
+                    st = e.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -94,7 +94,7 @@ class CmkUtil(CmkProps, CSVKitUtility):
     """
 
     def log_err(self, txt: str) -> NoReturnType:
-        stderr.write(f"{txt}\n")
+        sys.stderr.write(f"{txt}\n")
 
     def text_csv_reader(self) -> agate.csv.reader:
         """TODO: deprecate"""
@@ -0,0 +1,250 @@
+"""
+An optional NumPy backend for csvpivot's numeric aggregations
+"""
+from array import array
+from typing import (
+    Dict as DictType,
+    Iterable as IterableType,
+    Iterator as IteratorType,
+    List as ListType,
+    NoReturn as NoReturnType,
+    Sequence as SequenceType,
+    Tuple as TupleType,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from csvmedkit.cmk.engine import PivotEngine
+from csvmedkit.cmk.floats import float_result, float_stdev
+
+NUMPY_AGGREGATES = ("count", "max", "mean", "min", "stdev", "sum")
+# the arrays of _ColumnStats
+STATS = ("n", "total", "mean", "m2", "min", "max")
+
+
+def numpy_supports(slug: str, args: SequenceType) -> bool:
+    """whether NumpyPivotEngine can do the aggregation, e.g. not `count:col,value`"""
+    if slug == "count":
+        return len(args) <= 1
+    return slug in NUMPY_AGGREGATES and len(args) == 1
+
+
+class _ColumnStats(object):
+    """
+    Per-group statistics of one column: non-null count, sum, mean, sum of squared deviations from the mean
+    (for stdev), min, and max. Each is an array, indexed by group number
+    """
+
+    def __init__(self, size: int = 0):
+        self.n = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def grow(self, size: int) -> NoReturnType:
+        extra = size - len(self.n)
+        if extra > 0:
+            self.n = np.concatenate([self.n, np.zeros(extra, dtype=np.int64)])
+            self.total = np.concatenate([self.total, np.zeros(extra)])
+            self.mean = np.concatenate([self.mean, np.zeros(extra)])
+            self.m2 = np.concatenate([self.m2, np.zeros(extra)])
+            self.min = np.concatenate([self.min, np.full(extra, np.inf)])
+            self.max = np.concatenate([self.max, np.full(extra, -np.inf)])
+
+    def to_state(self) -> dict:
+        return {name: getattr(self, name).tolist() for name in STATS}
+
+    def load_state(self, state: dict) -> NoReturnType:
+        for name in STATS:
+            setattr(self, name, np.array(state[name], dtype=getattr(self, name).dtype))
+
+    @classmethod
+    def of_chunk(cls, codes, values) -> TupleType["_ColumnStats", "np.ndarray"]:
+        """
+        The statistics of a chunk of values (NaN for nulls), grouped by their group numbers, using sorted
+        ufunc.reduceat(). Returns (stats, the group numbers that they're for)
+        """
+        valid = ~np.isnan(values)
+        codes, values = codes[valid], values[valid]
+        order = np.argsort(codes, kind="stable")
+        codes, values = codes[order], values[order]
+
+        stats = cls()
+        if not len(codes):
+            return stats, codes
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        stats.n = np.diff(np.r_[starts, len(codes)])
+        stats.total = np.add.reduceat(values, starts)
+        stats.mean = stats.total / stats.n
+        deviations = values - np.repeat(stats.mean, stats.n)
+        stats.m2 = np.add.reduceat(deviations * deviations, starts)
+        stats.min = np.minimum.reduceat(values, starts)
+        stats.max = np.maximum.reduceat(values, starts)
+        return stats, codes[starts]
+
+    def combine(self, groups: "np.ndarray", other: "_ColumnStats") -> NoReturnType:
+        """
+        Folds in `other`, whose i-th statistics are for group number groups[i], which are all different.
+        Means and squared deviations are combined with Chan et al.'s pairwise update, which is numerically stable
+        """
+        n0, n1 = self.n[groups], other.n
+        n = n0 + n1
+        safe_n = np.where(n > 0, n, 1)
+        delta = other.mean - self.mean[groups]
+        self.mean[groups] += delta * n1 / safe_n
+        self.m2[groups] += other.m2 + delta * delta * n0 * n1 / safe_n
+        self.total[groups] += other.total
+        self.min[groups] = np.minimum(self.min[groups], other.min)
+        self.max[groups] = np.maximum(self.max[groups], other.max)
+        self.n[groups] = n
+
+
+class NumpyPivotEngine(PivotEngine):
+    """
+    Columnar hash aggregation: each row's key is looked up (and, if new, numbered) in self.groups, and its
+    group number and aggregated values are appended to arrays. Every `chunk_size` rows, the arrays are reduced
+    to per-group statistics with numpy, and discarded.
+
+    Values to aggregate must be floats, e.g. cast with the cmk.floats.Float type, with None for nulls.
+
+    slugs: the aggregation (e.g. "sum") of each aggregation, instead of accumulator factories; they must be
+        supported by numpy_supports()
+    """
+
+    def __init__(
+        self,
+        key_ids: ListType[int],
+        slugs: ListType[str],
+        arg_ids: ListType[ListType[int]],
+        chunk_size: int = 1 << 16,
+    ):
+        super().__init__(key_ids, [], arg_ids)
+        self.slugs = slugs
+        self.chunk_size = chunk_size
+        self.value_ids = list(dict.fromkeys(i for ids in arg_ids for i in ids))
+        self.row_counts = np.zeros(0, dtype=np.int64)
+        self.stats: DictType[int, _ColumnStats] = {
+            i: _ColumnStats() for i in self.value_ids
+        }
+
+    def consume(self, rows: IterableType[SequenceType]) -> NoReturnType:
+        groups = self.groups
+        key_columns = list(zip(self.key_ids, self.dictionaries))
+        value_ids = self.value_ids
+        nan = float("nan")
+        codes = array("q")
+        columns = [array("d") for _ in value_ids]
+
+        for row in rows:
+            key = tuple([d.setdefault(row[i], len(d)) for i, d in key_columns])
+            code = groups.get(key)
+            if code is None:
+                code = groups[key] = len(groups)
+            codes.append(code)
+            for col, i in zip(columns, value_ids):
+                v = row[i]
+                col.append(nan if v is None else v)
+
+            if len(codes) == self.chunk_size:
+                self._reduce(codes, columns)
+                codes = array("q")
+                columns = [array("d") for _ in value_ids]
+
+        self._reduce(codes, columns)
+
+    def _grow(self) -> NoReturnType:
+        size = len(self.groups)
+        extra = size - len(self.row_counts)
+        if extra > 0:
+            self.row_counts = np.concatenate(
+                [self.row_counts, np.zeros(extra, dtype=np.int64)]
+            )
+        for stats in self.stats.values():
+            stats.grow(size)
+
+    def _reduce(self, codes: array, columns: ListType[array]) -> NoReturnType:
+        self._grow()
+        if not codes:
+            return
+        codes = np.frombuffer(codes, dtype=np.int64)
+        self.row_counts += np.bincount(codes, minlength=len(self.row_counts))
+        for i, col in zip(self.value_ids, columns):
+            chunk, groups = _ColumnStats.of_chunk(codes, np.frombuffer(col))
+            self.stats[i].combine(groups, chunk)
+
+    def merge(self, other: "NumpyPivotEngine") -> NoReturnType:
+        # other's group numbers, as this engine's group numbers
+        groups = self.groups
+        translation = self._translation(other)
+        mapping = np.array(
+            [
+                groups.setdefault(
+                    tuple([t[code] for t, code in zip(translation, key)]), len(groups)
+                )
+                for key in other.groups
+            ],
+            dtype=np.int64,
+        )
+        self._grow()
+        self.row_counts[mapping] += other.row_counts
+        for i, stats in self.stats.items():
+            stats.combine(mapping, other.stats[i])
+
+    def to_state(self) -> dict:
+        return {
+            "dictionaries": [list(d) for d in self.dictionaries],
+            # in order of their group numbers
+            "groups": list(self.groups),
+            "row_counts": self.row_counts.tolist(),
+            "stats": {i: stats.to_state() for i, stats in self.stats.items()},
+        }
+
+    def load_state(self, state: dict) -> NoReturnType:
+        self.dictionaries = [
+            {v: code for code, v in enumerate(values)}
+            for values in state["dictionaries"]
+        ]
+        self.groups = {tuple(key): code for code, key in enumerate(state["groups"])}
+        self.row_counts = np.array(state["row_counts"], dtype=np.int64)
+        for i, stats in self.stats.items():
+            stats.load_state(state["stats"][i])
+
+    def _result_column(self, slug: str, ids: ListType[int]) -> list:
+        if not ids:
+            return [int(n) for n in self.row_counts]
+
+        stats = self.stats[ids[0]]
+        if slug == "count":
+            return [int(n) for n in stats.n]
+        if slug == "sum":
+            return [float_result(x) for x in stats.total]
+
+        results = []
+        for n, mean, m2, lo, hi in zip(
+            stats.n, stats.mean, stats.m2, stats.min, stats.max
+        ):
+            if slug == "stdev":
+                results.append(float_stdev(int(n), float(m2)))
+            elif not n:
+                results.append(None)
+            elif slug == "mean":
+                results.append(float_result(mean))
+            elif slug == "min":
+                results.append(float_result(lo))
+            else:
+                results.append(float_result(hi))
+        return results
+
+    def results(self) -> IteratorType[TupleType[TupleType, list]]:
+        columns = [
+            self._result_column(slug, ids)
+            for slug, ids in zip(self.slugs, self.arg_ids)
+        ]
+        # self.groups maps keys to group numbers, instead of accumulators
+        for key, code in self.items():
+            yield key, [col[code] for col in columns]
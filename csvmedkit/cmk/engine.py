@@ -0,0 +1,482 @@
+"""
+The aggregation engine behind csvpivot
+"""
+import heapq
+import itertools
+import sys
+from typing import (
+    Callable as CallableType,
+    Dict as DictType,
+    Iterable as IterableType,
+    Iterator as IteratorType,
+    List as ListType,
+    NoReturn as NoReturnType,
+    Optional as OptionalType,
+    Sequence as SequenceType,
+    Set as SetType,
+    Tuple as TupleType,
+)
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import Accumulator
+
+
+class PivotEngine(object):
+    """
+    Streaming hash aggregation: rows are consumed one at a time, and each group – i.e. each
+    unique combination of values in the key columns – holds one accumulator per aggregation.
+
+    Memory use is proportional to the number of groups, not the number of rows.
+
+    Group keys are dictionary-encoded: each key column has a dictionary that numbers its distinct values in order of
+    first appearance, and a group's key is a tuple of those numbers. Values that many groups share, e.g. the
+    states in a pivot by state and county, are then held once, instead of once per group. Keys are decoded
+    back to values by items()
+
+    key_ids: indexes of the columns to group by (for a crosstab, the pivot column comes last)
+    factories: one callable per aggregation, each returning a fresh Accumulator
+    arg_ids: one list per aggregation, the indexes of the column(s) whose values are passed to Accumulator.add()
+    """
+
+    def __init__(
+        self,
+        key_ids: ListType[int],
+        factories: ListType[CallableType],
+        arg_ids: ListType[ListType[int]],
+    ):
+        self.key_ids = key_ids
+        self.factories = factories
+        self.arg_ids = arg_ids
+        self.groups: DictType[TupleType, ListType[Accumulator]] = {}
+        self.dictionaries: ListType[DictType] = [{} for _ in key_ids]
+
+    @property
+    def group_count(self) -> int:
+        return len(self.groups)
+
+    def consume(self, rows: IterableType[SequenceType]) -> NoReturnType:
+        groups = self.groups
+        key_columns = list(zip(self.key_ids, self.dictionaries))
+        factories = self.factories
+        arg_ids = self.arg_ids
+
+        for row in rows:
+            key = tuple([d.setdefault(row[i], len(d)) for i, d in key_columns])
+            accs = groups.get(key)
+            if accs is None:
+                accs = groups[key] = [f() for f in factories]
+            for acc, ids in zip(accs, arg_ids):
+                acc.add(*[row[i] for i in ids])
+
+    def merge(self, other: "PivotEngine") -> NoReturnType:
+        """fold in the groups of another engine, which consumed rows that came after this engine's rows"""
+        groups = self.groups
+        translation = self._translation(other)
+        for key, accs in other.groups.items():
+            key = tuple([t[code] for t, code in zip(translation, key)])
+            mine = groups.get(key)
+            if mine is None:
+                groups[key] = accs
+            else:
+                for acc, theirs in zip(mine, accs):
+                    acc.merge(theirs)
+
+    def _translation(self, other: "PivotEngine") -> ListType[ListType[int]]:
+        """for each key column, the other engine's codes as this engine's codes (adding any values it doesn't have)"""
+        return [
+            [mine.setdefault(value, len(mine)) for value in theirs]
+            for mine, theirs in zip(self.dictionaries, other.dictionaries)
+        ]
+
+    def to_state(self) -> dict:
+        """the key dictionaries and every group's accumulators, as data that can be saved, e.g. by --emit-state"""
+        return {
+            "dictionaries": [list(d) for d in self.dictionaries],
+            "groups": [
+                (key, [acc.to_state() for acc in accs])
+                for key, accs in self.groups.items()
+            ],
+        }
+
+    def load_state(self, state: dict) -> NoReturnType:
+        """restores to_state(), to an engine with the same factories, in place of this engine's groups"""
+        self.dictionaries = [
+            {v: code for code, v in enumerate(values)}
+            for values in state["dictionaries"]
+        ]
+        groups = self.groups = {}
+        for key, saved in state["groups"]:
+            accs = groups[tuple(key)] = [f() for f in self.factories]
+            for acc, acc_state in zip(accs, saved):
+                acc.load_state(acc_state)
+
+    def decoder(self) -> CallableType[[TupleType], TupleType]:
+        """a function from an encoded key to its values"""
+        values = [list(d) for d in self.dictionaries]
+        return lambda key: tuple([v[code] for v, code in zip(values, key)])
+
+    def key_memory(self) -> TupleType[int, int]:
+        """
+        Roughly, the bytes taken up by the values of the group keys: as they are, i.e. in the key dictionaries,
+        and if each group held its own copy of its key values instead
+        """
+        encoded = plain = 0
+        for d in self.dictionaries:
+            if not d:
+                continue
+            # None, True, and False are singletons, which every group would share anyway
+            values_size = sum(
+                sys.getsizeof(v)
+                for v in d
+                if v is not None and v is not True and v is not False
+            )
+            # small ints are cached by Python, so only the larger codes take up memory
+            codes_size = sys.getsizeof(len(d)) * max(0, len(d) - 257)
+            encoded += sys.getsizeof(d) + values_size + codes_size
+            plain += values_size * self.group_count // len(d)
+        return encoded, plain
+
+    def items(self) -> IteratorType[TupleType[TupleType, ListType[Accumulator]]]:
+        """
+        Yields (key, accumulators) for every group, in the order that agate's chained group_by() produces:
+        groups are ordered by the first appearance of their first key value; within that, by first appearance
+        of their second key value; and so on
+        """
+        keys = list(self.groups)
+        if len(self.key_ids) > 1:
+            ranks = [{} for _ in self.key_ids]
+            for key in keys:
+                for n, rank in enumerate(ranks, 1):
+                    prefix = key[:n]
+                    if prefix not in rank:
+                        rank[prefix] = len(rank)
+            keys.sort(key=lambda k: tuple(r[k[:n]] for n, r in enumerate(ranks, 1)))
+
+        decode = self.decoder()
+        for key in keys:
+            yield decode(key), self.groups[key]
+
+    def keys(self) -> IteratorType[TupleType]:
+        for key, _ in self.items():
+            yield key
+
+    def results(self) -> IteratorType[TupleType[TupleType, list]]:
+        """Yields (key, [each aggregation's result]) for every group, in the same order as items()"""
+        for key, accs in self.items():
+            yield key, [a.result() for a in accs]
+
+    def grouped_rows(self) -> IteratorType[list]:
+        """one row per group: the key values, followed by each aggregation's result"""
+        for key, values in self.results():
+            yield [*key, *values]
+
+    def crosstab_rows(
+        self, default_value=None
+    ) -> TupleType[ListType[str], IteratorType[list]]:
+        """
+        Same as agate.Table.denormalize: the last key column is the pivot column, and each of its (stringified)
+        values becomes a column, holding the first aggregation's result. Cells for which there is no group
+        are filled with default_value
+
+        Returns (pivot_column_names, rows). Since results() are ordered by key prefix, the groups of each
+        output row are consecutive, so rows are generated one at a time
+        """
+        fields: DictType[str, int] = {}
+        for key in self.keys():
+            fields.setdefault(str(key[-1]), len(fields))
+        field_names = list(fields)
+
+        def rows():
+            for row_key, group in itertools.groupby(
+                self.results(), key=lambda item: item[0][:-1]
+            ):
+                cells = {str(key[-1]): values[0] for key, values in group}
+                yield [*row_key, *(cells.get(f, default_value) for f in field_names)]
+
+        return field_names, rows()
+
+
+class PresortedPivotEngine(PivotEngine):
+    """
+    For rows that are already sorted – or at least grouped – by their first `sorted_width` key columns
+    (by default, all of them): only the groups of the current block of rows with the same sorted key
+    values are held, and each block's results are yielded as soon as the next block starts. Rows are
+    therefore not aggregated until results are asked for.
+
+    Input that isn't grouped isn't detected; it just gets more than one result for the same group.
+
+    Since only one block's groups are held at a time, their keys aren't dictionary-encoded
+    """
+
+    def __init__(
+        self,
+        key_ids: ListType[int],
+        factories: ListType[CallableType],
+        arg_ids: ListType[ListType[int]],
+        sorted_width: OptionalType[int] = None,
+    ):
+        super().__init__(key_ids, factories, arg_ids)
+        self.sorted_width = len(key_ids) if sorted_width is None else sorted_width
+        self._rows: IterableType[SequenceType] = ()
+        self._results: OptionalType[list] = None
+        self._group_count = 0
+
+    @property
+    def group_count(self) -> int:
+        """the number of groups that have been aggregated so far"""
+        return self._group_count
+
+    def consume(self, rows: IterableType[SequenceType]) -> NoReturnType:
+        self._rows = itertools.chain(self._rows, rows)
+
+    def merge(self, other: "PivotEngine") -> NoReturnType:
+        raise NotImplementedError(
+            "A PresortedPivotEngine can't be merged; its rows have to be consumed in order"
+        )
+
+    def decoder(self) -> CallableType[[TupleType], TupleType]:
+        return lambda key: key
+
+    def items(self) -> IteratorType[TupleType[TupleType, ListType[Accumulator]]]:
+        groups = self.groups
+        key_ids = self.key_ids
+        factories = self.factories
+        arg_ids = self.arg_ids
+        width = self.sorted_width
+        block = None
+
+        for row in self._rows:
+            key = tuple([row[i] for i in key_ids])
+            if key[:width] != block:
+                # within a block, the groups are in the same order as PivotEngine's
+                yield from super().items()
+                self._group_count += len(groups)
+                groups.clear()
+                block = key[:width]
+            accs = groups.get(key)
+            if accs is None:
+                accs = groups[key] = [f() for f in factories]
+            for acc, ids in zip(accs, arg_ids):
+                acc.add(*[row[i] for i in ids])
+
+        yield from super().items()
+        self._group_count += len(groups)
+        groups.clear()
+
+    def results(self) -> IteratorType[TupleType[TupleType, list]]:
+        if self._results is not None:
+            return iter(self._results)
+        return super().results()
+
+    def keys(self) -> IteratorType[TupleType]:
+        for key, _ in self.results():
+            yield key
+
+    def crosstab_rows(
+        self, default_value=None
+    ) -> TupleType[ListType[str], IteratorType[list]]:
+        # a crosstab's columns aren't all known until the end of the input, so its results are held until then
+        self._results = list(self.results())
+        return super().crosstab_rows(default_value)
+
+
+def select_top(
+    rows: IterableType[list], n: int, index: int, largest: bool = True
+) -> ListType[list]:
+    """
+    The n rows with the largest (or, if not largest, smallest) value at index, in that order. Picked with a heap of
+    at most n rows as the rows go by, instead of sorting all of them. Rows whose value is null come last,
+    and ties keep their order in rows
+    """
+    if largest:
+        return heapq.nlargest(n, rows, key=lambda r: (r[index] is not None, r[index]))
+    return heapq.nsmallest(n, rows, key=lambda r: (r[index] is None, r[index]))
+
+
+def having(
+    rows: IterableType[list], conditions: ListType[TupleType], offset: int
+) -> IterableType[list]:
+    """
+    Only the rows whose results meet every condition, like SQL's HAVING. Each condition is (i, compare, value),
+    for the result at row[offset + i], e.g. (0, operator.ge, 100); a null result never meets a condition.
+    Rows are filtered as they go by, so e.g. PresortedPivotEngine's groups are dropped as soon as they're done.
+    Groups aren't discarded before then, even when a monotone result (a count, a max) already fails a condition
+    """
+    if not conditions:
+        return rows
+    conditions = [(offset + i, compare, value) for i, compare, value in conditions]
+    return (
+        row
+        for row in rows
+        if all(
+            row[i] is not None and compare(row[i], value)
+            for i, compare, value in conditions
+        )
+    )
+
+
+GroupingType = TupleType[int, ...]
+ItemsType = IterableType[TupleType[TupleType, ListType[Accumulator]]]
+
+
+def rollup(
+    items: ItemsType, factories: ListType[CallableType]
+) -> IteratorType[TupleType[GroupingType, TupleType, list]]:
+    """
+    Subtotals for every prefix of the key columns, e.g. for keys (a, b, c): by (a, b), by (a), and a grand total.
+
+    items: (key, accumulators) for each group, ordered by key prefix, as from PivotEngine.items()
+
+    Yields (grouping, key, results), where grouping is the positions of the key columns that the row is grouped by,
+    and the key's other values are None: each group in order, and, right after the last group with a given prefix,
+    that prefix's subtotal. A subtotal's accumulators are merged from those of the groups (or subtotals) a level
+    finer, so no row is aggregated twice, and only one subtotal per level is held at a time
+    """
+    width = 0
+    # [(prefix, accumulators)] of the current subtotal of each level, i.e. of each prefix width
+    totals: list = []
+
+    def subtotal(n: int):
+        prefix, accs = totals[n]
+        totals[n] = None
+        if n:
+            for total, acc in zip(totals[n - 1][1], accs):
+                total.merge(acc)
+        return (
+            tuple(range(n)),
+            prefix + (None,) * (width - n),
+            [a.result() for a in accs],
+        )
+
+    for key, accs in items:
+        if not totals:
+            width = len(key)
+            totals = [None] * width
+        for n in range(width - 1, -1, -1):
+            if totals[n] is not None and totals[n][0] != key[:n]:
+                yield subtotal(n)
+        for n in range(width):
+            if totals[n] is None:
+                totals[n] = (key[:n], [f() for f in factories])
+        yield tuple(range(width)), key, [a.result() for a in accs]
+        for total, acc in zip(totals[width - 1][1], accs):
+            total.merge(acc)
+    for n in range(width - 1, -1, -1):
+        yield subtotal(n)
+
+
+def cube(
+    items: ItemsType, factories: ListType[CallableType]
+) -> IteratorType[TupleType[GroupingType, TupleType, list]]:
+    """
+    Subtotals for every combination of the key columns, e.g. for keys (a, b): by (a), by (b), and a grand total.
+
+    Yields (grouping, key, results), like rollup(): each group in order, then the subtotals of each combination,
+    from the most key columns to the fewest. Each combination's accumulators are merged from those of a
+    combination with one more column, so only the groups of two levels of combinations are held at a time
+    """
+    groups: DictType[TupleType, ListType[Accumulator]] = {}
+    for key, accs in items:
+        groups[key] = accs
+        yield tuple(range(len(key))), key, [a.result() for a in accs]
+    if not groups:
+        return
+
+    width = len(next(iter(groups)))
+    # the groups of each combination with one more key column than the current level's
+    finer: DictType[GroupingType, DictType[TupleType, ListType[Accumulator]]] = {
+        tuple(range(width)): groups
+    }
+    for size in range(width - 1, -1, -1):
+        level = {}
+        for grouping in itertools.combinations(range(width), size):
+            # e.g. (a) from (a, b), i.e. with the first key column that grouping doesn't have
+            missing = min(set(range(width)) - set(grouping))
+            totals: DictType[TupleType, ListType[Accumulator]] = {}
+            for key, accs in finer[tuple(sorted(grouping + (missing,)))].items():
+                subkey = tuple(v if i in grouping else None for i, v in enumerate(key))
+                group = totals.get(subkey)
+                if group is None:
+                    group = totals[subkey] = [f() for f in factories]
+                for total, acc in zip(group, accs):
+                    total.merge(acc)
+            for key, accs in totals.items():
+                yield grouping, key, [a.result() for a in accs]
+            level[grouping] = totals
+        finer = level
+
+
+def project_rows(
+    rows: IterableType[list], column_ids: ListType[int]
+) -> IteratorType[list]:
+    """
+    Yields only the used columns of each input row. Like csv.DictReader, blank lines are skipped,
+    and short rows are padded with None
+    """
+    width = max(column_ids) + 1
+    for row in rows:
+        if len(row) < width:
+            if not row:
+                continue
+            row = row + [None] * (width - len(row))
+        yield [row[i] for i in column_ids]
+
+
+def typed_rows(
+    rows: IterableType[list], coltypes: ListType[agate.DataType]
+) -> IteratorType[list]:
+    casts = [t.cast for t in coltypes]
+    for row in rows:
+        yield [cast(v) for cast, v in zip(casts, row)]
+
+
+def untested_rows(
+    rows: IterableType[list], memo_limit: int = 100000
+) -> IteratorType[list]:
+    """
+    A value that has already been type-tested in a column doesn't need to be tested again,
+    so repeats are replaced with None – which passes every type test – and rows of nothing but
+    repeats are skipped. Up to memo_limit distinct values per column are remembered
+    """
+    seen = None
+    for row in rows:
+        if seen is None:
+            seen = [set() for _ in row]
+        untested = False
+        for i, value in enumerate(row):
+            if value in seen[i]:
+                row[i] = None
+            else:
+                untested = True
+                if len(seen[i]) < memo_limit:
+                    seen[i].add(value)
+        if untested:
+            yield row
+
+
+def remaining_types(
+    rows: IterableType[list], types: SequenceType[agate.DataType], width: int
+) -> ListType[SetType[int]]:
+    """
+    Same hypothesis testing as agate.TypeTester: for each of the `width` columns, returns the indexes of the
+    candidate types that every value in that column can be cast to.
+
+    Hypotheses from different parts of the same data can be combined by intersecting them
+    """
+    hypotheses = [set(range(len(types))) for _ in range(width)]
+    for row in rows:
+        for i, value in enumerate(row):
+            h = hypotheses[i]
+            if len(h) == 1:
+                continue
+            for t in tuple(h):
+                if not types[t].test(value):
+                    h.remove(t)
+    return hypotheses
+
+
+def choose_types(
+    hypotheses: ListType[SetType[int]], types: SequenceType[agate.DataType]
+) -> ListType[agate.DataType]:
+    """like agate.TypeTester, the first of the candidate types that is still possible"""
+    return [types[min(h)] for h in hypotheses]
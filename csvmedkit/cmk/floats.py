@@ -0,0 +1,77 @@
+"""
+Floating-point arithmetic for csvpivot's --float and --engine numpy: casting numbers to float, and summing them
+without the rounding error piling up
+"""
+from decimal import Decimal
+import math
+
+from csvmedkit import agate
+
+
+class Float(agate.Number):
+    """
+    A Number type whose values are cast to float instead of Decimal, which is much quicker.
+    Plain numbers are parsed by float(); anything else, e.g. "$1,000" or a null, goes through agate.Number
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # e.g. with a decimal comma, "1.500" is one thousand five hundred, which float() would get wrong
+        self._plain = self.decimal_symbol == "." and self.group_symbol != "."
+
+    def cast(self, d):
+        if self._plain:
+            try:
+                return float(d)
+            except (TypeError, ValueError):
+                pass
+        value = super().cast(d)
+        return None if value is None else float(value)
+
+
+def float_result(x: float):
+    """a float result as a Decimal, so that it's written the same as agate's Number results, e.g. 40 rather than 40.0"""
+    x = float(x)
+    if x.is_integer():
+        return Decimal(int(x))
+    return Decimal(repr(x))
+
+
+class CompensatedSum(object):
+    """
+    A running float sum, with Neumaier's improvement on Kahan summation: the low-order bits lost by each addition
+    are added up separately, in `compensation`, so the total's error doesn't grow with the number of values
+    """
+
+    __slots__ = ("total", "compensation")
+
+    def __init__(self):
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def add(self, x: float):
+        total = self.total + x
+        if abs(self.total) >= abs(x):
+            self.compensation += (self.total - total) + x
+        else:
+            self.compensation += (x - total) + self.total
+        self.total = total
+
+    def merge(self, other: "CompensatedSum"):
+        self.add(other.total)
+        self.compensation += other.compensation
+
+    def value(self) -> float:
+        return self.total + self.compensation
+
+    def __getstate__(self):
+        return (self.total, self.compensation)
+
+    def __setstate__(self, state):
+        self.total, self.compensation = state
+
+
+def float_stdev(count: int, m2: float):
+    """the sample standard deviation, from the sum of squared deviations from the mean; None for fewer than 2 values"""
+    if count > 1:
+        return float_result(math.sqrt(m2 / (count - 1)))
@@ -98,3 +98,27 @@ def cmk_slugify(txt: UnionType[str, SequenceType]) -> str:
         # e.g a list of strings
         txt = " ".join(str(t) for t in txt)
     return pyslugify(txt, separator="_")
+
+
+def cmk_parse_memory_size(txt: str) -> int:
+    """
+    a number of bytes, optionally with a (binary) K, M, G, or T suffix, e.g. '512M' or '2G', or '1.5GB'.
+    Raises ValueError otherwise
+    """
+    units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    m = re.match(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", txt, re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Expected a size like 500M or 2G, not '{txt}'")
+    number, unit = m.groups()
+    return int(float(number) * units[unit.upper()])
+
+
+def cmk_format_memory_size(size: int) -> str:
+    """the reverse of cmk_parse_memory_size, rounded to one decimal place, e.g. 1536 is '1.5K'"""
+    for unit in ("", "K", "M", "G"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "T"
+    return f"{size}{unit}" if not unit else f"{size:.1f}{unit}"
@@ -0,0 +1,201 @@
+"""
+Splitting CSV files into byte ranges ("shards") that are aggregated by separate processes, then merged
+"""
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from functools import partial
+import io
+import os
+import re
+from typing import (
+    Callable as CallableType,
+    Iterator as IteratorType,
+    List as ListType,
+    Optional as OptionalType,
+    Set as SetType,
+    Tuple as TupleType,
+)
+
+from csvmedkit import agate
+from csvmedkit.cmk.engine import (
+    PivotEngine,
+    project_rows,
+    remaining_types,
+    typed_rows,
+    untested_rows,
+)
+
+CHUNK_SIZE = 1 << 20
+
+
+def data_offset(
+    path: str, skip_lines: int, header: bool, quotechar: OptionalType[str]
+) -> int:
+    """the byte offset of the first data row, i.e. after any skipped lines and the header row"""
+    with open(path, "rb") as f:
+        for _ in range(skip_lines):
+            f.readline()
+        offset = f.tell()
+    if header:
+        offset = next_record_offset(path, offset, quotechar)
+    return offset
+
+
+def next_record_offset(path: str, offset: int, quotechar: OptionalType[str]) -> int:
+    """
+    The offset just past the first newline at or after `offset` that isn't inside a quoted field,
+    assuming that `offset` is itself the start of a record
+    """
+    ranges = record_ranges(path, offset, 2, quotechar, targets=[offset])
+    return ranges[0][1] if ranges else offset
+
+
+def record_ranges(
+    path: str,
+    start: int,
+    count: int,
+    quotechar: OptionalType[str] = '"',
+    targets: OptionalType[ListType[int]] = None,
+) -> ListType[TupleType[int, int]]:
+    """
+    Splits the file, from `start` to its end, into (up to) `count` byte ranges of roughly equal size,
+    each of which begins and ends on a record boundary.
+
+    A newline is a record boundary if it is preceded by an even number of quotechars – doubled quotes
+    count twice, so they don't change the parity. This doesn't hold if quotes can be escaped with an
+    escapechar, in which case the file shouldn't be split this way. With quotechar=None (i.e. QUOTE_NONE),
+    every newline is a record boundary.
+
+    Only the quotechars are counted, so the whole file is scanned at close to disk speed.
+    """
+    size = os.path.getsize(path)
+    if targets is None:
+        targets = [start + (size - start) * i // count for i in range(1, count)]
+    q = quotechar.encode() if quotechar else None
+    boundary_rx = re.compile(b"[" + re.escape(q) + b"\n]" if q else b"\n")
+
+    bounds = [start]
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        inquote = False
+        for target in targets:
+            if target < pos:
+                continue
+            # parity of the quotes up to the target...
+            while pos < target:
+                block = f.read(min(CHUNK_SIZE, target - pos))
+                if not block:
+                    break
+                if q and block.count(q) % 2:
+                    inquote = not inquote
+                pos += len(block)
+            # ...then find the first newline after it that isn't quoted
+            boundary = None
+            while boundary is None:
+                block = f.read(CHUNK_SIZE)
+                if not block:
+                    boundary = size
+                    break
+                for m in boundary_rx.finditer(block):
+                    if m.group() == q:
+                        inquote = not inquote
+                    elif not inquote:
+                        boundary = pos + m.end()
+                        break
+                else:
+                    pos += len(block)
+            f.seek(boundary)
+            pos = boundary
+            if boundary > bounds[-1]:
+                bounds.append(boundary)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+class _ByteRange(io.RawIOBase):
+    """a binary file, limited to reading `length` bytes from its current position"""
+
+    def __init__(self, f, length: int):
+        self._f = f
+        self._remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._f.read(min(len(buffer), self._remaining))
+        buffer[: len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def read_range(
+    path: str, byte_range: TupleType[int, int], encoding: str, reader_kwargs: dict
+) -> IteratorType[list]:
+    start, end = byte_range
+    f = open(path, "rb")
+    f.seek(start)
+    with io.TextIOWrapper(
+        io.BufferedReader(_ByteRange(f, end - start)), encoding=encoding
+    ) as src:
+        yield from agate.csv.reader(src, **reader_kwargs)
+
+
+def infer_range(
+    byte_range: TupleType[int, int],
+    path: str,
+    encoding: str,
+    reader_kwargs: dict,
+    column_ids: ListType[int],
+    types: ListType[agate.DataType],
+) -> ListType[SetType[int]]:
+    rows = untested_rows(
+        project_rows(read_range(path, byte_range, encoding, reader_kwargs), column_ids)
+    )
+    return remaining_types(rows, types, len(column_ids))
+
+
+def aggregate_range(
+    byte_range: TupleType[int, int],
+    path: str,
+    encoding: str,
+    reader_kwargs: dict,
+    column_ids: ListType[int],
+    coltypes: ListType[agate.DataType],
+    engine: PivotEngine,
+) -> PivotEngine:
+    """`engine` is an empty engine, which is copied – not consumed into – so that it can be used for every shard"""
+    engine = copy.deepcopy(engine)
+    rows = project_rows(
+        read_range(path, byte_range, encoding, reader_kwargs), column_ids
+    )
+    engine.consume(typed_rows(rows, coltypes))
+    return engine
+
+
+def _run_on_shard(shard: TupleType[str, TupleType[int, int]], func, **kwargs):
+    path, byte_range = shard
+    return func(byte_range, path=path, **kwargs)
+
+
+def map_shards(
+    func: CallableType,
+    shards: ListType[TupleType[str, TupleType[int, int]]],
+    jobs: int,
+    **kwargs,
+) -> list:
+    """
+    Runs func(byte_range, path=path, **kwargs) for each (path, byte_range) shard in a pool of `jobs` processes –
+    or, with only one job, in this process. Results are in shard order
+    """
+    run = partial(_run_on_shard, func=func, **kwargs)
+    if jobs < 2:
+        return [run(shard) for shard in shards]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(run, shards))
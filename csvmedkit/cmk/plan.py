@@ -0,0 +1,188 @@
+"""
+A pivot, compiled once per run from csvpivot's arguments, so that nothing is re-derived from Aggy objects
+or argument strings while the rows are aggregated
+"""
+from typing import (
+    Callable as CallableType,
+    Dict as DictType,
+    List as ListType,
+    NoReturn as NoReturnType,
+    Optional as OptionalType,
+    Sequence as SequenceType,
+)
+
+from csvmedkit import agate
+from csvmedkit.cmk.aggs import Aggy
+from csvmedkit.cmk.buckets import TIME_OF_DAY_BUCKETS, TimeBucket, split_bucket
+from csvmedkit.exceptions import ColumnNameError
+
+# the aggregations whose arguments after the column name are values to count, typecast to the column's type
+COUNTED_VALUES = {"count": 1, "countif": None}
+
+
+class PlannedAggregation(object):
+    """
+    One aggregation of the plan, with Aggy's derived properties evaluated once:
+
+    - column_name: the aggregated column, if any
+    - column_names: the aggregated columns, i.e. [column_name], or e.g. both of `wmean:price,quantity`
+    - column_ids: their indexes (like an engine's arg_ids) among the plan's used columns
+    - args: the arguments after the column names; count's value arguments are typecast by PivotPlan.bind()
+    - counts_values: whether it's e.g. `count:col,value` or `countif:col,value,...`, but not `count:col`
+    - title: the output column's name, which bind() updates for any typecast values, e.g. count_of_when_1950_01_01
+    - aggregation: the agate.Aggregation, made by bind() from the typecast arguments
+    """
+
+    def __init__(self, aggy: Aggy, column_ids: ListType[int]):
+        self.aggy = aggy
+        self.slug = aggy.slug
+        self.accumulator_class = aggy.accumulator_class
+        self.column_name = aggy.column_name
+        self.column_names = aggy.column_names
+        self.column_ids = column_ids
+        self.args = aggy.agg_args[len(self.column_names) :]
+        self.counts_values = self.slug in COUNTED_VALUES and bool(self.args)
+        self.title = aggy.title
+        self.aggregation: OptionalType[agate.Aggregation] = None
+
+    def __str__(self):
+        return str(self.aggy)
+
+    @property
+    def agg_args(self) -> list:
+        """same as Aggy.agg_args, i.e. the column names and then args"""
+        return [*self.column_names, *self.args]
+
+
+class PivotPlan(object):
+    """
+    The columns that a pivot uses and how it aggregates them, resolved to indexes:
+
+    - column_names: the used columns – i.e. -r, -c, and the aggregated columns – in that order, without repeats
+    - input_ids: their indexes among the input's columns
+    - key_ids: the indexes, among the used columns, of the columns that rows are grouped on; for a crosstab,
+      the pivot column is the last one
+    - buckets: {index among the used columns: time bucket} for each key column that's a time bucket of an input
+      column, e.g. "date@month"
+    - aggs: a PlannedAggregation for each aggy
+
+    Column types aren't known until the input has been read, so bind() then casts count's values, makes each
+    agate.Aggregation (to check that it suits its column's type, and for the output types), and factories()
+    makes the accumulator factories for the engine
+    """
+
+    def __init__(
+        self,
+        aggies: SequenceType[Aggy],
+        row_names: ListType[str],
+        column_name: OptionalType[str],
+        input_names: SequenceType[str],
+    ):
+        self.row_names = list(row_names)
+        self.column_name = column_name
+        self.key_names = self.row_names + ([column_name] if column_name else [])
+
+        used = self.key_names + [c for a in aggies for c in a.column_names]
+        self.column_names = list(dict.fromkeys(used))
+        self.input_ids: ListType[int] = []
+        self.buckets: DictType[int, str] = {}
+        for i, c in enumerate(self.column_names):
+            # a column whose name looks like a time bucket, e.g. "team@home", is still just that column
+            bucketed = c in self.key_names and not c in input_names
+            column, unit = split_bucket(c) if bucketed else (c, None)
+            if not column in input_names:
+                raise ColumnNameError(
+                    f"'{c}' is not a valid column name; column names are: {list(input_names)}"
+                )
+            self.input_ids.append(input_names.index(column))
+            if unit:
+                self.buckets[i] = unit
+        self.key_ids = [self.column_names.index(c) for c in self.key_names]
+        self.aggs = [
+            PlannedAggregation(a, [self.column_names.index(c) for c in a.column_names])
+            for a in aggies
+        ]
+        self.arg_ids = [a.column_ids for a in self.aggs]
+        self.column_types: OptionalType[ListType[agate.DataType]] = None
+        self.schema: OptionalType[agate.Table] = None
+
+    def spec(self) -> dict:
+        """the pivot's columns and aggregations, by name, e.g. for telling whether a saved state is for this pivot"""
+        return {
+            "pivot_rows": self.row_names,
+            "pivot_column": self.column_name,
+            "aggregates": [[a.slug, a.agg_args, a.title] for a in self.aggs],
+        }
+
+    def bind(self, column_types: ListType[agate.DataType]) -> NoReturnType:
+        """
+        Sets the used columns' types, casting count's values to them. Raises agate.CastError for a value
+        that can't be cast, and e.g. DataTypeError for sum() of a Text column – before any aggregating is done
+        """
+        self.column_types = column_types
+        for i, unit in self.buckets.items():
+            self._check_bucket(i, unit)
+        # a zero-row table, for agate's aggregation type-checking
+        self.schema = agate.Table([], self.column_names, column_types)
+        for a in self.aggs:
+            if a.counts_values:
+                self._cast_counted_values(a)
+            a.aggregation = a.aggy.aggregation
+            a.aggregation.validate(self.schema)
+
+    def _check_bucket(self, i: int, unit: str) -> NoReturnType:
+        dtype = self.column_types[i]
+        column = split_bucket(self.column_names[i])[0]
+        if not isinstance(dtype, (agate.Date, agate.DateTime)):
+            raise agate.DataTypeError(
+                f"'{self.column_names[i]}' needs column '{column}' to contain dates or datetimes, but its datatype is "
+                f"{type(dtype).__name__}: specify its format with --date-format or --datetime-format, or its type with --types"
+            )
+        if unit in TIME_OF_DAY_BUCKETS and not isinstance(dtype, agate.DateTime):
+            raise agate.DataTypeError(
+                f"'{self.column_names[i]}' needs column '{column}' to contain datetimes, not just dates"
+            )
+
+    def bucketed(
+        self, cast_types: ListType[agate.DataType]
+    ) -> ListType[agate.DataType]:
+        """cast_types, except that each time bucket key column's values are cast to their buckets' labels"""
+        return [
+            TimeBucket(t, self.buckets[i]) if i in self.buckets else t
+            for i, t in enumerate(cast_types)
+        ]
+
+    def key_types(self) -> ListType[agate.DataType]:
+        """the types of the key columns' values in the output, where time buckets are Text labels"""
+        return [
+            agate.Text() if i in self.buckets else self.column_types[i]
+            for i in self.key_ids
+        ]
+
+    def _cast_counted_values(self, agg: PlannedAggregation) -> NoReturnType:
+        """typecasts count's value argument, or countif's values, to match the datatype of the column that it counts"""
+        dtype = self.column_types[agg.column_ids[0]]
+        nvals = COUNTED_VALUES[agg.slug]
+        for i, cval in enumerate(agg.args[:nvals]):
+            try:
+                dval = dtype.cast(cval)
+            except agate.CastError as err:
+                typename: str = type(dtype).__name__
+                raise agate.CastError(
+                    f"You attempted to count '{cval}' in column '{agg.column_name}', which has datatype {typename}. But '{cval}' could not be converted to {typename}."
+                )
+            agg.args[i] = dval
+            # so that the aggregation, and the title, are of the typecast value
+            agg.aggy._args[i + 1] = dval
+        agg.title = agg.aggy.title
+
+    def factories(self, cast_types: ListType[agate.DataType]) -> ListType[CallableType]:
+        """each aggregation's accumulator factory, for columns cast with cast_types"""
+        return [
+            a.accumulator_class.factory([cast_types[i] for i in a.column_ids], a.args)
+            for a in self.aggs
+        ]
+
+    def output_types(self) -> ListType[agate.DataType]:
+        """the types of each aggregation's results"""
+        return [a.aggregation.get_aggregate_data_type(self.schema) for a in self.aggs]
@@ -0,0 +1,220 @@
+"""
+Fixed-size, mergeable summaries of a stream of values, for the approximate (~) aggregations
+"""
+from decimal import Decimal
+import hashlib
+import math
+from typing import List as ListType, NoReturn as NoReturnType, Tuple as TupleType
+
+DEFAULT_SKETCH_SIZE = 200
+
+
+class KLLSketch(object):
+    """
+    A KLL quantile sketch (Karnin, Lang & Liberty, 2016).
+
+    Values are buffered in a stack of "compactors": level h holds values that each stand in for
+    2**h of the original values. When the sketch is full, its lowest full level is sorted and every
+    other value is promoted to the level above, with twice the weight. Capacities shrink geometrically
+    going down the stack, so the sketch never holds more than about 3 * size values, and the rank
+    error of a quantile is on the order of 1 / size, regardless of count.
+
+    Instead of a coin flip, compactions alternate between promoting the odd and even values,
+    so that the same input always produces the same sketch
+    """
+
+    def __init__(self, size: int = DEFAULT_SKETCH_SIZE):
+        self.size = size
+        self.count = 0
+        self.levels: ListType[list] = []
+        self._flip = 0
+        self._held = 0
+        self._grow()
+
+    @property
+    def is_exact(self) -> bool:
+        """True until the first compaction, i.e. every value that was added is still held"""
+        return len(self.levels) == 1
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.size * (2 / 3) ** depth)) + 1
+
+    def _grow(self) -> NoReturnType:
+        self.levels.append([])
+        self._max_held = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def add(self, value) -> NoReturnType:
+        self.levels[0].append(value)
+        self.count += 1
+        self._held += 1
+        if self._held >= self._max_held:
+            self._compress()
+
+    def merge(self, other: "KLLSketch") -> NoReturnType:
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for mine, theirs in zip(self.levels, other.levels):
+            mine.extend(theirs)
+        self.count += other.count
+        self._held += other._held
+        self._compress()
+
+    def _compress(self) -> NoReturnType:
+        """compacts full levels, lowest first, until the sketch is back under its total capacity"""
+        for level in range(len(self.levels)):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self._grow()
+                items = self.levels[level]
+                items.sort()
+                self.levels[level] = [items.pop()] if len(items) % 2 else []
+                self._flip ^= 1
+                self.levels[level + 1].extend(items[self._flip :: 2])
+                self._held = sum(len(items) for items in self.levels)
+                if self._held < self._max_held:
+                    break
+
+    def quantile(self, q: float):
+        """The value at (approximately) rank q * count, where 0 <= q <= 1. None if the sketch is empty"""
+        weighted = sorted(
+            (v, 1 << h) for h, items in enumerate(self.levels) for v in items
+        )
+        if not weighted:
+            return None
+
+        target = q * self.count
+        rank = 0
+        for value, weight in weighted:
+            rank += weight
+            if rank >= target:
+                return value
+        return weighted[-1][0]
+
+
+DEFAULT_HLL_PRECISION = 12
+
+
+def stable_hash(value) -> int:
+    """
+    A 64-bit hash of a (typed) value that, unlike hash(), is the same in every process,
+    so that sketches built by different workers can be merged
+    """
+    if isinstance(value, Decimal):
+        # equal Decimals, e.g. 1.0 and 1, should hash the same
+        value = value.normalize()
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HyperLogLog(object):
+    """
+    A HyperLogLog distinct-value counter (Flajolet et al., 2007), in 2**precision one-byte registers,
+    i.e. 4KB at the default precision of 12, with a standard error of about 1.04 / sqrt(2**precision),
+    i.e. 1.6%.
+
+    Each value is hashed; the first `precision` bits of its hash pick a register, which keeps the highest
+    "rank" – the position of the first 1 bit in the rest of the hash – of any value it has seen. Merging
+    two counters is just the element-wise max of their registers
+    """
+
+    def __init__(self, precision: int = DEFAULT_HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._width = 64 - precision
+        self._mask = (1 << self._width) - 1
+
+    def add(self, value) -> NoReturnType:
+        h = stable_hash(value)
+        index = h >> self._width
+        rank = self._width - (h & self._mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> NoReturnType:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if zeros and estimate <= 2.5 * m:
+            # small-range correction: linear counting of the empty registers
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+DEFAULT_COUNTERS = 100
+
+
+class SpaceSaving(object):
+    """
+    A Space-Saving heavy-hitters summary (Metwally, Agrawal & El Abbadi, 2005), with a bounded
+    number of counters.
+
+    Each counted value's count is an overestimate of its true count, by at most its `errors` entry.
+    Instead of evicting the smallest counter for every new value, the summary lets itself grow to
+    twice `counters`, then keeps only the largest `counters` counts; `floor` is the largest
+    count that was dropped, and a value that (re)appears afterwards starts counting from it.
+
+    Until the first time that counters are dropped, every count is exact
+    """
+
+    def __init__(self, counters: int = DEFAULT_COUNTERS):
+        self.counters = counters
+        self.counts: dict = {}
+        self.errors: dict = {}
+        self.floor = 0
+
+    @property
+    def is_exact(self) -> bool:
+        return self.floor == 0
+
+    def add(self, value) -> NoReturnType:
+        counts = self.counts
+        if value in counts:
+            counts[value] += 1
+        else:
+            counts[value] = self.floor + 1
+            self.errors[value] = self.floor
+            if len(counts) > 2 * self.counters:
+                self._prune()
+
+    def merge(self, other: "SpaceSaving") -> NoReturnType:
+        """
+        A value missing from one of the summaries could have been counted up to that summary's floor,
+        so that's what it's assumed to have been counted
+        """
+        counts, errors = self.counts, self.errors
+        for value, count in other.counts.items():
+            if value in counts:
+                counts[value] += count
+                errors[value] += other.errors[value]
+            else:
+                counts[value] = self.floor + count
+                errors[value] = self.floor + other.errors[value]
+        for value in counts.keys() - other.counts.keys():
+            counts[value] += other.floor
+            errors[value] += other.floor
+        self.floor += other.floor
+        if len(counts) > self.counters:
+            self._prune()
+
+    def _prune(self) -> NoReturnType:
+        # a stable sort, so values tied at the cutoff are kept in order of first appearance
+        ranked = sorted(self.counts, key=self.counts.get, reverse=True)
+        if len(ranked) <= self.counters:
+            return
+        kept = set(ranked[: self.counters])
+        self.floor = max(self.floor, self.counts[ranked[self.counters]])
+        self.counts = {v: c for v, c in self.counts.items() if v in kept}
+        self.errors = {v: self.errors[v] for v in self.counts}
+
+    def top(self, k: int) -> ListType[TupleType[object, int]]:
+        """The k (value, count) pairs with the highest counts; tied values are in order of first appearance"""
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:k]
@@ -0,0 +1,219 @@
+"""
+External (spill-to-disk) hash aggregation, for when a pivot's groups don't fit in a memory budget
+"""
+import heapq
+import pickle
+import sys
+import tempfile
+from typing import (
+    Callable as CallableType,
+    Dict as DictType,
+    Iterable as IterableType,
+    Iterator as IteratorType,
+    List as ListType,
+    NoReturn as NoReturnType,
+    Sequence as SequenceType,
+    Tuple as TupleType,
+)
+
+from csvmedkit.cmk.engine import PivotEngine
+
+SAMPLE_SIZE = 8
+
+
+def estimate_size(obj, depth: int = 4) -> int:
+    """
+    Roughly, the bytes used by obj and everything it holds. Large containers are estimated from
+    a sample of their items
+    """
+    size = sys.getsizeof(obj)
+    if depth == 0:
+        return size
+    if isinstance(obj, dict):
+        items = list(obj.items())[:SAMPLE_SIZE]
+        if items:
+            each = sum(
+                estimate_size(k, depth - 1) + estimate_size(v, depth - 1)
+                for k, v in items
+            )
+            size += each * len(obj) // len(items)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = [o for _, o in zip(range(SAMPLE_SIZE), obj)]
+        if items:
+            each = sum(estimate_size(o, depth - 1) for o in items)
+            size += each * len(obj) // len(items)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), depth - 1)
+    return size
+
+
+def read_pickles(f) -> IteratorType:
+    """every object pickled to file f, from its start"""
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            break
+
+
+class SpillingPivotEngine(PivotEngine):
+    """
+    A PivotEngine that, whenever its groups are estimated to take up more than max_memory bytes, moves
+    them out to temporary files: one per partition, chosen by the (hash of) the group's first key value.
+
+    When results are asked for, each partition is read back and merged by itself, then sorted in the same
+    order as PivotEngine.items(), and the partitions' results are merge-sorted together. Because groups are
+    partitioned by their first key value, every group that shares a key prefix is in the same partition,
+    so the order can be worked out one partition at a time – but it also means that a single first key value
+    with too many groups can't be split up.
+
+    Memory use is therefore bounded by max_memory, plus the largest partition (about 1/partitions of all groups).
+    Keys aren't dictionary-encoded: a dictionary of every distinct key value would grow with the input, however
+    often the groups were spilled
+    """
+
+    def __init__(
+        self,
+        key_ids: ListType[int],
+        factories: ListType[CallableType],
+        arg_ids: ListType[ListType[int]],
+        max_memory: int,
+        partitions: int = 16,
+        check_interval: int = 10000,
+    ):
+        super().__init__(key_ids, factories, arg_ids)
+        self.max_memory = max_memory
+        self.partitions = partitions
+        self.check_interval = check_interval
+        # the order in which each group first appeared: spilled groups are no longer in self.groups' key order
+        self.first_seen: DictType[TupleType, int] = {}
+        self.spill_count = 0
+        self._seen_count = 0
+        self._spill_files = None
+        self._merged = None
+        self._merged_count = 0
+
+    @property
+    def group_count(self) -> int:
+        return self._merged_count if self.spill_count else len(self.groups)
+
+    def consume(self, rows: IterableType[SequenceType]) -> NoReturnType:
+        groups = self.groups
+        first_seen = self.first_seen
+        key_ids = self.key_ids
+        factories = self.factories
+        arg_ids = self.arg_ids
+        countdown = self.check_interval
+
+        for row in rows:
+            key = tuple([row[i] for i in key_ids])
+            accs = groups.get(key)
+            if accs is None:
+                accs = groups[key] = [f() for f in factories]
+                first_seen[key] = self._seen_count
+                self._seen_count += 1
+            for acc, ids in zip(accs, arg_ids):
+                acc.add(*[row[i] for i in ids])
+
+            countdown -= 1
+            if not countdown:
+                countdown = self.check_interval
+                if self.estimate_memory() > self.max_memory:
+                    self.spill()
+
+    def merge(self, other: "PivotEngine") -> NoReturnType:
+        raise NotImplementedError(
+            "A SpillingPivotEngine can't be merged; it's meant for a single process"
+        )
+
+    def decoder(self) -> CallableType[[TupleType], TupleType]:
+        return lambda key: key
+
+    def estimate_memory(self) -> int:
+        """the size of the groups dicts, plus the estimated size of the oldest and newest groups, times the number of groups"""
+        groups = self.groups
+        if not groups:
+            return 0
+        sample = []
+        for keys in (iter(groups), reversed(groups)):
+            for _, key in zip(range(SAMPLE_SIZE), keys):
+                sample.append(estimate_size(key) + estimate_size(groups[key]))
+        each = sum(sample) // len(sample)
+        return 2 * sys.getsizeof(groups) + each * len(groups)
+
+    def spill(self) -> NoReturnType:
+        if self._spill_files is None:
+            self._spill_files = [
+                tempfile.TemporaryFile() for _ in range(self.partitions)
+            ]
+        files = self._spill_files
+        first_seen = self.first_seen
+        for key, accs in self.groups.items():
+            f = files[hash(key[0]) % self.partitions]
+            pickle.dump((key, first_seen[key], accs), f, pickle.HIGHEST_PROTOCOL)
+        self.groups.clear()
+        first_seen.clear()
+        self.spill_count += 1
+
+    def _partition_results(self, f) -> list:
+        """
+        Merges the spilled states of one partition, in the order they were spilled (i.e. input order), and
+        returns [(sort_key, key, results)], sorted the same way as PivotEngine.items()
+        """
+        groups: DictType[TupleType, list] = {}
+        first_seen: DictType[TupleType, int] = {}
+        for key, seen, accs in read_pickles(f):
+            mine = groups.get(key)
+            if mine is None:
+                groups[key] = accs
+                first_seen[key] = seen
+            else:
+                for acc, theirs in zip(mine, accs):
+                    acc.merge(theirs)
+
+        # a key prefix is ranked by the first appearance of any group that starts with it
+        prefix_rank: DictType[TupleType, int] = {}
+        for key, seen in sorted(first_seen.items(), key=lambda item: item[1]):
+            for n in range(1, len(key) + 1):
+                prefix_rank.setdefault(key[:n], seen)
+
+        results = []
+        for key, accs in groups.items():
+            sort_key = tuple(prefix_rank[key[:n]] for n in range(1, len(key) + 1))
+            results.append((sort_key, key, [a.result() for a in accs]))
+        results.sort(key=lambda r: r[0])
+        return results
+
+    def _merge_spills(self):
+        """writes every group's results, in items() order, to one file"""
+        self.spill()
+        runs = []
+        for f in self._spill_files:
+            run = tempfile.TemporaryFile()
+            for result in self._partition_results(f):
+                pickle.dump(result, run, pickle.HIGHEST_PROTOCOL)
+            f.close()
+            runs.append(run)
+
+        self._merged = tempfile.TemporaryFile()
+        for _, key, values in heapq.merge(
+            *(read_pickles(r) for r in runs), key=lambda r: r[0]
+        ):
+            pickle.dump((key, values), self._merged, pickle.HIGHEST_PROTOCOL)
+            self._merged_count += 1
+        for r in runs:
+            r.close()
+
+    def results(self) -> IteratorType[TupleType[TupleType, list]]:
+        if not self.spill_count:
+            yield from super().results()
+            return
+
+        if self._merged is None:
+            self._merge_spills()
+        yield from read_pickles(self._merged)
+
+    def keys(self) -> IteratorType[TupleType]:
+        for key, _ in self.results():
+            yield key
@@ -0,0 +1,395 @@
+"""
+Saving a pivot's aggregation state, so that rows appended to its input file later can be aggregated on their own,
+or so that pivots of separate files can be merged later
+"""
+from array import _array_reconstructor, array
+import datetime
+from decimal import Decimal
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from typing import (
+    List as ListType,
+    NoReturn as NoReturnType,
+    Optional as OptionalType,
+    Tuple as TupleType,
+)
+import zlib
+
+import isodate.tzinfo
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import Uncast
+from csvmedkit.cmk.buckets import TimeBucket
+from csvmedkit.cmk.engine import PivotEngine
+from csvmedkit.cmk.floats import CompensatedSum, Float
+from csvmedkit.cmk.sketches import HyperLogLog, KLLSketch, SpaceSaving
+from csvmedkit.exceptions import InvalidPartialAggregate
+
+STATE_VERSION = 3
+STATE_FIELDS = (
+    "spec",
+    "coltype_specs",
+    "casttype_specs",
+    "engine_name",
+    "engine_state",
+    "offset",
+    "check",
+)
+CHECK_SIZE = 1 << 16
+
+# the start of every --emit-state file, followed by PARTIAL_VERSION, as one byte
+PARTIAL_MAGIC = b"CMKAGG"
+PARTIAL_VERSION = 3
+PARTIAL_FIELDS = (
+    "pivot",
+    "coltype_specs",
+    "casttype_specs",
+    "engine_name",
+    "engine_state",
+)
+
+
+# the options that each column type is made with, i.e. all that has to be saved to make it again
+TYPE_OPTIONS = {
+    agate.Boolean: ("true_values", "false_values", "null_values"),
+    agate.Date: ("date_format", "locale", "null_values"),
+    agate.DateTime: ("datetime_format", "locale", "null_values"),
+    agate.Number: (
+        "locale",
+        "group_symbol",
+        "decimal_symbol",
+        "currency_symbols",
+        "null_values",
+    ),
+    agate.Text: ("cast_nulls", "null_values"),
+    agate.TimeDelta: ("null_values",),
+    Float: (
+        "locale",
+        "group_symbol",
+        "decimal_symbol",
+        "currency_symbols",
+        "null_values",
+    ),
+    TimeBucket: ("data_type", "unit"),
+    Uncast: ("data_type",),
+}
+TYPE_CLASSES = {cls.__name__: cls for cls in TYPE_OPTIONS}
+
+
+def type_spec(data_type: agate.DataType) -> TupleType[str, dict]:
+    """
+    A column type as its class name and its options, e.g. ("Date", {"date_format": "%Y.%d.%m", ...}), for saving
+    instead of the type itself, which pickles e.g. its babel locale: that would be most of the file
+    """
+    options = {name: getattr(data_type, name) for name in TYPE_OPTIONS[type(data_type)]}
+    if options.get("locale") is not None:
+        # agate.Number's is a babel Locale
+        options["locale"] = str(options["locale"])
+    if "data_type" in options:
+        options["data_type"] = type_spec(options["data_type"])
+    return type(data_type).__name__, options
+
+
+def spec_type(spec: TupleType[str, dict]) -> agate.DataType:
+    """the column type that type_spec() was given"""
+    name, options = spec
+    if "data_type" in options:
+        options = {**options, "data_type": spec_type(options["data_type"])}
+    return TYPE_CLASSES[name](**options)
+
+
+# the only classes and functions that a state file may refer to: data types, and the accumulators' sketches
+SAFE_GLOBALS = {
+    (obj.__module__, obj.__qualname__): obj
+    for obj in (
+        array,
+        # what an array is pickled as
+        _array_reconstructor,
+        bytearray,
+        datetime.date,
+        datetime.datetime,
+        datetime.time,
+        datetime.timedelta,
+        datetime.timezone,
+        # the time zones of the datetimes that agate parses from ISO 8601 offsets, e.g. 2020-01-01T00:00:00+05:00;
+        # a Utc pickles as a call to _Utc(), which returns the module's instance
+        isodate.tzinfo.FixedOffset,
+        isodate.tzinfo.Utc,
+        isodate.tzinfo._Utc,
+        Decimal,
+        frozenset,
+        set,
+        CompensatedSum,
+        HyperLogLog,
+        KLLSketch,
+        SpaceSaving,
+    )
+}
+
+
+class StateUnpickler(pickle.Unpickler):
+    """
+    Unpickles only data: anything other than SAFE_GLOBALS, e.g. a function that a crafted file refers to
+    in order to call it, is an UnpicklingError
+    """
+
+    def find_class(self, module: str, name: str):
+        try:
+            return SAFE_GLOBALS[(module, name)]
+        except KeyError:
+            raise pickle.UnpicklingError(
+                f"{module}.{name} isn't allowed in a state file"
+            )
+
+
+def loads(data: bytes):
+    """pickle.loads(), for data that might not have been pickled by csvpivot"""
+    return StateUnpickler(io.BytesIO(data)).load()
+
+
+def last_record_end(path: str, start: int) -> int:
+    """
+    The offset just past the file's last newline, i.e. the end of its last complete record – assuming that the
+    newline isn't inside a quoted field – or `start`, if there's no newline after it
+    """
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > start:
+            size = min(CHECK_SIZE, pos - start)
+            pos -= size
+            f.seek(pos)
+            i = f.read(size).rfind(b"\n")
+            if i >= 0:
+                return pos + i + 1
+    return start
+
+
+def prefix_check(path: str, offset: int) -> str:
+    """
+    A hash of the first and last (up to) 64KB of the file's first `offset` bytes: if the file has only been
+    appended to since, it won't have changed
+    """
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        h.update(f.read(min(CHECK_SIZE, offset)))
+        f.seek(max(0, offset - CHECK_SIZE))
+        h.update(f.read(offset - f.tell()))
+    return h.hexdigest()
+
+
+def load_engine(
+    engine: PivotEngine, engine_name: str, engine_state: dict
+) -> PivotEngine:
+    """
+    engine, with a saved engine's to_state(). A ValueError if the saved engine was of another class, or its state
+    is damaged
+    """
+    if type(engine).__name__ != engine_name:
+        raise ValueError(
+            f"they were saved by {engine_name}, not {type(engine).__name__}"
+        )
+    try:
+        engine.load_state(engine_state)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError) as err:
+        raise ValueError(f"they're damaged ({err!r})")
+    return engine
+
+
+class PivotState(object):
+    """
+    Everything needed to carry on a pivot of a file from where it left off: the engine, holding every group's
+    accumulators; the column types that its rows were cast with; and the offset of the first row not yet consumed.
+
+    spec: identifies the pivot table (i.e. its options); a state can only be carried on by the same pivot
+
+    The column types are kept as their type_spec()s, and the engine as its class name and its to_state(), the same
+    as PartialPivot's
+    """
+
+    def __init__(
+        self,
+        spec: str,
+        coltypes: ListType[agate.DataType],
+        casttypes: ListType[agate.DataType],
+        engine: PivotEngine,
+        offset: int,
+        check: str,
+    ):
+        self.spec = spec
+        self.coltype_specs = [type_spec(t) for t in coltypes]
+        self.casttype_specs = [type_spec(t) for t in casttypes]
+        self.engine_name = type(engine).__name__
+        self.engine_state = engine.to_state()
+        self.offset = offset
+        self.check = check
+
+    @property
+    def coltypes(self) -> ListType[agate.DataType]:
+        return [spec_type(s) for s in self.coltype_specs]
+
+    @property
+    def casttypes(self) -> ListType[agate.DataType]:
+        return [spec_type(s) for s in self.casttype_specs]
+
+    def load_engine(self, engine: PivotEngine) -> PivotEngine:
+        """engine, a new one of the saved class, made for the same plan, with the saved groups"""
+        return load_engine(engine, self.engine_name, self.engine_state)
+
+    @classmethod
+    def load(cls, path: str) -> OptionalType["PivotState"]:
+        """
+        None if there's no state file. ValueError, saying why, if it can't be carried on from: e.g. it was saved
+        by a different version, or it's damaged
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            saved = loads(data)
+        except (pickle.UnpicklingError, EOFError, ValueError) as err:
+            # e.g. an older version's state, which was a pickled PivotState
+            raise ValueError(f"it can't be read: {err}")
+        if not (isinstance(saved, tuple) and len(saved) == 2):
+            raise ValueError("it isn't a state file saved by csvpivot --state")
+        version, fields = saved
+        if version != STATE_VERSION:
+            raise ValueError("it was saved by a different version of csvpivot")
+        if not isinstance(fields, dict) or sorted(fields) != sorted(STATE_FIELDS):
+            raise ValueError("it's damaged: its fields aren't a state's")
+        state = cls.__new__(cls)
+        vars(state).update(fields)
+        try:
+            # i.e. they're valid
+            state.coltypes, state.casttypes
+        except (KeyError, TypeError, ValueError) as err:
+            raise ValueError(f"it's damaged: its column types can't be made: {err}")
+        return state
+
+    def dumps(self) -> bytes:
+        return pickle.dumps((STATE_VERSION, vars(self)), pickle.HIGHEST_PROTOCOL)
+
+    def mismatch(self, spec: str, input_path: str) -> OptionalType[str]:
+        """why the state can't be carried on for this pivot of input_path, or None if it can"""
+        if spec != self.spec:
+            return "it was saved by a pivot with different options"
+        if os.path.getsize(input_path) < self.offset:
+            return "the input file is smaller than it was"
+        if prefix_check(input_path, self.offset) != self.check:
+            return "the input file's existing rows have changed"
+        return None
+
+
+def type_names(types: ListType[agate.DataType]) -> ListType[str]:
+    """e.g. "TimeBucket(Date)" for a column type that wraps another"""
+    names = []
+    for t in types:
+        inner = getattr(t, "data_type", None)
+        name = type(t).__name__
+        names.append(f"{name}({type(inner).__name__})" if inner else name)
+    return names
+
+
+class PartialPivot(object):
+    """
+    A pivot's partial aggregates – its engine's state, with each group's accumulators (counts, sums, sketches,
+    etc.) rather than their results – saved by `csvpivot --emit-state` so that pivots of separate files, e.g. on
+    separate machines, can be merged by `csvpivot --merge` without reading the files again.
+
+    pivot: the pivot's rows, column, and aggregations – as given to -a – and the input's column names, from
+        which its plan is made again; partials can only be merged if they're of the same pivot
+
+    The used columns' types, and the types that they were cast with, are kept as their type_spec()s, and the
+    engine as its class name and its to_state(), to be loaded by an engine made again from the plan. Files are
+    loaded with StateUnpickler, since they might come from elsewhere
+    """
+
+    def __init__(
+        self,
+        pivot: dict,
+        coltypes: ListType[agate.DataType],
+        casttypes: ListType[agate.DataType],
+        engine: PivotEngine,
+    ):
+        self.pivot = pivot
+        self.coltype_specs = [type_spec(t) for t in coltypes]
+        self.casttype_specs = [type_spec(t) for t in casttypes]
+        self.engine_name = type(engine).__name__
+        self.engine_state = engine.to_state()
+
+    @property
+    def coltypes(self) -> ListType[agate.DataType]:
+        """the used columns' types, e.g. for PivotPlan.bind()"""
+        return [spec_type(s) for s in self.coltype_specs]
+
+    @property
+    def casttypes(self) -> ListType[agate.DataType]:
+        return [spec_type(s) for s in self.casttype_specs]
+
+    def load_engine(self, engine: PivotEngine) -> PivotEngine:
+        """engine, a new one of the saved class, made for the same plan, with the saved groups"""
+        try:
+            return load_engine(engine, self.engine_name, self.engine_state)
+        except ValueError as err:
+            raise InvalidPartialAggregate(f"Partial aggregates can't be loaded: {err}")
+
+    @classmethod
+    def load(cls, path: str) -> "PartialPivot":
+        with open(path, "rb") as f:
+            data = f.read()
+        header = len(PARTIAL_MAGIC) + 1
+        if not data.startswith(PARTIAL_MAGIC) or len(data) < header:
+            raise InvalidPartialAggregate(
+                f"{path} isn't a file of partial aggregates saved by csvpivot --emit-state"
+            )
+        if data[header - 1] != PARTIAL_VERSION:
+            raise InvalidPartialAggregate(
+                f"{path} was saved by a different version of csvpivot --emit-state"
+            )
+        partial = cls.__new__(cls)
+        try:
+            saved = loads(zlib.decompress(data[header:]))
+            if sorted(saved) != sorted(PARTIAL_FIELDS):
+                raise ValueError(f"its fields are {sorted(saved)}")
+            vars(partial).update(saved)
+            # i.e. they're valid
+            partial.coltypes, partial.casttypes
+        except Exception as err:
+            raise InvalidPartialAggregate(
+                f"{path} is damaged, or isn't a file of partial aggregates: {err}"
+            )
+        return partial
+
+    def dumps(self) -> bytes:
+        """PARTIAL_MAGIC and PARTIAL_VERSION, then the compressed pickle of a dict of PARTIAL_FIELDS"""
+        data = pickle.dumps(vars(self), pickle.HIGHEST_PROTOCOL)
+        return PARTIAL_MAGIC + bytes([PARTIAL_VERSION]) + zlib.compress(data)
+
+    def mismatch(self, other: "PartialPivot") -> OptionalType[str]:
+        """why other can't be merged into this partial, or None if it can"""
+        if other.pivot != self.pivot:
+            return "they're of pivots with different columns or aggregations"
+        if other.engine_name != self.engine_name:
+            return "they were aggregated by different engines"
+        if other.casttype_specs != self.casttype_specs:
+            theirs, mine = type_names(other.casttypes), type_names(self.casttypes)
+            if theirs == mine:
+                return "their columns' types have different options, e.g. date formats"
+            return f"their columns have different types: {theirs} instead of {mine}"
+        return None
+
+
+def save_state(path: str, data: bytes) -> NoReturnType:
+    """written to a temporary file first, so that an interrupted run doesn't leave a corrupt state"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -31,6 +31,31 @@ class MissingAggregationArgument(CustomException):
     pass
 
 
+class InvalidAggregationArgument(CustomException):
+    """
+    this is used when an aggregation's non-column argument is out of range or the wrong kind of value,
+    e.g. the percentile in `percentile~:age,101`
+    """
+
+    pass
+
+
+class MismatchedHeaders(CustomException):
+    """
+    this is used when a command is given more than one input file, but their header rows aren't all the same
+    """
+
+    pass
+
+
+class InvalidPartialAggregate(CustomException):
+    """
+    this is used when csvpivot --merge is given a file that wasn't saved by --emit-state, or files of different pivots
+    """
+
+    pass
+
+
 class InvalidRange(CustomException):
     pass
 
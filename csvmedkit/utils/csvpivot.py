@@ -1,20 +1,113 @@
 from argparse import _AppendAction as argAppendAction, _copy_items as arg_copy_items
-import csv
 from collections import namedtuple
-from io import StringIO
+import contextlib
+import csv
+from decimal import Decimal
+import glob
+import itertools
+import operator
+import os
+import re
+import shutil
 import sys
+import tempfile
 from typing import (
+    Dict as DictType,
+    Iterator as IteratorType,
     List as ListType,
     NoReturn as NoReturnType,
+    TextIO as TextIOType,
     Tuple as TupleType,
     Optional as OptionalType,
 )
 
+from csvkit.cli import make_default_headers
+
 from csvmedkit import agate
+from csvmedkit.__about__ import __version__
 from csvmedkit.exceptions import *
+from csvmedkit.cmk.accumulators import Uncast
 from csvmedkit.cmk.aggs import Aggy, Aggregates
+from csvmedkit.cmk.buckets import split_bucket
+from csvmedkit.cmk.cache import DEFAULT_CACHE_SIZE, ResultCache, digest
 from csvmedkit.cmk.cmkutil import CmkUtil, UniformReader
-from csvmedkit.cmk.helpers import cmk_parse_column_ids, cmk_parse_delimited_str
+from csvmedkit.cmk.columnar import NumpyPivotEngine, np, numpy_supports
+from csvmedkit.cmk.engine import (
+    PivotEngine,
+    PresortedPivotEngine,
+    choose_types,
+    cube,
+    having,
+    project_rows,
+    remaining_types,
+    rollup,
+    select_top,
+    typed_rows,
+    untested_rows,
+)
+from csvmedkit.cmk.floats import Float
+from csvmedkit.cmk.plan import PivotPlan
+from csvmedkit.cmk.parallel import (
+    aggregate_range,
+    data_offset,
+    infer_range,
+    map_shards,
+    read_range,
+    record_ranges,
+)
+from csvmedkit.cmk.spill import SpillingPivotEngine
+from csvmedkit.cmk.state import (
+    PartialPivot,
+    PivotState,
+    last_record_end,
+    prefix_check,
+    save_state,
+)
+from csvmedkit.cmk.helpers import (
+    cmk_format_memory_size,
+    cmk_parse_column_ids,
+    cmk_parse_delimited_str,
+    cmk_parse_memory_size,
+)
+
+COLUMN_TYPE_NAMES = ["boolean", "date", "datetime", "number", "text", "timedelta"]
+
+# the aggregations that --float calculates with floats, other than count
+FLOAT_AGGREGATES = ("mean", "median", "percentile", "quartiles", "stdev", "sum")
+
+# the comparisons that --having can make, e.g. `count_of>=100`
+HAVING_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "!=": operator.ne,
+    "==": operator.eq,
+    "=": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+HAVING_PATTERN = re.compile(
+    r"\s*(.+?)\s*({})\s*(.*?)\s*".format("|".join(map(re.escape, HAVING_OPERATORS)))
+)
+
+# options that don't change the output, or that are part of the cache key in normalized form
+UNCACHED_OPTIONS = {
+    "aggregates_list",
+    "cache_dir",
+    "cache_size",
+    "emit_state",
+    "input_path",
+    "jobs",
+    "list_aggs",
+    "max_memory",
+    "more_input_paths",
+    "pivot_colname",
+    "pivot_rownames",
+    "skip_lines",
+    "state",
+    "stats",
+    "verbose",
+    "zero_based",
+}
 
 
 class AppendAggyAction(argAppendAction):
@@ -33,6 +126,15 @@ class Parser:
 
     def add_arguments(self):
 
+        self.argparser.add_argument(
+            metavar="MORE_FILES",
+            nargs="*",
+            dest="more_input_paths",
+            help="""More CSV files to pivot, as if they were concatenated with FILE, e.g. daily exports.
+                                    Their header rows must all be the same. FILE and MORE_FILES can also be glob patterns,
+                                    e.g. 'exports/*.csv'""",
+        )
+
         self.argparser.add_argument(
             "--date-format",
             dest="date_format",
@@ -67,6 +169,151 @@ class Parser:
             help="Disable type inference when parsing the input.",
         )
 
+        self.argparser.add_argument(
+            "--infer-rows",
+            dest="infer_rows",
+            type=int,
+            help="""Infer column types from only the first INFER_ROWS rows of the input, instead of every row.
+                                    A later value that doesn't fit its column's inferred type is an error""",
+        )
+
+        self.argparser.add_argument(
+            "--types",
+            dest="type_overrides",
+            type=str,
+            help="""Comma-separated column names (or indexes), each followed by a colon and the column's type,
+                                    which is then not inferred: e.g. `--types "age:number,zip:text"`. Types are: """
+            + ", ".join(COLUMN_TYPE_NAMES),
+        )
+
+        self.argparser.add_argument(
+            "-j",
+            "--jobs",
+            dest="jobs",
+            type=int,
+            help="""The number of processes with which to read and aggregate the input. Only applies when
+                                    the input is an uncompressed file, i.e. not piped data. Default is 1, or
+                                    the number of CPUs when there is more than one input file""",
+        )
+
+        self.argparser.add_argument(
+            "--engine",
+            dest="engine",
+            choices=["python", "numpy"],
+            default="python",
+            help="""With "numpy", count, sum, mean, stdev, min, and max are calculated (in floating point) with NumPy arrays,
+                                    which is quicker, but not as exact as the default engine's decimal arithmetic.
+                                    Other aggregations, or NumPy not being installed, fall back to the default engine""",
+        )
+
+        self.argparser.add_argument(
+            "--float",
+            dest="float",
+            action="store_true",
+            help="""Calculate sum, mean, and stdev in floating point, with compensated summation, which is quicker than the
+                                    default decimal arithmetic, but may differ from it in the last few digits. The values held
+                                    for median, percentile, and quartiles are held as floats, in a quarter of the memory""",
+        )
+
+        self.argparser.add_argument(
+            "--max-memory",
+            dest="max_memory",
+            type=cmk_parse_memory_size,
+            help="""A rough limit on the memory used to hold the pivot table's groups, e.g. 500M or 2G. Past it,
+                                    groups are moved to temporary files, and merged back together at the end.
+                                    Implies --jobs 1""",
+        )
+
+        self.argparser.add_argument(
+            "--presorted",
+            dest="presorted",
+            action="store_true",
+            help="""The input is already sorted (or at least grouped) by the -r/--pivot-rows columns, so each group is
+                                    aggregated and output as soon as its rows end, holding only one group at a time in memory.
+                                    Implies --jobs 1""",
+        )
+
+        self.argparser.add_argument(
+            "--cache-dir",
+            dest="cache_dir",
+            help="""A directory in which to cache the output. Running the same pivot on the same (unchanged) input file
+                                    again just reads its output from the cache. Piped data isn't cached""",
+        )
+
+        self.argparser.add_argument(
+            "--cache-size",
+            dest="cache_size",
+            type=cmk_parse_memory_size,
+            default=DEFAULT_CACHE_SIZE,
+            help="""The most that --cache-dir can hold, e.g. 500M or 2G; past it, the least recently used outputs
+                                    are deleted. Default is 256M""",
+        )
+
+        self.argparser.add_argument(
+            "--state",
+            dest="state",
+            help="""A file in which to save the pivot's aggregation state. If it already exists, and the input file has only
+                                    been appended to since, only the new rows are read and aggregated. The input can't be piped data.
+                                    Implies --jobs 1""",
+        )
+
+        self.argparser.add_argument(
+            "--emit-state",
+            dest="emit_state",
+            metavar="FILE",
+            help="""Instead of outputting the pivot table, save its partial aggregates – e.g. each group's counts, sums, and
+                                    sketches – to FILE, which --merge can combine with those of the same pivot of other input""",
+        )
+
+        self.argparser.add_argument(
+            "--merge",
+            dest="merge",
+            nargs="+",
+            metavar="FILE",
+            help="""Output the pivot table of the partial aggregates in one or more FILEs saved by --emit-state, instead of
+                                    reading CSV input. The pivot rows, column, and aggregations are those of the FILEs""",
+        )
+
+        self.argparser.add_argument(
+            "--stats",
+            dest="stats",
+            action="store_true",
+            help="""Print statistics about the pivot to stderr: the number of groups, the number of distinct values of each
+                                    pivot row and column, and roughly how much memory their dictionary-encoding saved""",
+        )
+
+        self.argparser.add_argument(
+            "--top",
+            dest="top",
+            type=int,
+            help="""Output only the TOP groups with the largest values of the --by aggregation, largest first,
+                                    instead of every group""",
+        )
+
+        self.argparser.add_argument(
+            "--bottom",
+            dest="bottom",
+            type=int,
+            help="""Output only the BOTTOM groups with the smallest values of the --by aggregation, smallest first""",
+        )
+
+        self.argparser.add_argument(
+            "--by",
+            dest="top_by",
+            help="""The title of the aggregation (i.e. its output column's name) that --top or --bottom picks groups by.
+                                    Default is the first aggregation""",
+        )
+
+        self.argparser.add_argument(
+            "--having",
+            dest="having",
+            action="append",
+            metavar="CONDITION",
+            help="""Output only the groups whose result of an aggregation meets a condition, e.g. "count_of>=100":
+                                    an aggregation's title, then one of >=, <=, !=, =, >, <, then a value.
+                                    Can be given more than once, for groups that meet every condition""",
+        )
+
         ################# unique arguments
 
         self.argparser.add_argument(
@@ -81,7 +328,8 @@ class Parser:
             dest="pivot_rownames",
             type=str,
             help="""The column name(s) on which to use as pivot rows. Should be either one name
-                                    (or index) or a comma-separated list with one name (or index)""",
+                                    (or index) or a comma-separated list with one name (or index). A date or datetime
+                                    column can be grouped by year, quarter, month, week, day, hour, or minute, e.g. date@month""",
         )
 
         self.argparser.add_argument(
@@ -92,6 +340,37 @@ class Parser:
             help="Optionally, a column name/id to use as a pivot column. Only one is allowed",
         )
 
+        self.argparser.add_argument(
+            "--long",
+            action="store_true",
+            help="""With -c/--pivot-column, output a row for each combination of the pivot rows and a pivot column value
+                                    that there is data for – the pivot row values, the pivot column value, and the result of each
+                                    aggregation – instead of a column for every pivot column value. More than one aggregation is allowed""",
+        )
+
+        self.argparser.add_argument(
+            "--fill",
+            dest="fill",
+            metavar="VALUE",
+            help="""With -c/--pivot-column, the value for the cells that there is no data for. Default is 0 for
+                                    numeric aggregations, and empty otherwise""",
+        )
+
+        self.argparser.add_argument(
+            "--rollup",
+            action="store_true",
+            help="""With more than one pivot row column, also output subtotals: e.g. for -r "a,b,c", of each a and b,
+                                    then of each a, and then a grand total, each right after the rows it sums up.
+                                    A "grouping" column names the columns that each row is grouped by""",
+        )
+
+        self.argparser.add_argument(
+            "--cube",
+            action="store_true",
+            help="""Like --rollup, but with subtotals for every combination of the pivot row columns, e.g. for -r "a,b",
+                                    of each a, of each b, and a grand total, after all of the rows""",
+        )
+
         self.argparser.add_argument(
             "-a",
             "--agg",
@@ -113,44 +392,102 @@ class Props:
     """
 
     @property
-    def pivot_column_name(self) -> OptionalType[str]:
+    def input_paths(self) -> ListType[str]:
+        """
+        FILE and MORE_FILES, with glob patterns expanded (in sorted order), and without empty (0-byte) files,
+        unless they're all empty
+        """
+        if getattr(self, "_input_paths", None) is None:
+            paths = []
+            for path in [self.args.input_path, *self.args.more_input_paths]:
+                if path and glob.has_magic(path):
+                    # a pattern that matches nothing is left as is, to fail as a missing file
+                    paths.extend(sorted(glob.glob(path)) or [path])
+                elif path:
+                    paths.append(path)
+            nonempty = [
+                p for p in paths if not (os.path.isfile(p) and not os.path.getsize(p))
+            ]
+            self._input_paths = nonempty or paths[:1]
+        return self._input_paths
+
+    @property
+    def jobs(self) -> int:
+        if self.args.jobs:
+            return self.args.jobs
+        return (os.cpu_count() or 1) if len(self.input_paths) > 1 else 1
 
-        if self.args.pivot_colname:
+    @property
+    def column_type_overrides(self) -> DictType[int, agate.DataType]:
+        """the types given by --types, by input column index"""
+        overrides = {}
+        if self.args.type_overrides:
+            named_types = {
+                "boolean": agate.Boolean(),
+                "date": agate.Date(date_format=self.args.date_format),
+                "datetime": agate.DateTime(datetime_format=self.args.datetime_format),
+                "number": agate.Number(locale=self.args.locale),
+                "text": agate.Text(),
+                "timedelta": agate.TimeDelta(),
+            }
+            for item in cmk_parse_delimited_str(self.args.type_overrides):
+                colname, _, typename = item.rpartition(":")
+                dtype = named_types.get(typename.strip().lower())
+                if not colname or not dtype:
+                    self.argparser.error(
+                        f"--types expects column:type pairs, where type is one of {COLUMN_TYPE_NAMES}, not: '{item}'"
+                    )
+                for i in cmk_parse_column_ids(
+                    colname, self.i_column_names, column_offset=self.column_offset
+                ):
+                    overrides[i] = dtype
+        return overrides
+
+    def _pivot_key_names(self, ids: str) -> ListType[str]:
+        """
+        The column names given by -r or -c, each of which is a column's name or index, or a time bucket of one,
+        e.g. "date@month" or "3@year", which is named after the column, e.g. "date@month"
+        """
+        if not "@" in ids:
             cids = cmk_parse_column_ids(
-                self.args.pivot_colname,
-                self.i_column_names,
-                column_offset=self.column_offset,
+                ids, self.i_column_names, column_offset=self.column_offset
             )
-        else:
-            cids = None
+            return [self.i_column_names[i] for i in cids]
+
+        names = []
+        for item in ids.split(","):
+            item = item.strip()
+            column, unit = (
+                (item, None) if item in self.i_column_names else split_bucket(item)
+            )
+            cids = cmk_parse_column_ids(
+                column, self.i_column_names, column_offset=self.column_offset
+            )
+            names += [
+                self.i_column_names[i] + (f"@{unit}" if unit else "") for i in cids
+            ]
+        return names
 
-        if cids and len(cids) > 1:
+    @property
+    def pivot_column_name(self) -> OptionalType[str]:
+        names = (
+            self._pivot_key_names(self.args.pivot_colname)
+            if self.args.pivot_colname
+            else []
+        )
+        if len(names) > 1:
             # user passed in -c/--pivot-column value containing multiple column name references
+            cids = [self.i_column_names.index(split_bucket(n)[0]) for n in names]
             self.argparser.error(
                 f"Only one -c/--pivot-column is allowed, not {len(cids)}: {cids}"
             )
 
-        return self.i_column_names[cids[0]] if cids else None
+        return names[0] if names else None
 
     @property
-    def pivot_row_ids(self) -> ListType:
+    def pivot_row_names(self) -> ListType[str]:
         if self.args.pivot_rownames:
-            return cmk_parse_column_ids(
-                self.args.pivot_rownames,
-                self.i_column_names,
-                column_offset=self.column_offset,
-            )
-        else:
-            return []
-
-    @property
-    def pivot_row_names(self) -> ListType:
-        """
-        prereqs:
-         - self.pivot_row_ids
-        """
-        if self.pivot_row_ids:
-            return [self.i_column_names[i] for i in self.pivot_row_ids]
+            return self._pivot_key_names(self.args.pivot_rownames)
         else:
             return []
 
@@ -164,138 +501,799 @@ class CSVPivot(UniformReader, Props, Parser, CmkUtil):
             self.print_available_aggregates()
             return
 
-        if not self.args.pivot_rownames and not self.args.pivot_colname:
+        if self.args.merge:
+            if (
+                self.args.input_path
+                or self.args.more_input_paths
+                or self.args.pivot_rownames
+                or self.args.pivot_colname
+                or self.args.aggregates_list
+            ):
+                self.argparser.error(
+                    "--merge gets the pivot's rows, column, and aggregations from its files, "
+                    "so input files, -r, -c, and -a can't be given"
+                )
+            if self.args.emit_state or self.args.state or self.args.cache_dir:
+                self.argparser.error(
+                    "--merge can't be used with --emit-state, --state, or --cache-dir"
+                )
+            if (
+                self.args.engine == "numpy"
+                or self.args.float
+                or self.args.type_overrides
+                or self.args.max_memory
+                or self.args.presorted
+            ):
+                self.argparser.error(
+                    "--merge carries on with its files' engine and column types, "
+                    "so --engine numpy, --float, --types, --max-memory, and --presorted can't be given"
+                )
+        elif not self.args.pivot_rownames and not self.args.pivot_colname:
             self.argparser.error(
                 "Either -r/--pivot-rows or -c/--pivot-column must be specified. Both cannot be left unspecified."
             )
 
-        if self.args.pivot_colname and (
-            self.args.aggregates_list and len(self.args.aggregates_list) > 1
+        paths = self.input_paths
+        if paths:
+            # the first file is read for its header row, and opened by CSVKitUtility.run()
+            self.args.input_path = paths[0]
+        if len(paths) > 1:
+            if "-" in paths:
+                self.argparser.error(
+                    "Piped data can't be pivoted together with other input files"
+                )
+            if any(os.path.splitext(p)[1] in (".gz", ".bz2") for p in paths):
+                self.argparser.error(
+                    "Compressed input files can only be pivoted one at a time"
+                )
+            if '"\n'.encode(self.args.encoding, errors="replace") != b'"\n':
+                self.argparser.error(
+                    f"Input files in {self.args.encoding} can only be pivoted one at a time"
+                )
+            if self.args.presorted or self.args.max_memory or self.args.state:
+                self.argparser.error(
+                    "--presorted, --max-memory, and --state can't be used with more than one input file"
+                )
+
+        if self.args.jobs is not None and self.args.jobs < 1:
+            self.argparser.error("-j/--jobs must be at least 1")
+
+        if self.args.engine == "numpy" and (
+            self.args.presorted or self.args.max_memory
         ):
+            self.argparser.error(
+                "--engine numpy can't be used with --presorted or --max-memory"
+            )
 
-            aggcount = len(self.args.aggregates_list)
-            agglist = "".join("\n- %s" % str(a) for a in self.args.aggregates_list)
+        if self.args.state:
+            path = self.args.input_path
+            if not path or path == "-" or os.path.splitext(path)[1] in (".gz", ".bz2"):
+                self.argparser.error(
+                    "--state needs an uncompressed input file, not piped or compressed data"
+                )
+            if self.args.presorted or self.args.max_memory:
+                self.argparser.error(
+                    "--state can't be used with --presorted or --max-memory"
+                )
 
+        if self.args.emit_state and (
+            self.args.presorted or self.args.max_memory or self.args.cache_dir
+        ):
             self.argparser.error(
-                """Cannot have more than one aggregation when --pivot-column is specified. """
-                + """You specified --pivot-column '{colname}' and also {aggcount} aggregations: {agglist}""".format(
-                    colname=self.args.pivot_colname, aggcount=aggcount, agglist=agglist
+                "--emit-state can't be used with --presorted, --max-memory, or --cache-dir"
+            )
+
+        if self.args.top is not None or self.args.bottom is not None:
+            if self.args.top is not None and self.args.bottom is not None:
+                self.argparser.error("--top and --bottom can't be used together")
+            if (self.args.top or self.args.bottom) < 1:
+                self.argparser.error("--top and --bottom must be at least 1")
+        elif self.args.top_by:
+            self.argparser.error("--by only applies to --top or --bottom")
+
+        if self.args.rollup or self.args.cube:
+            if self.args.rollup and self.args.cube:
+                self.argparser.error("--rollup and --cube can't be used together")
+            if self.args.max_memory:
+                self.argparser.error(
+                    "--rollup and --cube can't be used with --max-memory"
+                )
+            if self.args.top is not None or self.args.bottom is not None:
+                self.argparser.error(
+                    "--rollup and --cube can't be used with --top or --bottom"
                 )
+
+        if self.args.infer_rows is not None and self.args.infer_rows < 1:
+            self.argparser.error("--infer-rows must be at least 1")
+
+        if self.args.long and self.args.fill is not None:
+            self.argparser.error(
+                "--fill can't be used with --long, which has no empty cells to fill"
+            )
+
+        if not self.args.merge:
+            # otherwise, checked against the pivot column of the files
+            self._check_pivot_column_options(
+                self.args.pivot_colname, self.args.aggregates_list or []
             )
         super().run()
 
-    def _validate_aggy_column_arguments(
-        self, aggy: Aggy, table: agate.Table
+    def _check_pivot_column_options(
+        self, pivot_colname: OptionalType[str], aggregates_list: list
     ) -> NoReturnType:
+        """the checks of the options that depend on whether there's a -c/--pivot-column"""
+        if not pivot_colname:
+            if self.args.long or self.args.fill is not None:
+                self.argparser.error(
+                    "--long and --fill only apply to -c/--pivot-column"
+                )
+            return
+
+        if self.args.top is not None or self.args.bottom is not None:
+            self.argparser.error(
+                "--top and --bottom can't be used with -c/--pivot-column"
+            )
+        if self.args.having and not self.args.long:
+            self.argparser.error(
+                "--having can't be used with -c/--pivot-column, except with --long"
+            )
+        if self.args.rollup or self.args.cube:
+            self.argparser.error(
+                "--rollup and --cube can't be used with -c/--pivot-column"
+            )
+        if not self.args.long and len(aggregates_list) > 1:
+
+            aggcount = len(aggregates_list)
+            agglist = "".join("\n- %s" % str(a) for a in aggregates_list)
+
+            self.argparser.error(
+                """Cannot have more than one aggregation when --pivot-column is specified. """
+                + """You specified --pivot-column '{colname}' and also {aggcount} aggregations: {agglist}""".format(
+                    colname=pivot_colname, aggcount=aggcount, agglist=agglist
+                )
+            )
+
+    def _infer_column_types(
+        self,
+        column_ids: ListType[int],
+        shards: ListType[TupleType[str, TupleType[int, int]]],
+    ) -> ListType[agate.DataType]:
+        """
+        Same inference as agate.Table.from_csv(column_types=self.get_column_types()), but only for the
+        used columns whose types aren't given by --types, and without holding any rows in memory.
+
+        With --infer-rows, only that many rows are tested, and then put back in front of the rest. Otherwise,
+        every row is tested – in parallel, if there are shards – and the input is read again afterwards
         """
-        Aggy is csvpivot/agate.Table agnostic, so this method:
+        overrides = self.column_type_overrides
+        types = self.get_column_types()._possible_types
+        # e.g. -r date,date@month: the same input column, whose type is only inferred once
+        infer_ids = [i for i in dict.fromkeys(column_ids) if i not in overrides]
+
+        if not infer_ids:
+            inferred = []
+        elif len(types) == 1:
+            # i.e. -I/--no-inference
+            inferred = [types[0]] * len(infer_ids)
+        elif self.args.infer_rows:
+            sample = list(itertools.islice(self.i_rows, self.args.infer_rows))
+            self._rows = itertools.chain(sample, self._rows)
+            rows = untested_rows(project_rows(sample, infer_ids))
+            inferred = choose_types(remaining_types(rows, types, len(infer_ids)), types)
+        elif shards:
+            hypotheses = map_shards(
+                infer_range,
+                shards,
+                self.jobs,
+                encoding=self.args.encoding,
+                reader_kwargs=self.reader_kwargs,
+                column_ids=infer_ids,
+                types=types,
+            )
+            # a type is possible for a column only if it is possible in every shard
+            inferred = choose_types(
+                [set.intersection(*h) for h in zip(*hypotheses)], types
+            )
+        else:
+            if not self.input_file.seekable():
+                self._spool_input()
+            rows = untested_rows(project_rows(self.i_rows, infer_ids))
+            inferred = choose_types(remaining_types(rows, types, len(infer_ids)), types)
+            self._reread_input()
 
-        - makes sure that aggy's ostensible column_name argument is actually in the table
-        - typecasts the second argument of count() to match the datatype of the column that it counts
+        coltypes = {**dict(zip(infer_ids, inferred)), **overrides}
+        return [coltypes[i] for i in column_ids]
 
+    def _input_shards(self) -> ListType[TupleType[str, TupleType[int, int]]]:
         """
+        Splits the input into (path, byte_range) shards, to be read and aggregated separately. With more
+        than one input file, each file is split into about (-j/--jobs ÷ number of files) shards, or at least one.
 
-        ############################
-        # checking valid column name
-        # (For now, all possible Aggregates use the first argument (if it exists) as the column_name to aggregate)
-        if aggy._args:
-            _col = aggy._args[0]
-            # the following is redundant with the filter_rows() check already done
-            if _col not in table.column_names:
-                raise ColumnNameError(
-                    "ColumnNameError: "
-                    + f"Attempted to perform `{aggy.slug}('{_col}', ...)`. "
-                    + f"But '{_col}' was expected to be a valid column name, i.e. from: {table.column_names}",
+        A single input file is split into one byte range per job. Returns an empty list if it can't be split,
+        e.g. piped or compressed data, or quotes escaped with -p/--escapechar
+        """
+        paths = self.input_paths
+        quotechar = self._input_quotechar()
+        if len(paths) > 1:
+            count = 1
+            if not self.reader_kwargs.get("escapechar"):
+                count = max(1, self.jobs // len(paths))
+            return [
+                (path, byte_range)
+                for path in paths
+                for byte_range in record_ranges(
+                    path,
+                    data_offset(
+                        path,
+                        self._skip_lines_count,
+                        not self.args.no_header_row,
+                        quotechar,
+                    ),
+                    count,
+                    quotechar,
                 )
+            ]
 
-        ################################################################
-        # if the aggregation is count(), and there are 2 arguments
-        #   then the 2nd argument is typecasted against the table.column
-        #   (i.e. the column name referenced by the first arg)
-        if len(aggy._args) > 1 and aggy.slug == "count":
-            col_name, cval = aggy.agg_args[0:2]
-            try:
-                # get column from first arg, which is presumably a column_name
-                _col: agate.Column = next(
-                    c for c in table.columns if c.name == col_name
+        path = self.args.input_path
+        if (
+            self.jobs < 2
+            or self.args.max_memory
+            or self.args.presorted
+            or self.args.state
+            or not path
+            or path == "-"
+            or os.path.splitext(path)[1] in (".gz", ".bz2")
+            or self.reader_kwargs.get("escapechar")
+            or '"\n'.encode(self.args.encoding, errors="replace") != b'"\n'
+        ):
+            return []
+
+        start = data_offset(
+            path, self._skip_lines_count, not self.args.no_header_row, quotechar
+        )
+        return [
+            (path, byte_range)
+            for byte_range in record_ranges(path, start, self.jobs, quotechar)
+        ]
+
+    def _input_quotechar(self) -> OptionalType[str]:
+        if self.reader_kwargs.get("quoting") == csv.QUOTE_NONE:
+            return None
+        return self.reader_kwargs.get("quotechar", '"')
+
+    def _aggregate_in_parallel(
+        self,
+        engine: PivotEngine,
+        column_ids: ListType[int],
+        coltypes: ListType[agate.DataType],
+        shards: ListType[TupleType[str, TupleType[int, int]]],
+    ) -> PivotEngine:
+        engines = map_shards(
+            aggregate_range,
+            shards,
+            self.jobs,
+            encoding=self.args.encoding,
+            reader_kwargs=self.reader_kwargs,
+            column_ids=column_ids,
+            coltypes=coltypes,
+            engine=engine,
+        )
+        # merged in shard (and file) order, so groups are still ordered by first appearance
+        for e in engines:
+            engine.merge(e)
+        return engine
+
+    def _numpy_column_types(
+        self, plan: PivotPlan, coltypes: ListType[agate.DataType]
+    ) -> OptionalType[ListType[agate.DataType]]:
+        """
+        With --engine numpy, the types to cast the used columns with: the aggregated columns are cast to floats.
+        None if the NumPy engine can't do every aggregation
+        """
+        if self.args.engine != "numpy":
+            return None
+        if np is None:
+            self.log_err(
+                "NumPy isn't installed, so the default engine is used instead of --engine numpy"
+            )
+            return None
+
+        if self.args.rollup or self.args.cube:
+            self.log_err(
+                "--engine numpy can't do --rollup or --cube, so the default engine is used instead"
+            )
+            return None
+
+        for a in plan.aggs:
+            col = a.column_name
+            if not numpy_supports(a.slug, a.agg_args) or (
+                col
+                and (
+                    col in plan.key_names
+                    or not isinstance(coltypes[a.column_ids[0]], agate.Number)
                 )
-            except StopIteration as err:
-                raise ColumnIdentifierError(
-                    f"'{col_name}' – from `{argtext}` – is expected to be a column name, but it was not found in the table: {table.column_names}"
+            ):
+                self.log_err(
+                    f"--engine numpy can't do `{a}`, so the default engine is used instead"
                 )
+                return None
+
+        floatnames = {a.column_name for a in plan.aggs if a.column_name}
+        return [
+            Float(locale=self.args.locale) if c in floatnames else t
+            for c, t in zip(plan.column_names, coltypes)
+        ]
+
+    def _float_column_types(
+        self, plan: PivotPlan, coltypes: ListType[agate.DataType]
+    ) -> ListType[agate.DataType]:
+        """
+        With --float, the types to cast the used columns with: a Number column that's only summed, averaged,
+        stdev'd, counted, or aggregated by an exact percentile is cast to float
+        """
+        if not self.args.float:
+            return coltypes
+        floatnames, other = set(), set(plan.key_names)
+        for a in plan.aggs:
+            if a.slug in FLOAT_AGGREGATES or (
+                a.slug == "count" and not a.counts_values
+            ):
+                floatnames.add(a.column_name)
             else:
-                dtype = _col.data_type
+                other.update(a.column_names)
+        floatnames -= other
+        return [
+            (
+                Float(locale=self.args.locale)
+                if c in floatnames and isinstance(t, agate.Number)
+                else t
+            )
+            for c, t in zip(plan.column_names, coltypes)
+        ]
 
-            # attempt a data_type conversion
-            try:
-                dval = dtype.cast(cval)
-                # modify agg_args
-            except agate.CastError as err:
-                typename: str = type(dtype).__name__
-                raise agate.CastError(
-                    f"You attempted to count '{cval}' in column '{col_name}', which has datatype {typename}. But '{cval}' could not be converted to {typename}."
-                )
+    def _uncast_column_types(
+        self, plan: PivotPlan, coltypes: ListType[agate.DataType]
+    ) -> ListType[agate.DataType]:
+        """
+        The types to cast the used columns with: a column that's only counted by value, i.e. only by
+        `count:col,value` and `countif:col,...`, isn't cast at all. Its raw values are matched instead – each
+        distinct one is cast just once, by the accumulators' shared ValueMatcher
+        """
+        by_value, other = set(), set(plan.key_names)
+        for a in plan.aggs:
+            if a.counts_values:
+                by_value.add(a.column_name)
             else:
-                aggy._args[1] = dval
+                other.update(a.column_names)
+        by_value -= other
+        return [
+            Uncast(t) if c in by_value else t
+            for c, t in zip(plan.column_names, coltypes)
+        ]
 
-    def _filter_input_rows(
-        self, rows: agate.csv.DictReader, colnames: ListType[str]
-    ) -> agate.Table:
+    def _build_engine(
+        self,
+        plan: PivotPlan,
+        casttypes: ListType[agate.DataType],
+        use_numpy: bool = False,
+    ) -> PivotEngine:
         """
-        trim self.i_rows to the actually used columns
+        An engine for the plan's key columns, and its aggregations' columns and accumulators, for columns
+        cast with casttypes
         """
-        # trim self.intable to the relevant, i.e. actually used columns
-        # TODO: clean this ugliness up
-        used_cols: list = self.pivot_row_names or []
-        if self.pivot_column_name:
-            used_cols.append(self.pivot_column_name)
-        if self.args.aggregates_list:
-            used_cols.extend(
-                # set is used so that only unique columns are included in the used_cols subset
-                list(
-                    set(
-                        a.column_name
-                        for a in self.args.aggregates_list
-                        if a.column_name
-                    )
-                )
+        key_ids, arg_ids = plan.key_ids, plan.arg_ids
+        if use_numpy:
+            return NumpyPivotEngine(key_ids, [a.slug for a in plan.aggs], arg_ids)
+        factories = plan.factories(casttypes)
+        if self.args.presorted:
+            return PresortedPivotEngine(
+                key_ids, factories, arg_ids, sorted_width=len(plan.row_names)
             )
+        if self.args.max_memory:
+            return SpillingPivotEngine(
+                key_ids, factories, arg_ids, max_memory=self.args.max_memory
+            )
+        return PivotEngine(key_ids, factories, arg_ids)
 
-        for c in used_cols:
-            if not c in colnames:
-                raise ColumnNameError(
-                    f"'{c}' is not a valid column name; column names are: {colnames}"
-                )
+    def _pivot_spec(self, plan: PivotPlan) -> dict:
+        """
+        Every option that affects the output, with column indexes resolved to names, e.g. `-r 1` and
+        `-r name` have the same spec
+        """
+        options = {
+            k: v for k, v in vars(self.args).items() if k not in UNCACHED_OPTIONS
+        }
+        return {
+            "version": __version__,
+            "skip_lines": self._skip_lines_count,
+            **plan.spec(),
+            "options": options,
+        }
+
+    def _cache_key(self, cache: ResultCache, plan: PivotPlan) -> OptionalType[str]:
+        """the input files' fingerprints, plus the pivot's spec. None for piped data"""
+        paths = self.input_paths
+        if not paths or "-" in paths:
+            return None
+        return digest(
+            {
+                **self._pivot_spec(plan),
+                "input": [cache.fingerprint(path) for path in paths],
+            }
+        )
+
+    def _load_state(self, spec: str) -> OptionalType[PivotState]:
+        """the --state to carry on from, if there is one, and it's for this pivot and input file"""
+        try:
+            state = PivotState.load(self.args.state)
+        except ValueError as err:
+            self.log_err(f"Starting --state {self.args.state} over, because {err}")
+            return None
+        if state is None:
+            return None
+        reason = state.mismatch(spec, self.args.input_path)
+        if reason:
+            self.log_err(f"Starting --state {self.args.state} over, because {reason}")
+            return None
+        return state
+
+    def _consume_appended(
+        self,
+        engine: PivotEngine,
+        state: OptionalType[PivotState],
+        spec: str,
+        column_ids: ListType[int],
+        coltypes: ListType[agate.DataType],
+        casttypes: ListType[agate.DataType],
+    ) -> bytes:
+        """
+        Consumes the input file's rows from where `state` left off (or from the start), and returns the
+        new state to save. That state ends at the last complete record: a last row without a newline,
+        e.g. one that is still being written, is aggregated for this run's output, but read again next time
+        """
+        path = self.args.input_path
+        if state:
+            start = state.offset
+        else:
+            start = data_offset(
+                path,
+                self._skip_lines_count,
+                not self.args.no_header_row,
+                self._input_quotechar(),
+            )
+        end = last_record_end(path, start)
+        size = os.path.getsize(path)
+
+        def rows(byte_range):
+            rows = read_range(path, byte_range, self.args.encoding, self.reader_kwargs)
+            return typed_rows(project_rows(rows, column_ids), casttypes)
+
+        engine.consume(rows((start, end)))
+        saved = PivotState(
+            spec, coltypes, casttypes, engine, end, prefix_check(path, end)
+        ).dumps()
+        if size > end:
+            engine.consume(rows((end, size)))
+        return saved
 
-        with StringIO() as ftxt:
-            fd = csv.DictWriter(ftxt, fieldnames=used_cols)
-            fd.writeheader()
+    def _write_output(
+        self,
+        engine: PivotEngine,
+        plan: PivotPlan,
+        output: TextIOType,
+    ) -> NoReturnType:
+        """
+        Same as what agate.Table.to_csv() would write for the result of Table.pivot(), or
+        for Table.group_by(...).aggregate()
+        """
+        rownames = plan.row_names
+        rowtypes = plan.key_types()[: len(rownames)]
+        aggtypes = plan.output_types()
+        conditions = self._having_conditions(plan)
+        csvify_fill = None
 
-            for row in rows:
-                fd.writerow({c: row[c] for c in used_cols})
+        if plan.column_name and not self.args.long:
+            aggtype = aggtypes[0]
+            if self.args.fill is not None:
+                # a placeholder for the cells with no group, which are written as the --fill value
+                default_value = object()
 
-            ftxt.seek(0)
-            table = agate.Table.from_csv(
-                ftxt,
-                skip_lines=self.args.skip_lines,
-                sniff_limit=self.args.sniff_limit,
-                column_types=self.get_column_types(),
-                **self.reader_kwargs,
+                def csvify_fill(value):
+                    if value is default_value:
+                        return self.args.fill
+                    return aggtype.csvify(value)
+
+            else:
+                # same default as agate.Table.denormalize
+                default_value = (
+                    Decimal(0) if isinstance(aggtype, agate.Number) else None
+                )
+            fieldnames, rows = engine.crosstab_rows(default_value)
+            header = rownames + fieldnames
+            outtypes = rowtypes + [aggtype] * len(fieldnames)
+        elif plan.column_name:
+            # i.e. --long: the groups, in the same order, with the pivot column's values in a column of their own
+            rows = having(engine.grouped_rows(), conditions, len(plan.key_names))
+            header = plan.key_names + [a.title for a in plan.aggs]
+            outtypes = plan.key_types() + aggtypes
+        elif self.args.rollup or self.args.cube:
+            subtotals = rollup if self.args.rollup else cube
+            rows = having(
+                (
+                    [*key, "+".join(rownames[i] for i in grouping), *values]
+                    for grouping, key, values in subtotals(
+                        engine.items(), engine.factories
+                    )
+                ),
+                conditions,
+                len(rownames) + 1,
             )
-        return table
+            header = rownames + ["grouping"] + [a.title for a in plan.aggs]
+            outtypes = rowtypes + [agate.Text()] + aggtypes
+        else:
+            rows = having(engine.grouped_rows(), conditions, len(rownames))
+            header = rownames + [a.title for a in plan.aggs]
+            outtypes = rowtypes + aggtypes
+            if self.args.top or self.args.bottom:
+                rows = select_top(
+                    rows,
+                    self.args.top or self.args.bottom,
+                    len(rownames) + self._top_by_index(plan),
+                    largest=bool(self.args.top),
+                )
+
+        writer = agate.csv.writer(
+            output, **{"lineterminator": "\n", **self.writer_kwargs}
+        )
+        writer.writerow(header)
+        csvify = [t.csvify for t in outtypes]
+        if csvify_fill:
+            csvify[len(rownames) :] = [csvify_fill] * (len(csvify) - len(rownames))
+        for row in rows:
+            writer.writerow([f(v) for f, v in zip(csvify, row)])
 
     def read_input(self):
-        self._rows = agate.csv.DictReader(self.skip_lines(), **self.reader_kwargs)
-        self._column_names = self._rows.fieldnames
+        # skip_lines() counts self.args.skip_lines down to 0, so remember it for _reread_input()
+        self._skip_lines_count = self.args.skip_lines
+        self._spooled = False
+        self._first_rows = []
+        self._rows = agate.csv.reader(self.skip_lines(), **self.reader_kwargs)
+        if self.args.no_header_row:
+            self._first_rows = [next(self._rows, [])]
+            self._rows = itertools.chain(self._first_rows, self._rows)
+            self._column_names = list(make_default_headers(len(self._first_rows[0])))
+        else:
+            self._column_names = next(self._rows, [])
         self._read_input_done = True
 
+    def _spool_input(self):
+        """
+        e.g. piped data, which can't be read again after type inference: the rest of it is copied to a temporary
+        file (not memory), to be read instead. Only done when inference has to read every row, i.e. not when --types
+        gives every used column's type
+        """
+        spool = tempfile.TemporaryFile(mode="w+", encoding="utf-8", newline="")
+        shutil.copyfileobj(self.input_file, spool)
+        self.input_file = spool
+        self._spooled = True
+        self._reread_input()
+
+    def _reread_input(self):
+        self.input_file.seek(0)
+        if self._spooled:
+            # the header row, or the first row with --no-header-row, was read before the rest was spooled
+            rows = agate.csv.reader(self.input_file, **self.reader_kwargs)
+            self._rows = itertools.chain(self._first_rows, rows)
+            return
+        self.args.skip_lines = self._skip_lines_count
+        self.read_input()
+
     def print_available_aggregates(self):
         outs = self.output_file
         outs.write(f"List of aggregate functions:\n")
         for a in Aggregates.keys():
             outs.write(f"- {a}\n")
 
+    def _check_headers(self) -> NoReturnType:
+        """with more than one input file, every (non-empty) file's header row has to be the same as the first's"""
+        if self.args.no_header_row:
+            return
+        for path in self.input_paths[1:]:
+            with open(path, encoding=self.args.encoding, newline="") as f:
+                for _ in range(self._skip_lines_count):
+                    f.readline()
+                header = next(agate.csv.reader(f, **self.reader_kwargs), [])
+            if header and header != self.i_column_names:
+                raise MismatchedHeaders(
+                    f"The header row of {path} is different from that of {self.input_paths[0]}: "
+                    f"{header} instead of {self.i_column_names}"
+                )
+
+    def _top_by_index(self, plan: PivotPlan) -> int:
+        """the index of the aggregation given by --by, among the plan's aggregations"""
+        if not self.args.top_by:
+            return 0
+        titles = [a.title for a in plan.aggs]
+        if self.args.top_by not in titles:
+            self.argparser.error(
+                f"--by must be the title of one of the aggregations, i.e. one of {titles}, not: '{self.args.top_by}'"
+            )
+        return titles.index(self.args.top_by)
+
+    def _having_conditions(self, plan: PivotPlan) -> ListType[TupleType]:
+        """
+        Each --having condition as (the index of its aggregation among the plan's, comparison, value), where
+        the value is cast to the type of the aggregation's results
+        """
+        titles = [a.title for a in plan.aggs]
+        outtypes = plan.output_types()
+        conditions = []
+        for expr in self.args.having or []:
+            match = HAVING_PATTERN.fullmatch(expr)
+            if not match:
+                self.argparser.error(
+                    f"--having must be an aggregation's title, a comparison, and a value, e.g. count_of>=100, not: '{expr}'"
+                )
+            title, op, value = match.groups()
+            if title not in titles:
+                self.argparser.error(
+                    f"--having must compare the title of one of the aggregations, i.e. one of {titles}, not: '{title}'"
+                )
+            i = titles.index(title)
+            try:
+                dval = outtypes[i].cast(value)
+            except agate.CastError:
+                dval = None
+            if dval is None:
+                self.argparser.error(
+                    f"--having compares '{title}' with '{value}', which isn't a {type(outtypes[i]).__name__} value"
+                )
+            conditions.append((i, HAVING_OPERATORS[op], dval))
+        return conditions
+
+    def _pivot(self, plan: PivotPlan, output: TextIOType) -> NoReturnType:
+        """
+        Infers the used columns' types, aggregates the input, and writes the pivot table to output.
+        With --state, carries on from the saved state – including its column types – if there is one
+        """
+        column_ids = plan.input_ids
+        spec = digest(self._pivot_spec(plan))
+        state = self._load_state(spec) if self.args.state else None
+        if state:
+            shards = []
+            coltypes = state.coltypes
+        else:
+            shards = self._input_shards()
+            coltypes = self._infer_column_types(column_ids, shards)
+
+        # e.g. sum() of a Text column: raise DataTypeError before doing any aggregating
+        plan.bind(coltypes)
+        # i.e. an invalid --by or --having, which can only be checked against the titles of the bound aggregations
+        self._top_by_index(plan)
+        self._having_conditions(plan)
+
+        if state:
+            casttypes = state.casttypes
+            use_numpy = state.engine_name == NumpyPivotEngine.__name__
+            engine = state.load_engine(
+                self._build_engine(plan, casttypes, use_numpy=use_numpy)
+            )
+        else:
+            numpy_types = self._numpy_column_types(plan, coltypes)
+            casttypes = plan.bucketed(
+                numpy_types
+                or self._uncast_column_types(
+                    plan, self._float_column_types(plan, coltypes)
+                )
+            )
+            engine = self._build_engine(
+                plan, casttypes, use_numpy=numpy_types is not None
+            )
+        try:
+            if self.args.state:
+                saved = self._consume_appended(
+                    engine, state, spec, column_ids, coltypes, casttypes
+                )
+            elif shards:
+                engine = self._aggregate_in_parallel(
+                    engine, column_ids, casttypes, shards
+                )
+            else:
+                engine.consume(
+                    typed_rows(project_rows(self.i_rows, column_ids), casttypes)
+                )
+            if self.args.emit_state:
+                partial = PartialPivot(
+                    {
+                        "pivot_rows": plan.row_names,
+                        "pivot_column": plan.column_name,
+                        "aggregates": [str(a) for a in plan.aggs],
+                        "input_names": list(self.i_column_names),
+                    },
+                    coltypes,
+                    casttypes,
+                    engine,
+                )
+                save_state(self.args.emit_state, partial.dumps())
+            else:
+                self._write_output(engine, plan, output)
+        except agate.CastError as err:
+            if state:
+                raise agate.CastError(
+                    f"{err} Column types were inferred when --state {self.args.state} was first saved: "
+                    "delete it to start over, or specify the column's type with --types"
+                )
+            if not self.args.infer_rows:
+                raise
+            raise agate.CastError(
+                f"{err} Column types were inferred from only the first {self.args.infer_rows} rows: "
+                "try a larger --infer-rows, or specify the column's type with --types"
+            )
+        if self.args.state:
+            save_state(self.args.state, saved)
+        if self.args.stats:
+            self._log_stats(engine, plan)
+
+    def _log_stats(self, engine: PivotEngine, plan: PivotPlan) -> NoReturnType:
+        self.log_err(f"Groups: {engine.group_count:,}")
+        for name, d in zip(plan.key_names, engine.dictionaries):
+            if d:
+                self.log_err(f'Distinct values of "{name}": {len(d):,}')
+        encoded, plain = engine.key_memory()
+        if plain:
+            self.log_err(
+                f"Memory used by group keys: {cmk_format_memory_size(encoded)} dictionary-encoded, "
+                f"instead of about {cmk_format_memory_size(plain)} "
+                f"(saved about {cmk_format_memory_size(max(0, plain - encoded))})"
+            )
+
+    def _merge_partials(self, output: TextIOType) -> NoReturnType:
+        """
+        Merges the --merge files' partial aggregates, in the order given, so that groups are in order of
+        first appearance as if their inputs had been pivoted one after another, and writes the pivot table
+        """
+        paths = self.args.merge
+        first = PartialPivot.load(paths[0])
+        pivot = first.pivot
+        aggies = [Aggy.parse_aggy_string(a) for a in pivot["aggregates"]]
+        self._check_pivot_column_options(pivot["pivot_column"], aggies)
+        plan = PivotPlan(
+            aggies, pivot["pivot_rows"], pivot["pivot_column"], pivot["input_names"]
+        )
+        plan.bind(first.coltypes)
+        self._top_by_index(plan)
+
+        casttypes = first.casttypes
+        use_numpy = first.engine_name == NumpyPivotEngine.__name__
+        if use_numpy and (self.args.rollup or self.args.cube):
+            # its groups hold arrays of statistics, not accumulators to merge into subtotals
+            self.argparser.error(
+                "Partial aggregates saved by --engine numpy can't be merged with --rollup or --cube"
+            )
+        if use_numpy and np is None:
+            raise InvalidPartialAggregate(
+                f"{paths[0]} was saved by --engine numpy, so merging it needs NumPy, which isn't installed"
+            )
+        engine = first.load_engine(self._build_engine(plan, casttypes, use_numpy))
+        for path in paths[1:]:
+            partial = PartialPivot.load(path)
+            why = first.mismatch(partial)
+            if why:
+                raise InvalidPartialAggregate(
+                    f"{path} can't be merged with {paths[0]}: {why}"
+                )
+            engine.merge(
+                partial.load_engine(self._build_engine(plan, casttypes, use_numpy))
+            )
+        self._write_output(engine, plan, output)
+        if self.args.stats:
+            self._log_stats(engine, plan)
+
     def main(self):
+        if self.args.merge:
+            self._merge_partials(self.output_file)
+            return 0
+
         if self.additional_input_expected():
             self.argparser.error("You must provide an input file or piped data.")
 
@@ -303,9 +1301,7 @@ class CSVPivot(UniformReader, Props, Parser, CmkUtil):
         self.read_input()
         if self.is_empty:
             return
-        # TODO ugly access of internal variables, DRY later:
-        self._rows = self._filter_input_rows(self.i_rows, self.i_column_names)
-        self._column_names = self.i_rows.column_names
+        self._check_headers()
 
         # extract aggies
         aggies: list
@@ -315,30 +1311,27 @@ class CSVPivot(UniformReader, Props, Parser, CmkUtil):
         else:
             aggies = self.args.aggregates_list.copy()
 
-        for a in aggies:
-            self._validate_aggy_column_arguments(a, table=self.i_rows)
-
-        outtable: agate.Table
-        outtable = self.i_rows
-
-        if self.pivot_column_name:
-            # in this mode, only one aggregation is allowed. This is enforced inside run()
-            # Also, this aggregation:
-            # - is performed for each group i.e. cell of the aggregated data
-            # - aggy.title is not used and thus ignored
-            #   - TODO: warn user that title is ignored?
-            outtable = outtable.pivot(
-                key=self.pivot_row_names or None,
-                pivot=self.pivot_column_name or None,
-                aggregation=aggies[0].aggregation,
-            )
+        plan = PivotPlan(
+            aggies, self.pivot_row_names, self.pivot_column_name, self.i_column_names
+        )
+
+        cache_key = None
+        if self.args.cache_dir:
+            cache = ResultCache(self.args.cache_dir, self.args.cache_size)
+            cache_key = self._cache_key(cache, plan)
+        if cache_key and cache.fetch(cache_key, self.output_file):
+            if self.args.stats:
+                self.log_err(
+                    "The output was read from --cache-dir, so there are no stats"
+                )
+            return 0
+        if cache_key:
+            output_context = cache.store(cache_key, self.output_file)
         else:
-            # user wants multiple aggregations for rows, so this is essentially a group_by
-            for rcol in self.pivot_row_names:
-                outtable = outtable.group_by(key=rcol)
-            outtable = outtable.aggregate([(a.title, a.aggregation) for a in aggies])
+            output_context = contextlib.nullcontext(self.output_file)
 
-        outtable.to_csv(self.output_file, **self.writer_kwargs)
+        with output_context as output:
+            self._pivot(plan, output)
         return 0
 
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Times csvpivot's sum, mean, and stdev with --float against the default decimal arithmetic, and measures how far
+apart their results are
+
+    $ python -m sandbox.benchfloat
+"""
+
+import csv
+from io import StringIO
+from pathlib import Path
+import tempfile
+import time
+
+from csvmedkit.utils.csvpivot import CSVPivot
+from sandbox.benchpivot import REPEAT, SCALE, scaled_copy
+
+PATH = "examples/real/chicago-crime.csv"
+ROWS = ["Primary Type"]
+AGGS = [
+    ["sum:Latitude", "mean:Longitude", "stdev:X Coordinate"],
+    ["sum:X Coordinate", "sum:Y Coordinate"],
+]
+
+
+def csvpivot(path: str, aggs: list, *options) -> str:
+    args = ["-r", ",".join(ROWS)] + list(options)
+    for a in aggs:
+        args += ["-a", a]
+    result = StringIO()
+    CSVPivot(args + [path], result).run()
+    return result.getvalue()
+
+
+def timed(func, *args):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        output = func(*args)
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+    return best, output
+
+
+def max_relative_error(output: str, expected: str) -> float:
+    """the largest relative difference between corresponding aggregated values"""
+    worst = 0.0
+    rows = zip(csv.reader(StringIO(output)), csv.reader(StringIO(expected)))
+    next(rows)
+    for row, exp in rows:
+        for value, other in zip(row[len(ROWS) :], exp[len(ROWS) :]):
+            if value and other and float(other):
+                worst = max(worst, abs(float(value) - float(other)) / abs(float(other)))
+    return worst
+
+
+def main():
+    tmpdir = tempfile.TemporaryDirectory()
+    path = scaled_copy(PATH, Path(tmpdir.name))
+    with open(path) as f:
+        nrows = sum(1 for _ in f) - 1
+    print(f"{SCALE}x copies of {PATH}'s rows, i.e. {nrows:,} rows")
+    print(
+        f"{'aggregations':<52}{'decimal rows/s':>16}{'float rows/s':>14}{'speedup':>9}{'max rel. error':>16}"
+    )
+    for aggs in AGGS:
+        d_secs, d_out = timed(csvpivot, path, aggs)
+        f_secs, f_out = timed(csvpivot, path, aggs, "--float")
+        print(
+            f"{' '.join(aggs):<52}{nrows / d_secs:>16,.0f}{nrows / f_secs:>14,.0f}"
+            f"{d_secs / f_secs:>8.1f}x{max_relative_error(f_out, d_out):>16.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Times csvpivot against the agate-only approach it replaced, i.e. projecting the used columns into a StringIO,
+re-parsing that with agate.Table.from_csv, then group_by()/aggregate() or Table.pivot()
+
+    $ python -m sandbox.benchpivot
+"""
+
+import csv
+from io import StringIO
+from pathlib import Path
+import tempfile
+import time
+import tracemalloc
+
+from csvmedkit import agate
+from csvmedkit.cmk.aggs import Aggy
+from csvmedkit.utils.csvpivot import CSVPivot
+
+REPEAT = 2
+# each file's data rows are copied this many times, so that per-row costs outweigh startup costs
+SCALE = 10
+
+# (path, pivot rows, pivot column, aggregations)
+CASES = [
+    ("examples/real/potus-tweets.csv", ["lang"], None, ["count", "max:favorite_count"]),
+    ("examples/real/stop-frisks.csv", ["MONTH2", "DAY2"], None, ["count"]),
+    (
+        "examples/real/fed-judges-service.csv",
+        ["Court Type"],
+        "Party of Appointing President",
+        ["count"],
+    ),
+    (
+        "examples/real/white-house-salaries.csv",
+        ["president", "status"],
+        None,
+        ["mean:salary", "median:salary"],
+    ),
+    (
+        "examples/real/chicago-crime.csv",
+        ["Primary Type"],
+        None,
+        ["count:Arrest,true", "mean:Latitude"],
+    ),
+]
+
+
+def agate_pivot(path: str, rows: list, column, aggs: list) -> str:
+    aggies = [Aggy.parse_aggy_string(a) for a in aggs]
+    used = list(
+        dict.fromkeys(
+            rows
+            + ([column] if column else [])
+            + [a.column_name for a in aggies if a.column_name]
+        )
+    )
+    with open(path) as src, StringIO() as ftxt:
+        writer = csv.DictWriter(ftxt, fieldnames=used)
+        writer.writeheader()
+        for row in agate.csv.DictReader(src):
+            writer.writerow({c: row[c] for c in used})
+        ftxt.seek(0)
+        table = agate.Table.from_csv(ftxt, sniff_limit=0)
+
+    for a in aggies:
+        if a.slug == "count" and len(a._args) > 1:
+            a._args[1] = table.columns[a._args[0]].data_type.cast(a._args[1])
+    if column:
+        out = table.pivot(
+            key=rows or None, pivot=column, aggregation=aggies[0].aggregation
+        )
+    else:
+        out = table
+        for r in rows:
+            out = out.group_by(key=r)
+        out = out.aggregate([(a.title, a.aggregation) for a in aggies])
+    result = StringIO()
+    out.to_csv(result)
+    return result.getvalue()
+
+
+def csvpivot(path: str, rows: list, column, aggs: list) -> str:
+    args = ["-r", ",".join(rows)] if rows else []
+    args += ["-c", column] if column else []
+    for a in aggs:
+        args += ["-a", a]
+    result = StringIO()
+    CSVPivot(args + [path], result).run()
+    return result.getvalue()
+
+
+def measure(func, *args):
+    best = min(_timed(func, *args) for _ in range(REPEAT))
+    tracemalloc.start()
+    output = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, output
+
+
+def _timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def scaled_copy(path: str, dest: Path) -> str:
+    with open(path) as src:
+        header = src.readline()
+        body = src.read()
+    if not body.endswith("\n"):
+        body += "\n"
+    outpath = dest / Path(path).name
+    outpath.write_text(header + body * SCALE)
+    return str(outpath)
+
+
+def main():
+    tmpdir = tempfile.TemporaryDirectory()
+    print(f"{SCALE}x copies of each file's rows")
+    print(
+        f"{'file':<28}{'agate secs':>12}{'cmk secs':>10}{'speedup':>9}{'agate peak MB':>15}{'cmk peak MB':>13}  same"
+    )
+    for path, rows, column, aggs in CASES:
+        path = scaled_copy(path, Path(tmpdir.name))
+        a_secs, a_peak, a_out = measure(agate_pivot, path, rows, column, aggs)
+        c_secs, c_peak, c_out = measure(csvpivot, path, rows, column, aggs)
+        print(
+            f"{Path(path).name:<28}{a_secs:>12.3f}{c_secs:>10.3f}{a_secs / c_secs:>8.1f}x"
+            f"{a_peak / 2**20:>15.1f}{c_peak / 2**20:>13.1f}  {a_out == c_out}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -75,5 +75,5 @@ setup(
         ]
     },
     install_requires=install_requires,
-    extras_require={"dev": dev_requires},
+    extras_require={"dev": dev_requires, "numpy": ["numpy"]},
 )
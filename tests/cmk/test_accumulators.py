@@ -0,0 +1,224 @@
+from decimal import Decimal
+import pickle
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import *
+from csvmedkit.cmk.aggs import Aggregates
+
+from tests.mk import TestCase, skiptest
+
+
+def accumulate(acc: Accumulator, values) -> Accumulator:
+    for v in values:
+        acc.add(v)
+    return acc
+
+
+def accumulate_rows(acc: Accumulator, rows) -> Accumulator:
+    for row in rows:
+        acc.add(*row)
+    return acc
+
+
+class TestSameAsAgate(TestCase):
+    """each accumulator returns what its agate aggregation returns for the same column"""
+
+    def setUp(self):
+        self.values = [
+            Decimal(v) if v else None for v in ["3", "1", "", "4", "1.5", "9", "", "2"]
+        ]
+        self.table = agate.Table([[v] for v in self.values], ["x"], [agate.Number()])
+
+    def test_registry_matches_aggregates(self):
+        self.assertEqual(list(Accumulators.keys()), list(Aggregates.keys()))
+
+    def test_numeric_aggregates(self):
+        for slug in ("count", "max", "min", "mean", "median", "mode", "stdev", "sum"):
+            expected = self.table.aggregate(Aggregates[slug]("x"))
+            acc = accumulate(Accumulators[slug](), self.values)
+            self.assertEqual(acc.result(), expected, slug)
+
+    def test_stdev_large_offset_small_spread(self):
+        for strings in (
+            ["100000000000000.1", "100000000000000.2", "100000000000000.3"],
+            ["1234567.891", "1234567.892", "1234567.894"],
+        ):
+            values = [Decimal(v) for v in strings]
+            table = agate.Table([[v] for v in values], ["x"], [agate.Number()])
+            expected = table.aggregate(agate.StDev("x"))
+            acc = accumulate(StDevAccumulator(), values[:1])
+            acc.merge(accumulate(StDevAccumulator(), values[1:]))
+            self.assertEqual(str(acc.result()), str(expected))
+
+    def test_stdev_state_does_not_grow_with_rows(self):
+        values = [Decimal("12.5"), Decimal("7.25"), Decimal("3")]
+        few = accumulate(StDevAccumulator(), values)
+        many = accumulate(StDevAccumulator(), values * 10000)
+        self.assertEqual(few.to_state().keys(), many.to_state().keys())
+        # the sums gain a few digits, but no more values
+        self.assertLess(
+            len(pickle.dumps(many.to_state())), len(pickle.dumps(few.to_state())) + 16
+        )
+
+    def test_percentiles(self):
+        expected = self.table.aggregate(agate.Percentiles("x"))
+        for p in (0, 10, 25, 50, 75, 99, 100):
+            acc = accumulate(PercentileAccumulator(p), self.values)
+            self.assertEqual(acc.result(), expected[p], p)
+        self.assertEqual(
+            self.table.aggregate(Aggregates["percentile"]("x", "90")), expected[90]
+        )
+        acc = accumulate(QuartilesAccumulator(), self.values)
+        self.assertEqual(
+            acc.result(), "; ".join(str(expected[p]) for p in (25, 50, 75))
+        )
+
+    def test_approx_percentiles_are_exact_for_small_groups(self):
+        expected = self.table.aggregate(agate.Percentiles("x"))
+        for p in (0, 10, 50, 75, 100):
+            acc = accumulate(ApproxPercentileAccumulator(p), self.values)
+            self.assertEqual(acc.result(), expected[p], p)
+        acc = accumulate(ApproxMedianAccumulator(), self.values)
+        self.assertEqual(acc.result(), expected[50])
+
+    def test_count_distinct(self):
+        self.assertEqual(
+            accumulate(CountDistinctAccumulator(), self.values).result(), 6
+        )
+        self.assertEqual(
+            accumulate(ApproxCountDistinctAccumulator(), self.values).result(), 6
+        )
+
+    def test_count_distinct_equal_decimals(self):
+        values = [Decimal("1"), Decimal("1.0"), Decimal("1.00")]
+        self.assertEqual(accumulate(CountDistinctAccumulator(), values).result(), 1)
+        self.assertEqual(
+            accumulate(ApproxCountDistinctAccumulator(), values).result(), 1
+        )
+
+    def test_approx_mode_is_exact_for_few_distinct_values(self):
+        acc = accumulate(ApproxModeAccumulator(), self.values + [Decimal("9")])
+        self.assertEqual(acc.result(), Decimal("9"))
+        self.assertIsNone(ApproxModeAccumulator().result())
+
+    def test_topk(self):
+        acc = accumulate(TopKAccumulator(2), ["b", "a", None, "c", "a", "c"])
+        self.assertEqual(acc.result(), "a; c")
+
+    def test_column_pairs(self):
+        weights = [
+            Decimal(w) if w else None for w in ["1", "", "2", "3", "0", "1", "4", "2"]
+        ]
+        table = agate.Table(
+            list(zip(self.values, weights)),
+            ["x", "w"],
+            [agate.Number(), agate.Number()],
+        )
+        rows = list(zip(self.values, weights))
+        for slug, expected in (
+            ("wmean", Decimal("4")),
+            ("sumproduct", Decimal("28")),
+            ("ratio", Decimal("20.5") / 13),
+        ):
+            self.assertEqual(
+                table.aggregate(Aggregates[slug]("x", "w")), expected, slug
+            )
+            acc = accumulate_rows(Accumulators[slug](), rows)
+            self.assertEqual(acc.result(), expected, slug)
+
+    def test_column_pairs_without_weights(self):
+        self.assertIsNone(WeightedMeanAccumulator().result())
+        self.assertIsNone(RatioAccumulator().result())
+        self.assertEqual(SumProductAccumulator().result(), 0)
+
+    def test_count_rows(self):
+        acc = CountAccumulator()
+        for v in self.values:
+            acc.add()
+        self.assertEqual(acc.result(), 8)
+
+    def test_countif(self):
+        expected = self.table.aggregate(Aggregates["countif"]("x", Decimal("1"), None))
+        acc = accumulate(
+            CountIfAccumulator({Decimal("1"), None}.__contains__), self.values
+        )
+        self.assertEqual(acc.result(), expected)
+        self.assertEqual(expected, 3)
+
+    def test_count_value(self):
+        acc = accumulate(CountAccumulator(Decimal("1.5")), self.values)
+        self.assertEqual(acc.result(), 1)
+
+    def test_empty_group(self):
+        self.assertIsNone(MeanAccumulator().result())
+        self.assertIsNone(MinAccumulator().result())
+        self.assertIsNone(MedianAccumulator().result())
+        self.assertEqual(SumAccumulator().result(), 0)
+        self.assertEqual(MaxLengthAccumulator().result(), Decimal("0"))
+
+
+class TestMerge(TestCase):
+    def test_merge_is_same_as_single_pass(self):
+        values = [Decimal(v) for v in ("10", "20", "20", "35", "5", "35", "35", "7")]
+        for slug, klass in Accumulators.items():
+            if slug in ("maxlength", "topk~"):
+                continue
+            if slug == "countif":
+                klass = klass.factory([agate.Number()], [Decimal("35")])
+            rows = [(v,) for v in values]
+            if slug in ("ratio", "sumproduct", "wmean"):
+                rows = list(zip(values, reversed(values)))
+            whole = accumulate_rows(klass(), rows)
+            left = accumulate_rows(klass(), rows[:3])
+            left.merge(accumulate_rows(klass(), rows[3:]))
+            self.assertEqual(left.result(), whole.result(), slug)
+
+    def test_mode_ties_go_to_earlier_partial(self):
+        left = accumulate(ModeAccumulator(), ["a", "b"])
+        left.merge(accumulate(ModeAccumulator(), ["b", "a"]))
+        self.assertEqual(left.result(), "a")
+
+
+class TestFactory(TestCase):
+    def test_sum_timedelta_starts_from_timedelta(self):
+        acc = SumAccumulator.factory([agate.TimeDelta()], [])()
+        self.assertEqual(str(acc.result()), "0:00:00")
+
+    def test_params_are_passed_along(self):
+        acc = CountAccumulator.factory([agate.Text()], ["hi"])()
+        accumulate(acc, ["hi", "hey", "hi"])
+        self.assertEqual(acc.result(), 2)
+
+    def test_count_value_of_uncast_column_matches_raw_values(self):
+        factory = CountAccumulator.factory([Uncast(agate.Number())], [Decimal("5")])
+        acc = accumulate(factory(), ["5", "5.0", "$5", "6", "", "5"])
+        self.assertIsInstance(acc, CountIfAccumulator)
+        self.assertEqual(acc.result(), 4)
+        # each distinct raw value was cast once
+        self.assertEqual(len(acc.match.memo), 5)
+
+
+class TestValueMatcher(TestCase):
+    def test_memo_is_limited_and_not_pickled(self):
+        match = ValueMatcher(agate.Text().cast, ["a", "b"], memo_limit=2)
+        self.assertEqual([match(v) for v in "abcab"], [True, True, False, True, True])
+        self.assertEqual(match.memo, {"a": True, "b": True})
+        self.assertEqual(pickle.loads(pickle.dumps(match)).memo, {})
+
+
+class TestOrderStatistics(TestCase):
+    def test_same_as_sorted(self):
+        values = [Decimal(v) for v in ["5", "1", "1.0", "3", "2", "1.00", "4"] * 20]
+        ordered = sorted(values)
+        ranks = [0, 1, 2, 50, 70, 139]
+        found = order_statistics(values, ranks)
+        # ties are broken the same way as sorted(), e.g. "1" before "1.0"
+        self.assertEqual(
+            [str(found[r]) for r in ranks], [str(ordered[r]) for r in ranks]
+        )
+
+    def test_compact_float_values(self):
+        acc = PercentileAccumulator.factory([Float()], ["50"])()
+        accumulate(acc, [3.0, None, 1.5, 2.0])
+        self.assertEqual(acc.values.typecode, "d")
+        self.assertEqual(acc.result(), Decimal("2"))
@@ -0,0 +1,64 @@
+import datetime
+import pickle
+
+from csvmedkit import agate
+from csvmedkit.cmk.buckets import TIME_BUCKETS, TimeBucket, split_bucket
+
+from tests.mk import TestCase
+
+
+class TestSplitBucket(TestCase):
+    def test_split(self):
+        self.assertEqual(split_bucket("when@month"), ("when", "month"))
+        self.assertEqual(split_bucket("a@b@year"), ("a@b", "year"))
+
+    def test_not_a_bucket(self):
+        self.assertEqual(split_bucket("when"), ("when", None))
+        self.assertEqual(split_bucket("when@decade"), ("when@decade", None))
+        self.assertEqual(split_bucket("@year"), ("@year", None))
+
+
+class TestTimeBucket(TestCase):
+    def test_labels(self):
+        d = datetime.datetime(2020, 3, 5, 14, 30, 59)
+        self.assertEqual(
+            {unit: label(d) for unit, label in TIME_BUCKETS.items()},
+            {
+                "year": "2020",
+                "quarter": "2020-Q1",
+                "month": "2020-03",
+                "week": "2020-W10",
+                "day": "2020-03-05",
+                "hour": "2020-03-05 14:00",
+                "minute": "2020-03-05 14:30",
+            },
+        )
+
+    def test_iso_week_can_be_in_another_year(self):
+        self.assertEqual(TIME_BUCKETS["week"](datetime.date(2021, 1, 1)), "2020-W53")
+
+    def test_cast(self):
+        bucket = TimeBucket(agate.Date(), "month")
+        self.assertEqual(bucket.cast("2020-03-05"), "2020-03")
+        self.assertIsNone(bucket.cast(""))
+        with self.assertRaises(agate.CastError):
+            bucket.cast("not a date")
+
+    def test_each_distinct_value_is_parsed_once(self):
+        bucket = TimeBucket(agate.Date(), "year")
+        for _ in range(3):
+            bucket.cast("2020-03-05")
+        self.assertEqual(bucket.memo, {"2020-03-05": "2020"})
+
+    def test_memo_limit(self):
+        bucket = TimeBucket(agate.Date(), "year", memo_limit=1)
+        bucket.cast("2020-03-05")
+        self.assertEqual(bucket.cast("2021-03-05"), "2021")
+        self.assertEqual(list(bucket.memo), ["2020-03-05"])
+
+    def test_pickle(self):
+        bucket = TimeBucket(agate.Date(), "quarter")
+        bucket.cast("2020-03-05")
+        other = pickle.loads(pickle.dumps(bucket))
+        self.assertEqual(other.memo, {})
+        self.assertEqual(other.cast("2020-11-05"), "2020-Q4")
@@ -0,0 +1,74 @@
+from io import StringIO
+import os
+import tempfile
+
+from csvmedkit.cmk.cache import ResultCache, digest
+
+from tests.mk import TestCase, skiptest
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.tmpdir.name, "cache"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_input(self, text, name="input.csv"):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def store(self, key, text):
+        output = StringIO()
+        with self.cache.store(key, output) as f:
+            f.write(text)
+        return output.getvalue()
+
+    def fetched(self, key):
+        output = StringIO()
+        return output.getvalue() if self.cache.fetch(key, output) else None
+
+    def test_store_writes_through_and_fetch(self):
+        self.assertIsNone(self.fetched("k"))
+        self.assertEqual(self.store("k", "a,b\r\n1,2\n"), "a,b\r\n1,2\n")
+        self.assertEqual(self.fetched("k"), "a,b\r\n1,2\n")
+
+    def test_nothing_stored_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.cache.store("k", StringIO()) as f:
+                f.write("partial")
+                raise ValueError()
+        self.assertIsNone(self.fetched("k"))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.max_size = 25
+        self.store("a", "x" * 10)
+        self.store("b", "x" * 10)
+        os.utime(self.cache._path("a", ".csv"), ns=(0, 1))
+        os.utime(self.cache._path("b", ".csv"), ns=(0, 2))
+        self.fetched("a")
+        self.store("c", "x" * 10)
+        self.assertIsNone(self.fetched("b"))
+        self.assertEqual(self.fetched("a"), "x" * 10)
+        self.assertEqual(self.fetched("c"), "x" * 10)
+
+    def test_fingerprint_is_of_contents(self):
+        path = self.write_input("a,b\n1,2\n")
+        other = self.write_input("a,b\n1,2\n", "other.csv")
+        fingerprint = self.cache.fingerprint(path)
+        self.assertEqual(self.cache.fingerprint(other), fingerprint)
+        # the second time, it's the cached hash
+        self.assertEqual(self.cache.fingerprint(path), fingerprint)
+
+        self.write_input("a,b\n1,3\n")
+        # in case the rewrite happened within the file system's timestamp resolution
+        os.utime(path, ns=(0, 1))
+        self.assertNotEqual(self.cache.fingerprint(path), fingerprint)
+
+    def test_digest(self):
+        self.assertEqual(digest({"a": 1, "b": [2]}), digest({"b": [2], "a": 1}))
+        self.assertNotEqual(digest({"a": 1}), digest({"a": "1"}))
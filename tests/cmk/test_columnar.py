@@ -0,0 +1,96 @@
+from decimal import Decimal
+import unittest
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import Accumulators
+from csvmedkit.cmk.columnar import NumpyPivotEngine, np, numpy_supports
+from csvmedkit.cmk.engine import PivotEngine
+from csvmedkit.cmk.floats import Float
+
+from tests.mk import TestCase, skiptest
+
+ROWS = [
+    ["a", "x", "3"],
+    ["b", "y", "1.5"],
+    ["a", "x", ""],
+    ["a", "y", "4"],
+    ["b", "y", "2.5"],
+    ["b", "x", "n/a"],
+    ["c", "x", ""],
+    ["a", "x", "9"],
+    ["a", "y", "5"],
+]
+
+SLUGS = ["count", "count", "sum", "mean", "stdev", "min", "max"]
+ARG_IDS = [[], [2], [2], [2], [2], [2], [2]]
+
+
+class TestNumpySupports(TestCase):
+    def test_numpy_supports(self):
+        self.assertTrue(numpy_supports("count", []))
+        self.assertTrue(numpy_supports("stdev", ["x"]))
+        self.assertFalse(numpy_supports("count", ["x", "1"]))
+        self.assertFalse(numpy_supports("median", ["x"]))
+
+
+@unittest.skipIf(np is None, "NumPy isn't installed")
+class TestNumpyPivotEngine(TestCase):
+    def engines(self, key_ids, chunk_size=3):
+        typed = [[k, j, Float().cast(v)] for k, j, v in ROWS]
+        numpy_engine = NumpyPivotEngine(key_ids, SLUGS, ARG_IDS, chunk_size)
+        numpy_engine.consume(typed)
+
+        decimal_rows = [
+            [k, j, None if v is None else Decimal(repr(v))] for k, j, v in typed
+        ]
+        engine = PivotEngine(key_ids, [Accumulators[s] for s in SLUGS], ARG_IDS)
+        engine.consume(decimal_rows)
+        return numpy_engine, engine
+
+    def assertRowsAlmostEqual(self, rows, expected_rows):
+        rows, expected_rows = list(rows), list(expected_rows)
+        self.assertEqual(len(rows), len(expected_rows))
+        for row, expected in zip(rows, expected_rows):
+            for value, other in zip(row, expected):
+                if isinstance(other, Decimal):
+                    self.assertAlmostEqual(float(value), float(other))
+                else:
+                    self.assertEqual(value, other)
+
+    def test_same_as_default_engine(self):
+        numpy_engine, engine = self.engines([0])
+        self.assertRowsAlmostEqual(numpy_engine.grouped_rows(), engine.grouped_rows())
+
+    def test_nested_group_order(self):
+        numpy_engine, engine = self.engines([1, 0])
+        self.assertEqual(
+            [r[:2] for r in numpy_engine.grouped_rows()],
+            [r[:2] for r in engine.grouped_rows()],
+        )
+
+    def test_stdev(self):
+        numpy_engine, _ = self.engines([0])
+        row = next(numpy_engine.grouped_rows())
+        self.assertAlmostEqual(float(row[5]), 2.6299556396765835)
+
+    def test_merge_is_same_as_single_pass(self):
+        typed = [[k, j, Float().cast(v)] for k, j, v in ROWS]
+        whole = NumpyPivotEngine([0], SLUGS, ARG_IDS)
+        whole.consume(typed)
+        merged = NumpyPivotEngine([0], SLUGS, ARG_IDS)
+        merged.consume(typed[:4])
+        rest = NumpyPivotEngine([0], SLUGS, ARG_IDS)
+        rest.consume(typed[4:])
+        merged.merge(rest)
+        self.assertRowsAlmostEqual(merged.grouped_rows(), whole.grouped_rows())
+
+    def test_state_is_restored_to_a_new_engine(self):
+        typed = [[k, j, Float().cast(v)] for k, j, v in ROWS]
+        whole = NumpyPivotEngine([0], SLUGS, ARG_IDS)
+        whole.consume(typed)
+        part = NumpyPivotEngine([0], SLUGS, ARG_IDS)
+        part.consume(typed[:4])
+        restored = NumpyPivotEngine([0], SLUGS, ARG_IDS)
+        restored.load_state(part.to_state())
+        restored.consume(typed[4:])
+        self.assertRowsAlmostEqual(restored.grouped_rows(), whole.grouped_rows())
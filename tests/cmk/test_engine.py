@@ -0,0 +1,247 @@
+import operator
+
+from csvmedkit.cmk.accumulators import (
+    CountAccumulator,
+    CountIfAccumulator,
+    SumAccumulator,
+)
+from csvmedkit.cmk.engine import (
+    PivotEngine,
+    PresortedPivotEngine,
+    cube,
+    having,
+    rollup,
+    select_top,
+)
+
+from tests.mk import TestCase, skiptest
+
+ROWS = [
+    ["female", "white", 20],
+    ["male", "asian", 20],
+    ["female", "black", 20],
+    ["male", "latino", 25],
+    ["female", "black", 25],
+    ["female", "asian", 25],
+]
+
+
+def count_engine(key_ids):
+    return PivotEngine(key_ids, [CountAccumulator], [[]])
+
+
+class TestGroupOrder(TestCase):
+    def test_single_key_first_appearance(self):
+        engine = count_engine([1])
+        engine.consume(ROWS)
+        self.assertEqual(
+            list(engine.grouped_rows()),
+            [["white", 1], ["asian", 2], ["black", 2], ["latino", 1]],
+        )
+
+    def test_multi_key_nested_like_agate_group_by(self):
+        engine = count_engine([0, 1])
+        engine.consume(ROWS)
+        self.assertEqual(
+            [r[:2] for r in engine.grouped_rows()],
+            [
+                ["female", "white"],
+                ["female", "black"],
+                ["female", "asian"],
+                ["male", "asian"],
+                ["male", "latino"],
+            ],
+        )
+
+
+class TestCrosstab(TestCase):
+    def test_basic(self):
+        engine = count_engine([1, 0])
+        engine.consume(ROWS)
+        fields, rows = engine.crosstab_rows(default_value=0)
+        self.assertEqual(fields, ["female", "male"])
+        self.assertEqual(
+            list(rows),
+            [["white", 1, 0], ["asian", 1, 1], ["black", 2, 0], ["latino", 0, 1]],
+        )
+
+    def test_no_row_keys(self):
+        engine = count_engine([1])
+        engine.consume(ROWS)
+        fields, rows = engine.crosstab_rows()
+        self.assertEqual(fields, ["white", "asian", "black", "latino"])
+        self.assertEqual(list(rows), [[1, 2, 2, 1]])
+
+
+class TestMerge(TestCase):
+    def test_merge_is_same_as_single_pass(self):
+        whole = PivotEngine([0], [SumAccumulator], [[2]])
+        whole.consume(ROWS)
+
+        part = PivotEngine([0], [SumAccumulator], [[2]])
+        part.consume(ROWS[:2])
+        rest = PivotEngine([0], [SumAccumulator], [[2]])
+        rest.consume(ROWS[2:])
+        part.merge(rest)
+
+        self.assertEqual(list(part.grouped_rows()), list(whole.grouped_rows()))
+
+    def test_state_is_restored_to_a_new_engine(self):
+        """to the factories' accumulators, with e.g. count's placeholder value intact"""
+        factories = [
+            CountAccumulator,
+            CountIfAccumulator.factory([None], ["asian", "black"]),
+        ]
+        part = PivotEngine([0], factories, [[1], [1]])
+        part.consume(ROWS[:3])
+        restored = PivotEngine([0], factories, [[1], [1]])
+        restored.load_state(part.to_state())
+        restored.consume(ROWS[3:])
+
+        whole = PivotEngine([0], factories, [[1], [1]])
+        whole.consume(ROWS)
+        self.assertEqual(list(restored.grouped_rows()), list(whole.grouped_rows()))
+
+
+class TestDictionaryEncoding(TestCase):
+    def test_keys_are_codes(self):
+        engine = count_engine([0, 1])
+        engine.consume(ROWS)
+        self.assertEqual(list(engine.groups)[:3], [(0, 0), (1, 1), (0, 2)])
+        self.assertEqual(engine.dictionaries[0], {"female": 0, "male": 1})
+        self.assertEqual(next(engine.keys()), ("female", "white"))
+
+    def test_merge_translates_codes(self):
+        engine, other = count_engine([1]), count_engine([1])
+        engine.consume(ROWS[:3])
+        other.consume(ROWS[3:])
+        engine.merge(other)
+        whole = count_engine([1])
+        whole.consume(ROWS)
+        self.assertEqual(list(engine.grouped_rows()), list(whole.grouped_rows()))
+
+    def test_values_are_held_once(self):
+        rows = [[str(i % 2), f"{i % 7}".join("ab")] for i in range(50)]
+        engine = count_engine([0, 1])
+        engine.consume(rows)
+        self.assertEqual(engine.group_count, 14)
+        self.assertEqual([len(d) for d in engine.dictionaries], [2, 7])
+        encoded, plain = engine.key_memory()
+        self.assertLess(encoded, plain)
+
+
+class TestPresorted(TestCase):
+    def setUp(self):
+        self.rows = sorted(ROWS, key=lambda r: r[0])
+
+    def test_same_as_unsorted_engine(self):
+        for key_ids in ([0], [0, 1]):
+            whole = count_engine(key_ids)
+            whole.consume(self.rows)
+            presorted = PresortedPivotEngine(key_ids, [CountAccumulator], [[]])
+            presorted.consume(self.rows)
+            self.assertEqual(list(presorted.grouped_rows()), list(whole.grouped_rows()))
+
+    def test_holds_one_group_at_a_time(self):
+        presorted = PresortedPivotEngine([0], [CountAccumulator], [[]])
+        presorted.consume(self.rows)
+        results = presorted.results()
+        self.assertEqual(next(results), (("female",), [4]))
+        self.assertEqual(list(presorted.groups), [("female",)])
+        self.assertEqual(next(results), (("male",), [2]))
+        self.assertEqual(list(presorted.groups), [("male",)])
+
+    def test_crosstab_sorted_by_row_keys(self):
+        whole = count_engine([0, 1])
+        whole.consume(self.rows)
+        presorted = PresortedPivotEngine(
+            [0, 1], [CountAccumulator], [[]], sorted_width=1
+        )
+        presorted.consume(self.rows)
+        fields, rows = presorted.crosstab_rows(0)
+        expected_fields, expected_rows = whole.crosstab_rows(0)
+        self.assertEqual(fields, expected_fields)
+        self.assertEqual(list(rows), list(expected_rows))
+
+
+class TestSelectTop(TestCase):
+    def setUp(self):
+        self.rows = [["a", 3], ["b", None], ["c", 5], ["d", 3], ["e", 1]]
+
+    def test_largest(self):
+        self.assertEqual(select_top(self.rows, 3, 1), [["c", 5], ["a", 3], ["d", 3]])
+
+    def test_smallest(self):
+        self.assertEqual(
+            select_top(self.rows, 2, 1, largest=False), [["e", 1], ["a", 3]]
+        )
+
+    def test_nulls_come_last(self):
+        self.assertEqual(select_top(self.rows, 10, 1)[-1], ["b", None])
+        self.assertEqual(select_top(self.rows, 10, 1, largest=False)[-1], ["b", None])
+
+
+class TestHaving(TestCase):
+    def setUp(self):
+        self.rows = [["a", 3, "x"], ["b", None, "y"], ["c", 5, "y"], ["d", 1, "y"]]
+
+    def test_every_condition(self):
+        conditions = [(0, operator.ge, 3), (1, operator.eq, "y")]
+        self.assertEqual(list(having(self.rows, conditions, 1)), [["c", 5, "y"]])
+
+    def test_null_never_meets_a_condition(self):
+        self.assertEqual(
+            [r[0] for r in having(self.rows, [(0, operator.ne, 3)], 1)], ["c", "d"]
+        )
+
+    def test_no_conditions(self):
+        self.assertEqual(list(having(self.rows, [], 1)), self.rows)
+
+
+class TestSubtotals(TestCase):
+    def setUp(self):
+        self.engine = PivotEngine([0, 1], [CountAccumulator, SumAccumulator], [[], [2]])
+        self.engine.consume(ROWS)
+
+    def subtotals(self, func):
+        return list(func(self.engine.items(), self.engine.factories))
+
+    def test_rollup(self):
+        self.assertEqual(
+            self.subtotals(rollup),
+            [
+                ((0, 1), ("female", "white"), [1, 20]),
+                ((0, 1), ("female", "black"), [2, 45]),
+                ((0, 1), ("female", "asian"), [1, 25]),
+                ((0,), ("female", None), [4, 90]),
+                ((0, 1), ("male", "asian"), [1, 20]),
+                ((0, 1), ("male", "latino"), [1, 25]),
+                ((0,), ("male", None), [2, 45]),
+                ((), (None, None), [6, 135]),
+            ],
+        )
+
+    def test_cube(self):
+        self.assertEqual(
+            self.subtotals(cube)[5:],
+            [
+                ((0,), ("female", None), [4, 90]),
+                ((0,), ("male", None), [2, 45]),
+                ((1,), (None, "white"), [1, 20]),
+                ((1,), (None, "black"), [2, 45]),
+                ((1,), (None, "asian"), [2, 45]),
+                ((1,), (None, "latino"), [1, 25]),
+                ((), (None, None), [6, 135]),
+            ],
+        )
+
+    def test_groups_are_left_as_they_were(self):
+        before = list(self.engine.grouped_rows())
+        self.subtotals(rollup)
+        self.subtotals(cube)
+        self.assertEqual(list(self.engine.grouped_rows()), before)
+
+    def test_no_groups(self):
+        engine = count_engine([0])
+        self.assertEqual(list(rollup(engine.items(), engine.factories)), [])
+        self.assertEqual(list(cube(engine.items(), engine.factories)), [])
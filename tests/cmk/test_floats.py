@@ -0,0 +1,95 @@
+from decimal import Decimal
+import math
+import pickle
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import *
+from csvmedkit.cmk.floats import CompensatedSum, Float, float_result
+
+from tests.mk import TestCase, skiptest
+
+
+class TestFloat(TestCase):
+    def test_cast(self):
+        f = Float()
+        self.assertEqual(f.cast("1.5"), 1.5)
+        self.assertEqual(f.cast("1,000"), 1000.0)
+        self.assertIsNone(f.cast(""))
+        self.assertIsNone(f.cast("N/A"))
+
+    def test_same_as_number_for_other_locales(self):
+        for value in ("1.500", "1,5"):
+            self.assertEqual(
+                Float(locale="de_DE").cast(value),
+                float(agate.Number(locale="de_DE").cast(value)),
+            )
+
+    def test_float_result(self):
+        self.assertEqual(str(float_result(40.0)), "40")
+        self.assertEqual(str(float_result(0.1 + 0.2)), "0.30000000000000004")
+
+
+class TestCompensatedSum(TestCase):
+    def test_no_error_where_naive_sum_has_some(self):
+        values = [0.1] * 10
+        total = CompensatedSum()
+        for v in values:
+            total.add(v)
+        self.assertNotEqual(sum(values), 1.0)
+        self.assertEqual(total.value(), 1.0)
+        self.assertEqual(total.value(), math.fsum(values))
+
+    def test_big_and_small_values(self):
+        total = CompensatedSum()
+        for v in (1.0, 1e100, 1.0, -1e100):
+            total.add(v)
+        self.assertEqual(total.value(), 2.0)
+
+    def test_merge_and_pickle(self):
+        left, right = CompensatedSum(), CompensatedSum()
+        for v in (1e16, 1.0):
+            left.add(v)
+        for v in (1.0, -1e16):
+            right.add(v)
+        left.merge(pickle.loads(pickle.dumps(right)))
+        self.assertEqual(left.value(), 2.0)
+
+
+class TestFloatAccumulators(TestCase):
+    def setUp(self):
+        self.values = ["3", "1", "", "4", "1.5", "9", "", "2"]
+
+    def accumulated(self, slug, column_type):
+        acc = Accumulators[slug].factory([column_type], [])()
+        for v in self.values:
+            acc.add(column_type.cast(v))
+        return acc
+
+    def test_same_as_decimal(self):
+        for slug in ("sum", "mean", "stdev"):
+            acc = self.accumulated(slug, Float())
+            self.assertIn("Float", type(acc).__name__)
+            self.assertIsInstance(acc.result(), Decimal)
+            self.assertAlmostEqual(
+                float(acc.result()),
+                float(self.accumulated(slug, agate.Number()).result()),
+                places=12,
+            )
+
+    def test_merge_is_same_as_single_pass(self):
+        for slug in ("sum", "mean", "stdev"):
+            whole = self.accumulated(slug, Float())
+            factory = Accumulators[slug].factory([Float()], [])
+            left, right = factory(), factory()
+            for v in self.values[:3]:
+                left.add(Float().cast(v))
+            for v in self.values[3:]:
+                right.add(Float().cast(v))
+            left.merge(right)
+            self.assertAlmostEqual(
+                float(left.result()), float(whole.result()), places=12
+            )
+
+    def test_stdev_of_fewer_than_two_values(self):
+        self.values = ["", "3"]
+        self.assertIsNone(self.accumulated("stdev", Float()).result())
@@ -79,3 +79,20 @@ class TestParseDelims(TestCase):
             "",
             "",
         ]
+
+
+class TestParseMemorySize(TestCase):
+    def test_units(self):
+        self.assertEqual(cmk_parse_memory_size("1024"), 1024)
+        self.assertEqual(cmk_parse_memory_size("500K"), 500 * 1024)
+        self.assertEqual(cmk_parse_memory_size("2g"), 2 * 1024 ** 3)
+        self.assertEqual(cmk_parse_memory_size("1.5GB"), 3 * 1024 ** 3 // 2)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            cmk_parse_memory_size("lots")
+
+    def test_format(self):
+        self.assertEqual(cmk_format_memory_size(1000), "1000")
+        self.assertEqual(cmk_format_memory_size(1536), "1.5K")
+        self.assertEqual(cmk_format_memory_size(3 * 1024 ** 3), "3.0G")
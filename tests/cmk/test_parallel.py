@@ -0,0 +1,69 @@
+import csv
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import CountAccumulator
+from csvmedkit.cmk.engine import PivotEngine
+from csvmedkit.cmk.parallel import (
+    aggregate_range,
+    data_offset,
+    map_shards,
+    read_range,
+    record_ranges,
+)
+
+from tests.mk import TestCase, skiptest
+
+
+class TestRecordRanges(TestCase):
+    """ranges must never split a record, even one with newlines inside quoted fields"""
+
+    path = "examples/tweets-newlines.csv"
+
+    def setUp(self):
+        with open(self.path) as src:
+            self.rows = list(csv.reader(src))[1:]
+        self.start = data_offset(self.path, 0, True, '"')
+
+    def test_ranges_cover_the_data(self):
+        for count in (1, 2, 3, 7, 50):
+            ranges = record_ranges(self.path, self.start, count)
+            self.assertLessEqual(len(ranges), count)
+            self.assertEqual(ranges[0][0], self.start)
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+
+    def test_ranges_parse_to_the_same_rows(self):
+        for count in (1, 2, 3, 7, 50):
+            rows = []
+            for r in record_ranges(self.path, self.start, count):
+                rows.extend(read_range(self.path, r, "utf-8", {}))
+            self.assertEqual(rows, self.rows, count)
+
+    def test_header_offset(self):
+        with open(self.path, "rb") as src:
+            src.readline()
+            self.assertEqual(self.start, src.tell())
+
+
+class TestMapShards(TestCase):
+    path = "examples/peeps2.csv"
+
+    def test_in_process_engines_are_copies(self):
+        start = data_offset(self.path, 0, True, '"')
+        shards = [(self.path, r) for r in record_ranges(self.path, start, 2)]
+        engine = PivotEngine([0], [CountAccumulator], [[]])
+        engines = map_shards(
+            aggregate_range,
+            shards,
+            1,
+            encoding="utf-8",
+            reader_kwargs={},
+            column_ids=[2],
+            coltypes=[agate.Text()],
+            engine=engine,
+        )
+        self.assertEqual(len(engines), 2)
+        self.assertEqual(engine.groups, {})
+        for e in engines:
+            engine.merge(e)
+        self.assertEqual(list(engine.grouped_rows()), [["female", 4], ["male", 2]])
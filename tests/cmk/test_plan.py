@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import CountAccumulator, SumAccumulator
+from csvmedkit.cmk.aggs import Aggy
+from csvmedkit.cmk.plan import PivotPlan
+from csvmedkit.exceptions import ColumnNameError
+
+from tests.mk import TestCase, skiptest
+
+INPUT_NAMES = ["id", "name", "gender", "age"]
+
+
+def plan(*aggs, rows=["gender"], column=None):
+    aggies = [Aggy.parse_aggy_string(a) for a in aggs]
+    return PivotPlan(aggies, rows, column, INPUT_NAMES)
+
+
+class TestPivotPlan(TestCase):
+    def test_resolves_column_indexes(self):
+        p = plan("count", "sum:age", "count:gender,female", column="name")
+        self.assertEqual(p.column_names, ["gender", "name", "age"])
+        self.assertEqual(p.input_ids, [2, 1, 3])
+        self.assertEqual(p.key_ids, [0, 1])
+        self.assertEqual(p.arg_ids, [[], [2], [0]])
+        self.assertEqual(
+            [a.title for a in p.aggs],
+            ["count_of", "sum_of_age", "count_of_gender_female"],
+        )
+
+    def test_invalid_column_name(self):
+        with self.assertRaises(ColumnNameError):
+            plan("sum:height")
+
+    def test_bind_casts_counted_values(self):
+        p = plan("count:age,25", "sum:age")
+        p.bind([agate.Text(), agate.Number()])
+        self.assertEqual(p.aggs[0].args, [Decimal("25")])
+        self.assertEqual(
+            [type(t) for t in p.output_types()], [agate.Number, agate.Number]
+        )
+        counter, summer = [f() for f in p.factories(p.column_types)]
+        self.assertIsInstance(counter, CountAccumulator)
+        self.assertIsInstance(summer, SumAccumulator)
+
+    def test_bind_validates_aggregations(self):
+        with self.assertRaises(agate.DataTypeError):
+            plan("sum:name", rows=["gender"]).bind([agate.Text(), agate.Text()])
+        with self.assertRaises(agate.CastError):
+            plan("count:age,twenty").bind([agate.Text(), agate.Number()])
+
+    def test_time_bucket_keys(self):
+        p = plan("count", rows=["name", "age@year"])
+        self.assertEqual(p.column_names, ["name", "age@year"])
+        self.assertEqual(p.input_ids, [1, 3])
+        self.assertEqual(p.buckets, {1: "year"})
+        p.bind([agate.Text(), agate.Date()])
+        self.assertEqual([type(t) for t in p.key_types()], [agate.Text, agate.Text])
+        self.assertEqual(p.bucketed(p.column_types)[1].cast("2020-03-05"), "2020")
+        with self.assertRaises(agate.DataTypeError):
+            p.bind([agate.Text(), agate.Number()])
+
+    def test_aggregation_of_two_columns(self):
+        p = plan("wmean:age,id", "sum:age")
+        self.assertEqual(p.column_names, ["gender", "age", "id"])
+        self.assertEqual(p.input_ids, [2, 3, 0])
+        self.assertEqual(p.arg_ids, [[1, 2], [1]])
+        self.assertEqual(p.aggs[0].agg_args, ["age", "id"])
+        self.assertEqual(p.aggs[0].title, "wmean_of_age_id")
@@ -0,0 +1,129 @@
+import bisect
+import collections
+import random
+
+from csvmedkit.cmk.sketches import HyperLogLog, KLLSketch, SpaceSaving
+
+from tests.mk import TestCase, skiptest
+
+
+class TestKLLSketch(TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.values = [rng.gauss(0, 1) for _ in range(50000)]
+        self.ordered = sorted(self.values)
+
+    def rank_of(self, value) -> float:
+        return bisect.bisect_left(self.ordered, value) / len(self.ordered)
+
+    def sketch(self, values, size=200) -> KLLSketch:
+        sk = KLLSketch(size)
+        for v in values:
+            sk.add(v)
+        return sk
+
+    def test_small_input_is_exact(self):
+        sk = self.sketch([3, 1, 2])
+        self.assertTrue(sk.is_exact)
+        self.assertEqual(sk.quantile(0.5), 2)
+
+    def test_empty(self):
+        self.assertIsNone(KLLSketch().quantile(0.5))
+
+    def test_memory_is_bounded(self):
+        sk = self.sketch(self.values)
+        self.assertEqual(sk.count, len(self.values))
+        self.assertFalse(sk.is_exact)
+        self.assertLess(sum(len(lv) for lv in sk.levels), 3 * 200 + 20)
+
+    def test_rank_error(self):
+        sk = self.sketch(self.values)
+        for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+            self.assertAlmostEqual(self.rank_of(sk.quantile(q)), q, delta=0.01)
+
+    def test_merged_rank_error(self):
+        merged = self.sketch(self.values[:1000])
+        for i in range(1000, len(self.values), 7000):
+            merged.merge(self.sketch(self.values[i : i + 7000]))
+        self.assertEqual(merged.count, len(self.values))
+        for q in (0.01, 0.5, 0.99):
+            self.assertAlmostEqual(self.rank_of(merged.quantile(q)), q, delta=0.01)
+
+    def test_deterministic(self):
+        a = self.sketch(self.values)
+        b = self.sketch(self.values)
+        self.assertEqual(a.levels, b.levels)
+
+
+class TestHyperLogLog(TestCase):
+    def counter(self, values, precision=12) -> HyperLogLog:
+        hll = HyperLogLog(precision)
+        for v in values:
+            hll.add(v)
+        return hll
+
+    def test_small_counts_are_near_exact(self):
+        self.assertEqual(self.counter([]).estimate(), 0)
+        self.assertEqual(self.counter(["a", "b", "a"]).estimate(), 2)
+
+    def test_memory_is_fixed(self):
+        hll = self.counter(f"user{i}" for i in range(20000))
+        self.assertEqual(len(hll.registers), 4096)
+
+    def test_error(self):
+        for n in (1000, 20000):
+            estimate = self.counter(f"user{i}" for i in range(n)).estimate()
+            self.assertAlmostEqual(estimate / n, 1, delta=0.05)
+
+    def test_merge_is_same_as_single_pass(self):
+        whole = self.counter(f"user{i % 7000}" for i in range(20000))
+        merged = self.counter(f"user{i % 7000}" for i in range(10000))
+        merged.merge(self.counter(f"user{i % 7000}" for i in range(10000, 20000)))
+        self.assertEqual(merged.registers, whole.registers)
+
+
+class TestSpaceSaving(TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        # a few heavy hitters, in a long tail of values that mostly appear once
+        self.values = [
+            rng.choice("abcde") if rng.random() < 0.3 else rng.randrange(10**6)
+            for _ in range(50000)
+        ]
+        self.true_counts = collections.Counter(self.values)
+
+    def summary(self, values, counters=50) -> SpaceSaving:
+        ss = SpaceSaving(counters)
+        for v in values:
+            ss.add(v)
+        return ss
+
+    def test_exact_when_few_distinct_values(self):
+        ss = self.summary(["x", "y", "y", "z", "x"])
+        self.assertTrue(ss.is_exact)
+        self.assertEqual(ss.top(2), [("x", 2), ("y", 2)])
+
+    def test_memory_is_bounded(self):
+        ss = self.summary(self.values)
+        self.assertFalse(ss.is_exact)
+        self.assertLessEqual(len(ss.counts), 100)
+
+    def test_counts_bound_true_counts(self):
+        ss = self.summary(self.values)
+        for value, count in ss.counts.items():
+            true_count = self.true_counts[value]
+            self.assertLessEqual(count - ss.errors[value], true_count)
+            self.assertGreaterEqual(count, true_count)
+
+    def test_heavy_hitters(self):
+        ss = self.summary(self.values)
+        expected = [v for v, _ in self.true_counts.most_common(5)]
+        self.assertEqual([v for v, _ in ss.top(5)], expected)
+
+    def test_merged_heavy_hitters(self):
+        merged = self.summary(self.values[:20000])
+        merged.merge(self.summary(self.values[20000:]))
+        expected = [v for v, _ in self.true_counts.most_common(5)]
+        self.assertEqual([v for v, _ in merged.top(5)], expected)
+        for value, count in merged.counts.items():
+            self.assertGreaterEqual(count, self.true_counts[value])
@@ -0,0 +1,78 @@
+from decimal import Decimal
+import tracemalloc
+
+from csvmedkit.cmk.accumulators import CountAccumulator, MedianAccumulator
+from csvmedkit.cmk.engine import PivotEngine
+from csvmedkit.cmk.spill import SpillingPivotEngine, estimate_size
+
+from tests.mk import TestCase, skiptest
+
+ROWS = [
+    [f"k{i % 7}", f"j{i % 5}", f"p{i % 3}", Decimal(i % 11)] for i in range(500)
+] + [["new", "j0", "p0", Decimal(1)]]
+
+
+def engines(key_ids):
+    args = ([CountAccumulator, MedianAccumulator], [[], [3]])
+    whole = PivotEngine(key_ids, *args)
+    spilling = SpillingPivotEngine(key_ids, *args, max_memory=1, check_interval=40)
+    whole.consume(ROWS)
+    spilling.consume(ROWS)
+    return whole, spilling
+
+
+class TestSpillingPivotEngine(TestCase):
+    def test_grouped_rows_same_as_in_memory(self):
+        for key_ids in ([0], [1, 0], [0, 1, 2]):
+            whole, spilling = engines(key_ids)
+            self.assertGreater(spilling.spill_count, 1)
+            self.assertEqual(
+                list(spilling.grouped_rows()), list(whole.grouped_rows()), key_ids
+            )
+
+    def test_crosstab_same_as_in_memory(self):
+        for key_ids in ([2], [0, 2], [1, 0, 2]):
+            whole, spilling = engines(key_ids)
+            fields, rows = whole.crosstab_rows(0)
+            spilled_fields, spilled_rows = spilling.crosstab_rows(0)
+            self.assertEqual(spilled_fields, fields)
+            self.assertEqual(list(spilled_rows), list(rows))
+
+    def test_no_spill_under_budget(self):
+        spilling = SpillingPivotEngine(
+            [0], [CountAccumulator], [[]], max_memory=1 << 30, check_interval=40
+        )
+        spilling.consume(ROWS)
+        self.assertEqual(spilling.spill_count, 0)
+        self.assertEqual(list(spilling.grouped_rows())[0], ["k0", 72])
+
+    def test_memory_bounded_with_distinct_keys(self):
+        """every key value is distinct, so none of them should stay in memory once their groups are spilled"""
+        budget = 1 << 17
+        spilling = SpillingPivotEngine(
+            [0, 1], [CountAccumulator], [[]], max_memory=budget, check_interval=250
+        )
+        rows = ([f"id{i}", f"zip{i}"] for i in range(10000))
+        tracemalloc.start()
+        try:
+            spilling.consume(rows)
+            resident, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(spilling.spill_count, 1)
+        self.assertLess(resident, budget)
+        self.assertEqual(len(list(spilling.grouped_rows())), 10000)
+
+
+class TestEstimateSize(TestCase):
+    def test_grows_with_contents(self):
+        small = estimate_size([Decimal(1)] * 10)
+        big = estimate_size([Decimal(1)] * 10000)
+        self.assertGreater(big, 500 * small)
+
+    def test_objects(self):
+        acc = MedianAccumulator()
+        empty = estimate_size(acc)
+        for i in range(1000):
+            acc.add(Decimal(i))
+        self.assertGreater(estimate_size(acc), empty + 1000 * 8)
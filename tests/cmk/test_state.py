@@ -0,0 +1,169 @@
+import datetime
+import os
+import pickle
+import tempfile
+import zlib
+
+from csvmedkit import agate
+from csvmedkit.cmk.accumulators import SumAccumulator
+from csvmedkit.cmk.engine import PivotEngine
+from csvmedkit.cmk.floats import Float
+from csvmedkit.cmk.state import (
+    PARTIAL_MAGIC,
+    PartialPivot,
+    PivotState,
+    last_record_end,
+    prefix_check,
+    save_state,
+)
+
+from csvmedkit.exceptions import InvalidPartialAggregate
+
+from tests.mk import TestCase, skiptest
+
+
+class TestPivotState(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "input.csv")
+        self.write("a,b\n1,2\n3,4\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, text, mode="w"):
+        with open(self.path, mode) as f:
+            f.write(text)
+
+    def state(self, offset=12, coltypes=()):
+        engine = PivotEngine([0], [], [])
+        return PivotState(
+            "spec",
+            list(coltypes),
+            list(coltypes),
+            engine,
+            offset,
+            prefix_check(self.path, offset),
+        )
+
+    def test_last_record_end(self):
+        self.assertEqual(last_record_end(self.path, 0), 12)
+        self.write("5,", mode="a")
+        self.assertEqual(last_record_end(self.path, 0), 12)
+        self.assertEqual(last_record_end(self.path, 12), 12)
+
+    def test_save_and_load(self):
+        statepath = os.path.join(self.tmpdir.name, "pivot.state")
+        self.assertIsNone(PivotState.load(statepath))
+        save_state(statepath, self.state().dumps())
+        state = PivotState.load(statepath)
+        self.assertEqual(state.offset, 12)
+        self.assertEqual(state.spec, "spec")
+
+    def test_unreadable(self):
+        """ValueError, with the reason, rather than None, which is only for a missing file"""
+        statepath = os.path.join(self.tmpdir.name, "pivot.state")
+        for payload, reason in (
+            (b"not a pickle", "can't be read"),
+            (self.state().dumps()[:-8], "can't be read"),
+            (pickle.dumps(self.state()), "can't be read"),
+            (pickle.dumps((1, vars(self.state()))), "different version"),
+            (pickle.dumps(["a", "list"]), "isn't a state file"),
+        ):
+            save_state(statepath, payload)
+            with self.assertRaises(ValueError) as cm:
+                PivotState.load(statepath)
+            self.assertIn(reason, str(cm.exception))
+
+    def test_types_are_saved_by_their_options(self):
+        coltypes = [agate.Number(locale="de_DE"), agate.Date(date_format="%Y.%d.%m")]
+        data = self.state(coltypes=coltypes).dumps()
+        # i.e. not the types' babel locales
+        self.assertLess(len(data), 2000)
+        statepath = os.path.join(self.tmpdir.name, "pivot.state")
+        save_state(statepath, data)
+        state = PivotState.load(statepath)
+        for types in (state.coltypes, state.casttypes):
+            self.assertEqual(str(types[0].locale), "de_DE")
+            self.assertEqual(types[1].cast("2020.13.01"), datetime.date(2020, 1, 13))
+
+    def test_mismatch(self):
+        state = self.state()
+        self.assertIsNone(state.mismatch("spec", self.path))
+
+        self.write("5,6\n", mode="a")
+        self.assertIsNone(state.mismatch("spec", self.path))
+        self.assertIn("different options", state.mismatch("other", self.path))
+
+        self.write("a,b\n1,2\n9,4\n5,6\n")
+        self.assertIn("changed", state.mismatch("spec", self.path))
+
+        self.write("a,b\n")
+        self.assertIn("smaller", state.mismatch("spec", self.path))
+
+
+class TestPartialPivot(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "out.cmkagg")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def partial(self, rows, casttype=agate.Number()):
+        engine = PivotEngine([0], [SumAccumulator], [[1]])
+        engine.consume(rows)
+        pivot = {"pivot_rows": ["a"], "aggregates": ["sum:b"]}
+        return PartialPivot(
+            pivot, [agate.Text(), agate.Number()], [agate.Text(), casttype], engine
+        )
+
+    def test_save_and_load(self):
+        save_state(self.path, self.partial([["x", 1], ["y", 2]]).dumps())
+        partial = PartialPivot.load(self.path)
+        engine = partial.load_engine(PivotEngine([0], [SumAccumulator], [[1]]))
+        self.assertEqual(list(engine.grouped_rows()), [["x", 1], ["y", 2]])
+        self.assertEqual(
+            [type(t) for t in partial.coltypes], [agate.Text, agate.Number]
+        )
+        self.assertIsNone(partial.mismatch(self.partial([])))
+
+    def test_not_a_partial(self):
+        with open(self.path, "w") as f:
+            f.write("a,b\n")
+        with self.assertRaises(InvalidPartialAggregate):
+            PartialPivot.load(self.path)
+
+    def test_tampered(self):
+        """a file can't make --merge call anything, e.g. os.system"""
+
+        class Exploit(object):
+            def __reduce__(self):
+                return os.system, ("echo pwned",)
+
+        data = self.partial([["x", 1]]).dumps()
+        header = data[: len(PARTIAL_MAGIC) + 1]
+        for payload in (
+            pickle.dumps(Exploit()),
+            pickle.dumps({"pivot": Exploit()}),
+            b"not a pickle",
+        ):
+            with open(self.path, "wb") as f:
+                f.write(header + zlib.compress(payload))
+            with self.assertRaises(InvalidPartialAggregate):
+                PartialPivot.load(self.path)
+
+    def test_mismatch(self):
+        partial = self.partial([])
+        other = self.partial([])
+        other.pivot = {**partial.pivot, "aggregates": ["mean:b"]}
+        self.assertIn("different columns or aggregations", partial.mismatch(other))
+        self.assertIn(
+            "different types", partial.mismatch(self.partial([], casttype=Float()))
+        )
+        self.assertIn(
+            "different options",
+            partial.mismatch(
+                self.partial([], casttype=agate.Number(null_values=["-"]))
+            ),
+        )
@@ -2,17 +2,24 @@
 # from subprocess import Popen, PIPE
 import contextlib
 from io import StringIO
+import os
 import sys
+import tempfile
+import unittest
 import warnings
 
 from csvmedkit.exceptions import (
     ColumnIdentifierError,
     ColumnNameError,
+    InvalidAggregationArgument,
     MissingAggregationArgument,
     InvalidAggregateName,
+    InvalidPartialAggregate,
+    MismatchedHeaders,
 )
 from csvmedkit.utils.csvpivot import CSVPivot, Parser, launch_new_instance
 from csvmedkit.cmk.aggs import Aggy, Aggregates
+from csvmedkit.cmk.columnar import np
 
 
 from tests.mk import (
@@ -271,6 +278,58 @@ class TestCountTypeCast(TestCSVPivot):
             str(e.exception),
         )
 
+    def test_countif_typecasts_every_value(self):
+        self.assertLines(
+            [
+                "-a",
+                "countif:when,1950-01-01,2010-06-15",
+                "-r",
+                "where",
+                "examples/pdates.csv",
+            ],
+            [
+                "where,countif_of_when_1950_01_01_2010_06_15",
+                "TX,2",
+                "CA,2",
+                "NY,0",
+            ],
+        )
+
+    def test_count_value_same_whether_or_not_column_is_cast(self):
+        """age is cast when it's also summed, but not when it's only counted by value"""
+        self.assertLines(
+            [
+                "-a",
+                "countif:age,25,30",
+                "-a",
+                "count:age,20",
+                "-r",
+                "gender",
+                "examples/peeps.csv",
+            ],
+            [
+                "gender,countif_of_age_25_30,count_of_age_20",
+                "female,2,2",
+                "male,1,1",
+            ],
+        )
+        self.assertLines(
+            [
+                "-a",
+                "countif:age,25,30",
+                "-a",
+                "sum:age",
+                "-r",
+                "gender",
+                "examples/peeps.csv",
+            ],
+            [
+                "gender,countif_of_age_25_30,sum_of_age",
+                "female,2,90",
+                "male,1,45",
+            ],
+        )
+
 
 class TestNonCountAggregates(TestCSVPivot):
     """basic sanity check on all available aggs"""
@@ -362,6 +421,83 @@ class TestNonCountAggregates(TestCSVPivot):
         )
 
 
+class TestApproxAggregates(TestCSVPivot):
+    """small groups fit in the sketch, so their results are exact"""
+
+    def test_agg_median_approx(self):
+        self.assertRows(
+            ["-r", "gender", "-a", "median~:age", "examples/peeps2.csv"],
+            [
+                ["gender", "median_approx_of_age"],
+                ["female", "40"],
+                ["male", "40"],
+            ],
+        )
+
+    def test_agg_percentile_approx(self):
+        self.assertRows(
+            ["-r", "gender", "-a", "percentile~:age,90,50", "examples/peeps2.csv"],
+            [
+                ["gender", "percentile_approx_of_age_90_50"],
+                ["female", "60"],
+                ["male", "50"],
+            ],
+        )
+
+    def test_agg_countdistinct(self):
+        self.assertRows(
+            [
+                "-r",
+                "gender",
+                "-a",
+                "countdistinct:race",
+                "-a",
+                "countdistinct~:race",
+                "examples/peeps2.csv",
+            ],
+            [
+                ["gender", "countdistinct_of_race", "countdistinct_approx_of_race"],
+                ["female", "3", "3"],
+                ["male", "2", "2"],
+            ],
+        )
+
+    def test_agg_mode_approx_of_text(self):
+        self.assertRows(
+            [
+                "-r",
+                "gender",
+                "-a",
+                "mode~:race",
+                "-a",
+                "topk~:race,2",
+                "examples/peeps2.csv",
+            ],
+            [
+                ["gender", "mode_approx_of_race", "topk_approx_of_race_2"],
+                ["female", "black", "black; white"],
+                ["male", "asian", "asian; latino"],
+            ],
+        )
+
+    def test_topk_requires_k(self):
+        with self.assertRaises(MissingAggregationArgument):
+            self.get_output(["-r", "gender", "-a", "topk~:race", "examples/peeps2.csv"])
+
+    def test_percentile_out_of_range(self):
+        with self.assertRaises(InvalidAggregationArgument) as e:
+            self.get_output(
+                ["-r", "gender", "-a", "percentile~:age,101", "examples/peeps2.csv"]
+            )
+        self.assertIn("Percentile must be between 0 and 100", str(e.exception))
+
+    def test_percentile_required(self):
+        with self.assertRaises(MissingAggregationArgument):
+            self.get_output(
+                ["-r", "gender", "-a", "percentile~:age", "examples/peeps2.csv"]
+            )
+
+
 class TestInferenceCompat(TestCSVPivot):
     """make sure csvpivot honors --no-inference disabling"""
 
@@ -430,6 +566,759 @@ class TestMultiAgg(TestCSVPivot):
         )
 
 
+class UnseekableStringIO(StringIO):
+    """like piped data, which can't be rewound"""
+
+    def seekable(self):
+        return False
+
+
+class TestTypeOptions(TestCSVPivot):
+    def test_infer_rows(self):
+        with stdin_as_string(StringIO("a,b\nx,1\ny,2\nx,3\n")):
+            self.assertLines(
+                ["-r", "a", "-a", "sum:b", "--infer-rows", "2"],
+                ["a,sum_of_b", "x,4", "y,2"],
+            )
+
+    def test_infer_rows_piped_input_is_not_read_twice(self):
+        with stdin_as_string(UnseekableStringIO("a,b\nx,5\ny,2\nx,3\n")):
+            self.assertLines(
+                ["-r", "a", "-a", "sum:b", "--infer-rows", "1"],
+                ["a,sum_of_b", "x,8", "y,2"],
+            )
+
+    def test_infer_rows_misses_later_values(self):
+        with stdin_as_string(StringIO("a,b\nx,1\ny,2\nx,abc\n")):
+            with self.assertRaises(agate.CastError) as e:
+                self.get_output(["-r", "a", "-a", "sum:b", "--infer-rows", "2"])
+        self.assertIn("inferred from only the first 2 rows", str(e.exception))
+
+    def test_types_override(self):
+        """age is text, so the count value isn't cast to a number"""
+        self.assertLines(
+            [
+                "-r",
+                "gender",
+                "-a",
+                "count:age,30",
+                "-a",
+                "maxlength:age",
+                "--types",
+                "age:text",
+                "examples/peeps2.csv",
+            ],
+            ["gender,count_of_age_30,maxlength_of_age", "female,1,2", "male,1,2"],
+        )
+
+    def test_types_override_with_no_inference(self):
+        self.assertLines(
+            [
+                "-r",
+                "race",
+                "-a",
+                "sum:age",
+                "-I",
+                "--types",
+                "4:number",
+                "examples/peeps2.csv",
+            ],
+            ["race,sum_of_age", "white,40", "asian,90", "black,70", "latino,50"],
+        )
+
+    def test_invalid_type_name(self):
+        ioerr = StringIO()
+        with contextlib.redirect_stderr(ioerr):
+            with self.assertRaises(SystemExit) as err:
+                self.get_output(
+                    ["-r", "race", "--types", "age:float", "examples/peeps2.csv"]
+                )
+        self.assertEqual(err.exception.code, 2)
+        self.assertIn("--types expects column:type pairs", ioerr.getvalue())
+
+
+class TestPercentiles(TestCSVPivot):
+    def test_percentile_and_quartiles(self):
+        self.assertLines(
+            [
+                "-r",
+                "gender",
+                "-a",
+                "percentile:age,50",
+                "-a",
+                "quartiles:age",
+                "examples/peeps.csv",
+            ],
+            [
+                "gender,percentile_of_age_50,quartiles_of_age",
+                "female,22.5,20; 22.5; 25",
+                "male,22.5,20; 22.5; 25",
+            ],
+        )
+
+    def test_percentile_out_of_range(self):
+        with self.assertRaises(InvalidAggregationArgument):
+            self.get_output(
+                ["-r", "gender", "-a", "percentile:age,101", "examples/peeps.csv"]
+            )
+
+
+class TestColumnPairs(TestCSVPivot):
+    def test_wmean_sumproduct_and_ratio(self):
+        self.assertLines(
+            [
+                "-r",
+                "gender",
+                "-a",
+                "wmean:age,age",
+                "-a",
+                "sumproduct:age,age",
+                "-a",
+                "ratio:age,age",
+                "examples/peeps.csv",
+            ],
+            [
+                "gender,wmean_of_age_age,sumproduct_of_age_age,ratio_of_age_age",
+                "female,22.77777777777777777777777778,2050,1",
+                "male,22.77777777777777777777777778,1025,1",
+            ],
+        )
+
+    def test_needs_two_columns(self):
+        with self.assertRaises(MissingAggregationArgument):
+            self.get_output(["-r", "gender", "-a", "wmean:age", "examples/peeps.csv"])
+
+
+class TestFloat(TestCSVPivot):
+    def test_float_is_same_as_decimal(self):
+        args = ["-r", "gender", "-a", "sum:age", "-a", "mean:age", "-a", "count:age"]
+        self.assertLines(
+            args + ["--float", "examples/peeps.csv"],
+            [
+                "gender,sum_of_age,mean_of_age,count_of_age",
+                "female,90,22.5,4",
+                "male,45,22.5,2",
+            ],
+        )
+
+    def test_float_only_for_columns_that_are_only_summed(self):
+        self.assertLines(
+            [
+                "-r",
+                "gender",
+                "-a",
+                "sum:age",
+                "-a",
+                "max:age",
+                "--float",
+                "examples/peeps.csv",
+            ],
+            [
+                "gender,sum_of_age,max_of_age",
+                "female,90,25",
+                "male,45,25",
+            ],
+        )
+
+
+class TestTimeBuckets(TestCSVPivot):
+    def test_rows_by_year(self):
+        self.assertLines(
+            ["-r", "when@year", "examples/pdates.csv"],
+            [
+                "when@year,count_of",
+                "1950,3",
+                "1999,1",
+                "2010,1",
+                "2255,1",
+                "2007,1",
+            ],
+        )
+
+    def test_column_by_index_and_bucket(self):
+        self.assertLines(
+            ["-r", "where", "-c", "2@year", "examples/pdates.csv"],
+            [
+                "where,1950,1999,2010,2255,2007",
+                "TX,1,1,1,0,0",
+                "CA,2,0,0,1,0",
+                "NY,0,0,0,0,1",
+            ],
+        )
+
+    def test_bucket_and_its_column(self):
+        self.assertLines(
+            ["-r", "where,when@quarter", "-a", "max:when", "examples/pdates.csv"],
+            [
+                "where,when@quarter,max_of_when",
+                "TX,1950-Q1,1950-01-01",
+                "TX,1999-Q4,1999-12-31",
+                "TX,2010-Q2,2010-06-15",
+                "CA,1950-Q1,1950-01-01",
+                "CA,2255-Q4,2255-11-22",
+                "NY,2007-Q3,2007-07-07",
+            ],
+        )
+
+    def test_bucket_of_non_date_column(self):
+        with self.assertRaises(agate.DataTypeError):
+            self.get_output(["-r", "where@year", "examples/pdates.csv"])
+
+    def test_time_of_day_bucket_of_date_column(self):
+        with self.assertRaises(agate.DataTypeError):
+            self.get_output(["-r", "when@hour", "examples/pdates.csv"])
+
+
+class TestLongAndFill(TestCSVPivot):
+    def test_long(self):
+        self.assertLines(
+            [
+                "-r",
+                "gender",
+                "-c",
+                "race",
+                "--long",
+                "-a",
+                "count",
+                "-a",
+                "mean:age",
+                "examples/peeps.csv",
+            ],
+            [
+                "gender,race,count_of,mean_of_age",
+                "female,white,1,20",
+                "female,black,2,22.5",
+                "female,asian,1,25",
+                "male,asian,1,20",
+                "male,latino,1,25",
+            ],
+        )
+
+    def test_fill(self):
+        self.assertLines(
+            ["-r", "gender", "-c", "race", "--fill", "n/a", "examples/peeps.csv"],
+            [
+                "gender,white,black,asian,latino",
+                "female,1,2,1,n/a",
+                "male,n/a,n/a,1,1",
+            ],
+        )
+
+    def test_fill_empty(self):
+        self.assertLines(
+            ["-r", "gender", "-c", "race", "--fill", "", "examples/peeps.csv"],
+            [
+                "gender,white,black,asian,latino",
+                "female,1,2,1,",
+                "male,,,1,1",
+            ],
+        )
+
+    def test_long_and_fill_need_pivot_column(self):
+        for args in (
+            ["--long"],
+            ["--fill", "0"],
+            ["-c", "race", "--long", "--fill", "0"],
+        ):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(StringIO()):
+                self.get_output(["-r", "gender", *args, "examples/peeps.csv"])
+
+
+class TestRollup(TestCSVPivot):
+    def test_rollup(self):
+        self.assertLines(
+            ["-r", "gender,race", "--rollup", "-a", "mean:age", "examples/peeps.csv"],
+            [
+                "gender,race,grouping,mean_of_age",
+                "female,white,gender+race,20",
+                "female,black,gender+race,22.5",
+                "female,asian,gender+race,25",
+                "female,,gender,22.5",
+                "male,asian,gender+race,20",
+                "male,latino,gender+race,25",
+                "male,,gender,22.5",
+                ",,,22.5",
+            ],
+        )
+
+    def test_cube(self):
+        self.assertLines(
+            ["-r", "gender,race", "--cube", "examples/peeps.csv"],
+            [
+                "gender,race,grouping,count_of",
+                "female,white,gender+race,1",
+                "female,black,gender+race,2",
+                "female,asian,gender+race,1",
+                "male,asian,gender+race,1",
+                "male,latino,gender+race,1",
+                "female,,gender,4",
+                "male,,gender,2",
+                ",white,race,1",
+                ",black,race,2",
+                ",asian,race,2",
+                ",latino,race,1",
+                ",,,6",
+            ],
+        )
+
+    def test_invalid_combinations(self):
+        for args in (
+            ["--rollup", "--cube"],
+            ["--rollup", "-c", "race"],
+            ["--cube", "--top", "1"],
+        ):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(StringIO()):
+                self.get_output(["-r", "gender", *args, "examples/peeps.csv"])
+
+
+class TestHaving(TestCSVPivot):
+    def test_having(self):
+        self.assertLines(
+            [
+                "-r",
+                "race",
+                "-a",
+                "count",
+                "-a",
+                "mean:age",
+                "--having",
+                "count_of >= 2",
+                "--having",
+                "mean_of_age<25",
+                "examples/peeps.csv",
+            ],
+            ["race,count_of,mean_of_age", "asian,2,22.5", "black,2,22.5"],
+        )
+
+    def test_having_before_top(self):
+        self.assertLines(
+            [
+                "-r",
+                "race",
+                "--having",
+                "count_of=1",
+                "--top",
+                "1",
+                "examples/peeps.csv",
+            ],
+            ["race,count_of", "white,1"],
+        )
+
+    def test_invalid_having(self):
+        for condition in ("count_of", "sum_of_age>1", "count_of>many"):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(StringIO()):
+                self.get_output(
+                    ["-r", "race", "--having", condition, "examples/peeps.csv"]
+                )
+
+
+class TestTop(TestCSVPivot):
+    def test_top(self):
+        self.assertLines(
+            [
+                "-r",
+                "race",
+                "-a",
+                "count",
+                "-a",
+                "sum:age",
+                "--top",
+                "2",
+                "examples/peeps.csv",
+            ],
+            [
+                "race,count_of,sum_of_age",
+                # a tie goes to the group that comes first in the whole pivot table
+                "asian,2,45",
+                "black,2,45",
+            ],
+        )
+
+    def test_bottom_by(self):
+        self.assertLines(
+            [
+                "-r",
+                "race",
+                "-a",
+                "count",
+                "-a",
+                "sum:age",
+                "--bottom",
+                "2",
+                "--by",
+                "sum_of_age",
+                "examples/peeps.csv",
+            ],
+            [
+                "race,count_of,sum_of_age",
+                "white,1,20",
+                "latino,1,25",
+            ],
+        )
+
+    def test_invalid_by(self):
+        ioerr = StringIO()
+        with contextlib.redirect_stderr(ioerr):
+            with self.assertRaises(SystemExit) as err:
+                self.get_output(
+                    [
+                        "-r",
+                        "race",
+                        "--top",
+                        "1",
+                        "--by",
+                        "sum_of_age",
+                        "examples/peeps.csv",
+                    ]
+                )
+        self.assertEqual(err.exception.code, 2)
+        self.assertIn(
+            "--by must be the title of one of the aggregations", ioerr.getvalue()
+        )
+
+    def test_top_with_pivot_column(self):
+        ioerr = StringIO()
+        with contextlib.redirect_stderr(ioerr):
+            with self.assertRaises(SystemExit):
+                self.get_output(["-c", "race", "--top", "1", "examples/peeps.csv"])
+        self.assertIn("can't be used with -c/--pivot-column", ioerr.getvalue())
+
+
+class TestInput(TestCSVPivot):
+    def test_piped_input_is_read_twice_for_inference(self):
+        with open("examples/peeps.csv") as src:
+            with stdin_as_string(UnseekableStringIO(src.read())):
+                self.assertLines(
+                    ["-r", "gender", "-a", "sum:age"],
+                    [
+                        "gender,sum_of_age",
+                        "female,90",
+                        "male,45",
+                    ],
+                )
+
+    @patch("csvmedkit.utils.csvpivot.tempfile.TemporaryFile")
+    def test_piped_input_is_not_copied_when_types_are_given(self, mock_spool):
+        """every used column's type is given by --types, so there's no inference, and no second pass"""
+        with stdin_as_string(UnseekableStringIO("a,b,c\nx,1,?\ny,2,?\nx,3,?\n")):
+            self.assertLines(
+                ["-r", "a", "-a", "sum:b", "--types", "a:text,b:number"],
+                ["a,sum_of_b", "x,4", "y,2"],
+            )
+        mock_spool.assert_not_called()
+
+    def test_pivot_row_ids_refer_to_input_columns(self):
+        self.assertLines(
+            ["-r", "3", "examples/peeps.csv"],
+            [
+                "gender,count_of",
+                "female,4",
+                "male,2",
+            ],
+        )
+
+    def test_no_header_row(self):
+        self.assertLines(
+            ["-H", "-r", "b", "examples/dummy.csv"],
+            [
+                "b,count_of",
+                "b,1",
+                "2,1",
+            ],
+        )
+
+    def test_jobs(self):
+        """multiple processes produce the same output as one"""
+        args = ["-r", "Primary Type", "-a", "count", "-a", "mean:Latitude"]
+        path = "examples/real/chicago-crime.csv"
+        self.assertEqual(
+            self.get_output(args + ["--jobs", "3", path]),
+            self.get_output(args + [path]),
+        )
+
+    def test_max_memory(self):
+        args = ["-r", "Primary Type", "-c", "Arrest", "examples/real/chicago-crime.csv"]
+        self.assertEqual(
+            self.get_output(["--max-memory", "1M"] + args),
+            self.get_output(args),
+        )
+
+    def test_numpy_engine(self):
+        """NumPy's floats give the same results as the default engine's decimals, up to rounding"""
+        args = ["-r", "gender", "-a", "sum:age", "-a", "max:age", "examples/peeps2.csv"]
+        self.assertEqual(
+            self.get_output(["--engine", "numpy"] + args),
+            self.get_output(args),
+        )
+
+    def test_cache_dir(self):
+        args = ["-r", "gender", "-a", "mean:age", "examples/peeps2.csv"]
+        expected = self.get_output(args)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cached = ["--cache-dir", cache_dir]
+            self.assertEqual(self.get_output(cached + args), expected)
+            self.assertEqual(self.get_output(cached + args), expected)
+            # the same pivot, by column index
+            self.get_output(
+                cached + ["-r", "3", "-a", "mean:age", "examples/peeps2.csv"]
+            )
+            outputs = [f for f in os.listdir(cache_dir) if f.endswith(".csv")]
+            self.assertEqual(len(outputs), 1)
+
+            self.get_output(cached + ["-r", "gender", "examples/peeps2.csv"])
+            outputs = [f for f in os.listdir(cache_dir) if f.endswith(".csv")]
+            self.assertEqual(len(outputs), 2)
+
+    def test_state(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "log.csv")
+            statepath = os.path.join(tmpdir, "pivot.state")
+            args = ["-r", "a", "-a", "sum:b", "--state", statepath, path]
+            with open(path, "w") as f:
+                f.write("a,b\nx,1\ny,2\n")
+            self.assertLines(args, ["a,sum_of_b", "x,1", "y,2"])
+
+            # the last row isn't complete, so it isn't in the saved state...
+            with open(path, "a") as f:
+                f.write("x,10\nz,")
+            self.assertLines(args, ["a,sum_of_b", "x,11", "y,2", "z,0"])
+            # ...until it is
+            with open(path, "a") as f:
+                f.write("5\n")
+            self.assertLines(args, ["a,sum_of_b", "x,11", "y,2", "z,5"])
+
+            # rows that were already aggregated have changed, so it starts over
+            with open(path, "w") as f:
+                f.write("a,b\nx,7\ny,2\nx,10\nz,5\n")
+            self.assertLines(args, ["a,sum_of_b", "x,17", "y,2", "z,5"])
+
+    def test_state_counts_values(self):
+        """count:col's accumulators count values after they're loaded, too"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "log.csv")
+            statepath = os.path.join(tmpdir, "pivot.state")
+            args = ["-r", "a", "-a", "count:b", "-a", "countif:b,5"]
+            args += ["--state", statepath, path]
+            with open(path, "w") as f:
+                f.write("a,b\nx,5\ny,\n")
+            self.assertLines(args, ["a,count_of_b,countif_of_b_5", "x,1,1", "y,0,0"])
+            with open(path, "a") as f:
+                f.write("x,7\ny,5\n")
+            self.assertLines(args, ["a,count_of_b,countif_of_b_5", "x,2,1", "y,1,1"])
+
+    def test_unreadable_state_starts_over(self):
+        """and says why"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "log.csv")
+            statepath = os.path.join(tmpdir, "pivot.state")
+            args = ["-r", "a", "-a", "sum:b", "--state", statepath, path]
+            with open(path, "w") as f:
+                f.write("a,b\nx,1\ny,2\n")
+            with open(statepath, "wb") as f:
+                f.write(b"not a state")
+            ioerr = StringIO()
+            with contextlib.redirect_stderr(ioerr):
+                self.assertLines(args, ["a,sum_of_b", "x,1", "y,2"])
+            self.assertIn("over, because it can't be read", ioerr.getvalue())
+
+    def test_state_with_time_zones(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "log.csv")
+            statepath = os.path.join(tmpdir, "pivot.state")
+            args = ["-r", "a", "-a", "max:t", "--state", statepath, path]
+            with open(path, "w") as f:
+                f.write("a,t\nab,2020-01-01T00:00:00+05:00\n")
+            self.assertLines(args, ["a,max_of_t", "ab,2020-01-01T00:00:00+05:00"])
+            with open(path, "a") as f:
+                f.write("ab,2020-01-02T00:00:00-03:30\n")
+            ioerr = StringIO()
+            with contextlib.redirect_stderr(ioerr):
+                self.assertLines(args, ["a,max_of_t", "ab,2020-01-02T00:00:00-03:30"])
+            self.assertEqual(ioerr.getvalue(), "")
+
+    def test_emit_state_and_merge(self):
+        args = ["-r", "gender", "-a", "mean:age", "-a", "countdistinct:race"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            partials = []
+            for i, rows in enumerate(
+                ("Joe,white,female,20\nJane,asian,male,20\n", "Jill,black,female,25\n")
+            ):
+                path = os.path.join(tmpdir, f"{i}.csv")
+                with open(path, "w") as f:
+                    f.write("name,race,gender,age\n" + rows)
+                partials.append(os.path.join(tmpdir, f"{i}.cmkagg"))
+                self.assertEqual(
+                    self.get_output(args + ["--emit-state", partials[-1], path]), ""
+                )
+            self.assertLines(
+                ["--merge", *partials],
+                [
+                    "gender,mean_of_age,countdistinct_of_race",
+                    "female,22.5,2",
+                    "male,20,1",
+                ],
+            )
+
+            other = os.path.join(tmpdir, "other.cmkagg")
+            self.get_output(["-r", "race", "--emit-state", other, path])
+            with self.assertRaises(InvalidPartialAggregate):
+                self.get_output(["--merge", partials[0], other])
+            for options in (
+                ["-r", "gender"],
+                ["--engine", "numpy"],
+                ["--float"],
+                ["--types", "age:text"],
+                ["--max-memory", "1M"],
+                ["--presorted"],
+            ):
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(
+                    StringIO()
+                ):
+                    self.get_output(["--merge", partials[0], *options])
+
+    @unittest.skipIf(np is None, "NumPy isn't installed")
+    def test_merge_numpy_partials_without_rollup(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            partial = os.path.join(tmpdir, "0.cmkagg")
+            self.get_output(
+                ["-r", "gender", "-a", "sum:age", "--engine", "numpy"]
+                + ["--emit-state", partial, "examples/peeps2.csv"]
+            )
+            self.assertLines(
+                ["--merge", partial], ["gender,sum_of_age", "female,170", "male,80"]
+            )
+            for option in ("--rollup", "--cube"):
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(
+                    StringIO()
+                ):
+                    self.get_output(["--merge", partial, option])
+
+    def test_merge_with_type_options(self):
+        """e.g. the date format that count's value is cast with, when the pivot is merged"""
+        args = ["-r", "a", "-a", "count:d,2020.13.01", "--date-format", "%Y.%d.%m"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            partials = []
+            for i, rows in enumerate(
+                ("x,2020.13.01\ny,2020.14.01\n", "x,2020.13.01\n")
+            ):
+                path = os.path.join(tmpdir, f"{i}.csv")
+                with open(path, "w") as f:
+                    f.write("a,d\n" + rows)
+                partials.append(os.path.join(tmpdir, f"{i}.cmkagg"))
+                self.get_output(args + ["--emit-state", partials[-1], path])
+            self.assertLines(
+                ["--merge", *partials], ["a,count_of_d_2020_01_13", "x,2", "y,0"]
+            )
+
+    def test_merge_with_time_zones(self):
+        """datetimes with UTC offsets, as min: and max: values and as keys"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for i, rows in enumerate(
+                (
+                    "ab,2020-01-01T00:00:00+05:00\nab,2020-01-02T00:00:00-03:30\n",
+                    "cd,2020-01-03T00:00:00Z\n",
+                )
+            ):
+                paths.append(os.path.join(tmpdir, f"{i}.csv"))
+                with open(paths[-1], "w") as f:
+                    f.write("a,t\n" + rows)
+            for args, expected in (
+                (
+                    ["-r", "a", "-a", "min:t", "-a", "max:t"],
+                    [
+                        "a,min_of_t,max_of_t",
+                        "ab,2020-01-01T00:00:00+05:00,2020-01-02T00:00:00-03:30",
+                        "cd,2020-01-03T00:00:00+00:00,2020-01-03T00:00:00+00:00",
+                    ],
+                ),
+                (
+                    ["-r", "t"],
+                    [
+                        "t,count_of",
+                        "2020-01-01T00:00:00+05:00,1",
+                        "2020-01-02T00:00:00-03:30,1",
+                        "2020-01-03T00:00:00+00:00,1",
+                    ],
+                ),
+            ):
+                partials = []
+                for i, path in enumerate(paths):
+                    partials.append(os.path.join(tmpdir, f"{i}.cmkagg"))
+                    self.get_output(args + ["--emit-state", partials[-1], path])
+                self.assertLines(["--merge", *partials], expected)
+
+    def test_stats(self):
+        ioerr = StringIO()
+        with contextlib.redirect_stderr(ioerr):
+            self.assertLines(
+                ["-r", "gender", "-c", "race", "--stats", "examples/peeps2.csv"],
+                [
+                    "gender,white,black,asian,latino",
+                    "female,1,2,1,0",
+                    "male,0,0,1,1",
+                ],
+            )
+        stats = ioerr.getvalue().splitlines()
+        self.assertEqual(stats[0], "Groups: 5")
+        self.assertEqual(stats[1], 'Distinct values of "gender": 2')
+        self.assertEqual(stats[2], 'Distinct values of "race": 4')
+        self.assertIn("dictionary-encoded", stats[3])
+
+    def test_multiple_files(self):
+        """the same as one file with all of their rows, in order"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for i, rows in enumerate(["x,1\ny,2\n", "", "z,3\nx,4\n"]):
+                paths.append(os.path.join(tmpdir, f"day{i}.csv"))
+                with open(paths[-1], "w") as f:
+                    f.write("a,b\n" + rows)
+            expected = ["a,sum_of_b", "x,5", "y,2", "z,3"]
+            for jobs in ("1", "2"):
+                self.assertLines(
+                    ["-r", "a", "-a", "sum:b", "-j", jobs, *paths], list(expected)
+                )
+            self.assertLines(
+                ["-r", "a", "-a", "sum:b", os.path.join(tmpdir, "day*.csv")],
+                list(expected),
+            )
+
+            with open(paths[1], "w") as f:
+                f.write("a,c\n")
+            with self.assertRaises(MismatchedHeaders):
+                self.get_output(["-r", "a", *paths])
+
+    def test_empty_files_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for i, text in enumerate(["", "a,b\nx,1\n", "", "a,b\ny,2\nx,3\n"]):
+                paths.append(os.path.join(tmpdir, f"{i}.csv"))
+                with open(paths[-1], "w") as f:
+                    f.write(text)
+            self.assertLines(
+                ["-r", "a", "-a", "sum:b", *paths], ["a,sum_of_b", "x,4", "y,2"]
+            )
+            self.assertEqual(self.get_output(["-r", "a", paths[0], paths[2]]), "")
+
+    def test_presorted(self):
+        with stdin_as_string(StringIO("a,b\n1,x\n1,x\n2,y\n2,x\n")):
+            self.assertLines(
+                ["-r", "a", "-c", "b", "--presorted"],
+                ["a,x,y", "1,2,0", "2,1,1"],
+            )
+
+    def test_short_rows_are_null_padded(self):
+        with stdin_as_string(StringIO("a,b\nx,1\ny\nx,2\n")):
+            self.assertLines(
+                ["-r", "a", "-a", "count:b"],
+                [
+                    "a,count_of_b",
+                    "x,2",
+                    "y,0",
+                ],
+            )
+
+
 ##################################
 # error situations
 ###################################
@@ -504,6 +1393,16 @@ class TestArgumentErrors(TestCSVPivot):
         self.assertEqual(err.exception.code, 2)
         self.assertIn("Only one -c/--pivot-column is allowed, not 2", ioerr.getvalue())
 
+    def test_multiple_files_cant_be_compressed(self):
+        ioerr = StringIO()
+        with contextlib.redirect_stderr(ioerr):
+            with self.assertRaises(SystemExit) as err:
+                self.get_output(
+                    ["-r", "a", "examples/dummy.csv", "examples/dummy.csv.gz"]
+                )
+        self.assertEqual(err.exception.code, 2)
+        self.assertIn("Compressed input files", ioerr.getvalue())
+
     def test_cant_have_multiple_aggs_if_pivot_column_specified(self):
         ioerr = StringIO()
         with contextlib.redirect_stderr(ioerr):